@@ -0,0 +1,74 @@
+from cache import StudyCache
+from datamodels import MarketData, MarketPanel
+from enums import FrequencyType
+from resample import SESSION_CLOSE_MINUTES, SESSION_TIMEZONE
+from typing import Union
+
+import instrumentation
+import numpy as np
+import pandas as pd
+
+# Values of a study calculated on one market data, taken on the bars of another one (another symbol or
+# another timeframe, like the daily SPY for a symbol on 5 minute bars). Every bar of the target takes the
+# value of the last bar of the source that had closed when the target bar closed, so the values of a
+# higher timeframe only become visible once their bar is over and there is no look-ahead.
+#
+# The mapping between the bars is found once for every (source, target) pair with searchsorted and
+# cached, so aligning the values of every study is a single take of their rows.
+
+# Close time of every bar of a market data (milliseconds since the epoch, UTC). Intraday bars close after
+# their length, daily bars at the close of their session, weekly bars on Friday and monthly bars on the
+# last day of the month.
+def get_close_times(market_data : Union[MarketData, MarketPanel]) -> np.ndarray:
+    timestamps = market_data.get_timestamps()
+    if (market_data.frequency_type == FrequencyType.Minute):
+        return timestamps + market_data.frequency * 60 * 1000
+    index = pd.DatetimeIndex(np.asarray(timestamps).astype("datetime64[ms]")).tz_localize("UTC").tz_convert(SESSION_TIMEZONE)
+    dates = index.tz_localize(None).as_unit("ns").asi8.astype("datetime64[ns]").astype("datetime64[D]")
+    if (market_data.frequency_type == FrequencyType.Weekly):
+        # First Friday from the date of the bar (the epoch was a Thursday)
+        days = dates.astype(np.int64)
+        dates = dates + (1 - days % 7) % 7
+    elif (market_data.frequency_type == FrequencyType.Monthly):
+        dates = (dates.astype("datetime64[M]") + 1).astype("datetime64[D]") - 1
+    closes = pd.DatetimeIndex(dates.astype("datetime64[ns]") + np.timedelta64(SESSION_CLOSE_MINUTES, "m"))
+    # The session closes during the day, where the local times are never ambiguous
+    return MarketData.index_to_timestamps(closes.tz_localize(SESSION_TIMEZONE))
+
+# Row of the source taken by every bar of the target, -1 where no source bar had closed yet
+class Alignment:
+
+    def __init__(self, source : Union[MarketData, MarketPanel], target : Union[MarketData, MarketPanel]) -> None:
+        self.positions = None # None when the source and the target have the same bars
+        if (source is not target and (source.frequency_type != target.frequency_type or source.frequency != target.frequency
+                or not np.array_equal(source.get_timestamps(), target.get_timestamps()))):
+            self.positions = np.searchsorted(get_close_times(source), get_close_times(target), side="right") - 1
+        self.missing = None if self.positions is None else self.positions < 0
+
+    def is_identity(self) -> bool:
+        return self.positions is None
+
+    # Rows of values (one per bar of the source, 1-D or 2-D) on the bars of the target, NaN before the first source bar
+    def apply(self, values : Union[pd.Series, pd.DataFrame, np.ndarray]) -> np.ndarray:
+        values = values.to_numpy(dtype=np.float64) if isinstance(values, (pd.Series, pd.DataFrame)) else np.asarray(values, dtype=np.float64)
+        if (self.positions is None):
+            return values
+        result = values.take(np.maximum(self.positions, 0), axis=0)
+        result[self.missing] = np.nan
+        return result
+
+alignment_cache = StudyCache(max_size=64)
+
+def get_alignment(source : Union[MarketData, MarketPanel], target : Union[MarketData, MarketPanel]) -> Alignment:
+    def create_alignment() -> Alignment:
+        with instrumentation.stage("alignment", getattr(target, "symbol", None), bars=len(target.get_timestamps())):
+            return Alignment(source, target)
+    if (source is target):
+        return Alignment(source, target)
+    return alignment_cache.get((source.get_key(), target.get_key()), create_alignment)
+
+# Values calculated on the bars of source, as an array on the bars of target
+def align(values : Union[pd.Series, pd.DataFrame, np.ndarray],
+          source : Union[MarketData, MarketPanel],
+          target : Union[MarketData, MarketPanel]) -> np.ndarray:
+    return get_alignment(source, target).apply(values)
@@ -0,0 +1,245 @@
+from datamodels import JSONStorage, MarketData, MarketPanel
+from enums import FrequencyType, PriceType
+from strategy import Strategy
+
+import argparse
+import gc
+import json
+import numpy as np
+import os
+import pandas as pd
+import platform
+import statistics
+import studies
+import tempfile
+import time
+import tracemalloc
+import utils
+
+# Benchmarks of every stage of a backtest (I/O, studies, expression evaluation, trade simulation, the
+# global report and the portfolio simulation) on synthetic candles, so they run offline. Results are written as JSON and can be compared
+# with the results of a previous run:
+#   python benchmarks.py --bars 1000 100000 --symbols 1 100 --output after.json --compare before.json
+
+STAGES = ["io", "studies", "panel-studies", "expression", "simulation", "global-report", "portfolio"]
+# Stages that run on a single symbol, only the number of bars changes
+SINGLE_SYMBOL_STAGES = ["studies", "expression", "simulation"]
+BAR_MILLISECONDS = {FrequencyType.Minute: 60000, FrequencyType.Daily: 86400000,
+                    FrequencyType.Weekly: 7 * 86400000, FrequencyType.Monthly: 30 * 86400000}
+
+STUDIES = {
+    "AverageTrueRange": lambda market_data, benchmark: studies.AverageTrueRange(market_data, 14),
+    "BollingerBands": lambda market_data, benchmark: studies.BollingerBands(market_data, PriceType.Close, 20, 2.0),
+    "DonchianChannels": lambda market_data, benchmark: studies.DonchianChannels(market_data, 20),
+    "ExponentialMovingAverage": lambda market_data, benchmark: studies.ExponentialMovingAverage(market_data, 20),
+    "HullMovingAverage": lambda market_data, benchmark: studies.HullMovingAverage(market_data, 20),
+    "PercentR": lambda market_data, benchmark: studies.PercentR(market_data, 14),
+    "RealRelativeStrength": lambda market_data, benchmark: studies.RealRelativeStrength(market_data, benchmark, 12),
+    "SimpleMovingAverage": lambda market_data, benchmark: studies.SimpleMovingAverage(market_data, 20),
+    "TrueRange": lambda market_data, benchmark: studies.TrueRange(market_data),
+    "WeightedMovingAverage": lambda market_data, benchmark: studies.WeightedMovingAverage(market_data, 20),
+    "WildersMovingAverage": lambda market_data, benchmark: studies.WildersMovingAverage(market_data, 20)
+}
+PANEL_STUDIES = ["AverageTrueRange", "DonchianChannels", "ExponentialMovingAverage", "SimpleMovingAverage", "WeightedMovingAverage"]
+
+def get_strategy_dict(symbols : list) -> dict:
+    return {"marketData": [{"symbol": ", ".join(symbols), "frequency": 1, "frequencyType": "Daily"}],
+            "studies": [{"id": 0, "name": "SimpleMovingAverage", "params": {"marketDataIds": [0], "length": 10, "price": "close", "displace": 0}},
+                        {"id": 1, "name": "ExponentialMovingAverage", "params": {"marketDataIds": [0], "length": 30, "price": "close", "displace": 0}},
+                        {"id": 2, "name": "PercentR", "params": {"marketDataIds": [0], "length": 14, "displace": 0}},
+                        {"id": 3, "name": "DonchianChannels", "params": {"marketDataIds": [0], "length": 20, "displace": 1}, "desiredColumn": "middle"}],
+            "opening": {"type": "BuyToOpen", "condition": "S0 $crosses-above$ S1 & S2 < 80 & S0 > S3"},
+            "closing": {"condition": "S0 $crosses-below$ S1 | S2 > 95"},
+            "initialBalance": 10000}
+
+# Random walk candles (geometric, with open, high and low around the close), the same for the same symbol and seed
+def generate_market_data(symbol : str,
+                         bars : int,
+                         frequency_type : FrequencyType = FrequencyType.Daily,
+                         frequency : int = 1,
+                         seed : int = 0) -> MarketData:
+    generator = np.random.default_rng([seed] + list(symbol.encode()))
+    close = 100 * np.exp(np.cumsum(generator.normal(0, 0.02, bars)))
+    open = close * (1 + generator.normal(0, 0.005, bars))
+    high = np.maximum(open, close) * (1 + generator.uniform(0, 0.01, bars))
+    low = np.minimum(open, close) * (1 - generator.uniform(0, 0.01, bars))
+    volume = generator.integers(1000, 1000000, bars)
+    # Bars up to now, one every frequency units of time
+    step = BAR_MILLISECONDS[frequency_type] * frequency
+    date = (int(time.time() * 1000) // step - bars + 1 + np.arange(bars, dtype=np.int64)) * step
+    return MarketData(symbol, MarketData.columns_to_dataframe(open, high, low, close, volume, date), frequency_type, frequency)
+
+def get_symbols(count : int) -> list:
+    return [f"SYN{i}" for i in range(count)]
+
+# Times a function (after calling setup, which is not timed) and measures its peak memory in a separate
+# run, since tracemalloc slows the code it traces
+def measure(function, repeat : int, setup = None) -> dict:
+    times = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": {"min": min(times), "median": statistics.median(times), "mean": statistics.mean(times)},
+            "peak-memory-bytes": peak_memory}
+
+def benchmark_io(bars : int, symbols : int, repeat : int, seed : int) -> list:
+    market_datas = [generate_market_data(symbol, bars, seed=seed) for symbol in get_symbols(symbols)]
+    path = MarketData.get_path(FrequencyType.Daily, 1)
+    results = [("save", measure(lambda: [market_data.save(path) for market_data in market_datas], repeat))]
+    # Memory-mapped columns are only read when used, so the loaded candles are summed
+    load = lambda: [utils.get_market_data(market_data.symbol, FrequencyType.Daily, 1).candles["close"].sum() for market_data in market_datas]
+    results.append(("load", measure(load, repeat)))
+    json_storage = JSONStorage()
+    for market_data in market_datas:
+        json_storage.save(market_data, path)
+    load_json = lambda: [json_storage.load(path, market_data.symbol, FrequencyType.Daily, 1) for market_data in market_datas]
+    results.append(("load-json", measure(load_json, repeat)))
+    return results
+
+def benchmark_studies(bars : int, repeat : int, seed : int) -> list:
+    market_data = generate_market_data("SYN0", bars, seed=seed)
+    benchmark = generate_market_data("SYN-BENCHMARK", bars, seed=seed)
+    results = []
+    for name, create in STUDIES.items():
+        study = create(market_data, benchmark)
+        results.append((name, measure(study.calculate, repeat, studies.study_cache.clear)))
+    return results
+
+def benchmark_panel_studies(bars : int, symbols : int, repeat : int, seed : int) -> list:
+    panel = MarketPanel.from_market_datas([generate_market_data(symbol, bars, seed=seed) for symbol in get_symbols(symbols)])
+    results = []
+    for name in PANEL_STUDIES:
+        study = STUDIES[name](panel, None)
+        results.append((name, measure(study.calculate, repeat, studies.study_cache.clear)))
+    return results
+
+def benchmark_expression(bars : int, repeat : int, seed : int) -> list:
+    strategy = __create_strategy(get_symbols(1), bars, seed)
+    return [(expression, measure(lambda: strategy.evaluate_expression(expression), repeat))
+            for expression in [strategy.opening_condition_str, strategy.closing_condition_str]]
+
+def benchmark_simulation(bars : int, repeat : int, seed : int) -> list:
+    strategy = __create_strategy(get_symbols(1), bars, seed)
+    return [("generate_single_report", measure(strategy.generate_single_report, repeat))]
+
+def benchmark_global_report(bars : int, symbols : int, repeat : int, seed : int, workers : int) -> list:
+    strategy = __create_strategy(get_symbols(symbols), bars, seed)
+    return [(f"generate_global_report(workers={workers})",
+             measure(lambda: strategy.generate_global_report(workers), repeat, studies.study_cache.clear))]
+
+def benchmark_portfolio(bars : int, symbols : int, repeat : int, seed : int) -> list:
+    strategy = __create_strategy(get_symbols(symbols), bars, seed)
+    panel = strategy.load_panel()
+    return [("simulate_portfolio", measure(lambda: strategy.simulate_portfolio(panel), repeat, studies.study_cache.clear))]
+
+# Strategy on synthetic symbols, cached first so that it loads them offline
+def __create_strategy(symbols : list, bars : int, seed : int) -> Strategy:
+    for symbol in symbols:
+        generate_market_data(symbol, bars, seed=seed).save()
+    strategy = Strategy(get_strategy_dict(symbols), get_fresh_data=False)
+    strategy.load()
+    return strategy
+
+def run(stages : list, bars_list : list, symbols_list : list, repeat : int = 3, seed : int = 0, workers : int = 1) -> dict:
+    results = []
+    # Everything written to disk (candle caches, reports) goes to a temporary directory
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for bars in bars_list:
+                for symbols in symbols_list:
+                    for stage in stages:
+                        if stage in SINGLE_SYMBOL_STAGES and symbols != symbols_list[0]:
+                            continue
+                        print(f"{stage}: {bars} bars, {symbols} symbols", flush=True)
+                        if stage == "io":
+                            cases = benchmark_io(bars, symbols, repeat, seed)
+                        elif stage == "studies":
+                            cases = benchmark_studies(bars, repeat, seed)
+                        elif stage == "panel-studies":
+                            cases = benchmark_panel_studies(bars, symbols, repeat, seed)
+                        elif stage == "expression":
+                            cases = benchmark_expression(bars, repeat, seed)
+                        elif stage == "simulation":
+                            cases = benchmark_simulation(bars, repeat, seed)
+                        elif stage == "global-report":
+                            cases = benchmark_global_report(bars, symbols, repeat, seed, workers)
+                        elif stage == "portfolio":
+                            cases = benchmark_portfolio(bars, symbols, repeat, seed)
+                        else:
+                            raise ValueError(f"Unknown stage '{stage}', the available stages are {STAGES}.")
+                        for case, measurement in cases:
+                            results.append(dict({"stage": stage,
+                                                 "case": case,
+                                                 "bars": bars,
+                                                 "symbols": 1 if stage in SINGLE_SYMBOL_STAGES else symbols},
+                                                **measurement))
+                        studies.study_cache.clear()
+        finally:
+            os.chdir(working_directory)
+    return {"environment": {"python": platform.python_version(),
+                            "numpy": np.__version__,
+                            "pandas": pd.__version__,
+                            "platform": platform.platform(),
+                            "processor": platform.processor(),
+                            "date": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+            "settings": {"stages": stages, "bars": bars_list, "symbols": symbols_list, "repeat": repeat, "seed": seed, "workers": workers},
+            "results": results}
+
+# Cases that are slower (median time) or use more memory than in the baseline by more than the threshold ratio
+def compare(baseline : dict, current : dict, threshold : float = 1.2) -> list:
+    get_id = lambda result: (result["stage"], result["case"], result["bars"], result["symbols"])
+    baseline_results = {get_id(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = baseline_results.get(get_id(result))
+        if previous is None:
+            continue
+        time_ratio = result["seconds"]["median"] / max(previous["seconds"]["median"], 1e-9)
+        memory_ratio = result["peak-memory-bytes"] / max(previous["peak-memory-bytes"], 1)
+        if time_ratio > threshold or memory_ratio > threshold:
+            regressions.append({"stage": result["stage"], "case": result["case"], "bars": result["bars"], "symbols": result["symbols"],
+                                "time-ratio": time_ratio, "memory-ratio": memory_ratio})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the backtest stages on synthetic candles.")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--bars", nargs="+", type=int, default=[1000, 100000])
+    parser.add_argument("--symbols", nargs="+", type=int, default=[1, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--output", default="benchmarks.json")
+    parser.add_argument("--compare", help="results of a previous run to look for regressions")
+    parser.add_argument("--threshold", type=float, default=1.2, help="ratio to the previous run considered a regression")
+    args = parser.parse_args()
+    results = run(args.stages, args.bars, args.symbols, args.repeat, args.seed, args.workers)
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=4)
+    for result in results["results"]:
+        print(f"{result['stage']:>14} {result['case'][:40]:<40} {result['bars']:>9} bars {result['symbols']:>5} symbols "
+              f"{result['seconds']['median'] * 1000:10.2f} ms {result['peak-memory-bytes'] / 2**20:9.1f} MiB")
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            regressions = compare(json.load(file), results, args.threshold)
+        for regression in regressions:
+            print(f"Regression in {regression['stage']} {regression['case']} ({regression['bars']} bars, {regression['symbols']} symbols): "
+                  f"{regression['time-ratio']:.2f}x time, {regression['memory-ratio']:.2f}x memory")
+        if len(regressions) > 0:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
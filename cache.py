@@ -0,0 +1,32 @@
+from collections import OrderedDict
+from typing import Callable
+
+# Least recently used cache of values calculated from market data (studies, alignments)
+class StudyCache:
+
+    def __init__(self, max_size : int = 256) -> None:
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the cached values for the key, calculating (and caching) them if they are not cached
+    def get(self, key : tuple, calculate : Callable):
+        if key in self.values:
+            self.hits += 1
+            self.values.move_to_end(key)
+            return self.values[key]
+        self.misses += 1
+        values = calculate()
+        self.values[key] = values
+        if len(self.values) > self.max_size:
+            self.values.popitem(last=False)
+        return values
+
+    def clear(self) -> None:
+        self.values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def get_stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.values), "max_size": self.max_size}
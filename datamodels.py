@@ -1,44 +1,122 @@
+import glob
+import itertools
+import json
 import numpy as np
+import operator
 import pandas as pd
 import os
 
 from datetime import datetime
 from enums import FrequencyType
+from io import StringIO
 from typing import Union
 
+import instrumentation
+
+# orjson parses the price history responses several times faster, the standard json module is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CANDLE_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+
+# Columns of the candles of a price history response (its raw bytes), with the dates as milliseconds since the epoch
+def decode_candles(content : bytes) -> dict:
+    price_history_dict = orjson.loads(content) if orjson is not None else json.loads(content)
+    return MarketData.candles_to_columns(price_history_dict["candles"])
+
+# Versions of the candles of the market data and the panels, bumped whenever they are replaced. They are never
+# reused in a process, unlike the ids of the replaced objects, so the values cached for old candles are never
+# taken for new ones (the process id tells apart the versions of market data sent to other processes).
+_versions = itertools.count()
+
+def next_version() -> tuple:
+    return (os.getpid(), next(_versions))
+
 
 class MarketData:
 
-    def __init__(self, symbol : str, candles : Union[list, pd.DataFrame], frequency_type : FrequencyType, frequency : int) -> None:
+    # The candles are a dataframe, a list of candle dictionaries (as returned by the API) or a dictionary of
+    # columns (see candles_to_columns). The dataframe of the last two is only built when it is first used.
+    def __init__(self, symbol : str, candles : Union[list, dict, pd.DataFrame], frequency_type : FrequencyType, frequency : int) -> None:
         self.symbol = symbol
-
+        self.__candles = None
+        self.__columns = None
+        self.__version = next_version()
         if (isinstance(candles, pd.DataFrame)):
-            self.candles = candles
+            self.__candles = candles
         elif(isinstance(candles, list)):
-            self.candles = self.__candles_to_dataframe(candles)
+            self.__columns = MarketData.candles_to_columns(candles)
+        elif(isinstance(candles, dict)):
+            self.__columns = candles
         self.frequency_type = frequency_type
         self.frequency = frequency
-        
-    def __candles_to_dataframe(self, candles : dict) -> pd.DataFrame:
-        length = len(candles)
-        open = np.empty(shape=length, dtype=np.float64)
-        high = np.empty(shape=length, dtype=np.float64)
-        low = np.empty(shape=length, dtype=np.float64)
-        close = np.empty(shape=length, dtype=np.float64)
-        volume = np.empty(shape=length, dtype=np.int64)
-        date = np.empty(shape=length, dtype=np.int64)
-        for i in range(length):
-            candle = candles[i]
-            open[i] = candle["open"]
-            high[i] = candle["high"]
-            low[i] = candle["low"]
-            close[i] = candle["close"]
-            volume[i] = candle["volume"]
-            date[i] =  candle["datetime"]
-        df = pd.DataFrame({"open":open, "high":high, "low":low, "close":close, "volume":volume, "datetime":date.astype("datetime64[ms]")})
-        df.set_index("datetime", inplace=True)
-        df = df.tz_localize("UTC").tz_convert("US/Pacific")
-        return df
+
+    @property
+    def candles(self) -> pd.DataFrame:
+        if (self.__candles is None):
+            self.__candles = MarketData.columns_to_dataframe(*[self.__columns[column] for column in CANDLE_COLUMNS + ["datetime"]])
+            # From now on the dataframe holds the candles, even if it is modified
+            self.__columns = None
+        return self.__candles
+
+    @candles.setter
+    def candles(self, candles : pd.DataFrame) -> None:
+        self.__candles = candles
+        self.__columns = None
+        self.__version = next_version()
+
+    # Values of a column of the candles, without building the dataframe if it has not been built yet
+    def get_column(self, column : str) -> np.ndarray:
+        if (self.__columns is not None):
+            return self.__columns[column]
+        return self.candles[column].to_numpy()
+
+    def get_length(self) -> int:
+        if (self.__columns is not None):
+            return len(self.__columns["datetime"])
+        return len(self.candles)
+
+    # Columns of a list of candle dictionaries, extracted by numpy without a Python loop over the candles
+    def candles_to_columns(candles : list) -> dict:
+        columns = {}
+        for column in CANDLE_COLUMNS + ["datetime"]:
+            dtype = np.int64 if column == "datetime" else np.float64
+            columns[column] = np.fromiter(map(operator.itemgetter(column), candles), dtype=dtype, count=len(candles))
+        columns["volume"] = columns["volume"].astype(np.int64)
+        return columns
+
+    # Builds the candles dataframe from its columns, taking the dates as milliseconds since the epoch (UTC)
+    def columns_to_dataframe(open : np.ndarray,
+                             high : np.ndarray,
+                             low : np.ndarray,
+                             close : np.ndarray,
+                             volume : np.ndarray,
+                             date : np.ndarray) -> pd.DataFrame:
+        index = pd.DatetimeIndex(np.asarray(date).astype("datetime64[ms]"), name="datetime")
+        index = index.tz_localize("UTC").tz_convert("US/Pacific")
+        # copy=False lets the columns stay backed by memory-mapped arrays
+        return pd.DataFrame({"open":open, "high":high, "low":low, "close":close, "volume":volume}, index=index, copy=False)
+
+    # Identifies the candles of this market data, used to cache values calculated from them
+    def get_key(self) -> tuple:
+        if (len(self.candles) == 0):
+            return (self.symbol, self.frequency_type, self.frequency, 0, self.__version)
+        return (self.symbol, self.frequency_type, self.frequency, len(self.candles),
+                self.candles.index[0], self.candles.index[-1], self.__version)
+
+    # Dates of the candles as milliseconds since the epoch (UTC)
+    def get_timestamps(self) -> np.ndarray:
+        if (self.__columns is not None):
+            return self.__columns["datetime"]
+        return MarketData.index_to_timestamps(self.candles.index)
+
+    def index_to_timestamps(index : pd.DatetimeIndex) -> np.ndarray:
+        if (index.tz is not None):
+            index = index.tz_convert("UTC").tz_localize(None)
+        return index.as_unit("ms").asi8
     
     def get_path(frequency_type : FrequencyType, frequency : int) -> str:
         fname = "json\\"
@@ -49,13 +127,267 @@ class MarketData:
         return fname
     
     def save_to_json(self, path : str = None):
+        self.save(path, JSONStorage())
+
+    def save(self, path : str = None, storage : "CandleStorage" = None) -> None:
         if (path is None):
             path = MarketData.get_path(self.frequency_type, self.frequency)
+        if (storage is None):
+            storage = default_storage
+        storage.save(self, path)
+
+    # Loads the cached candles of a symbol, returns None if they have not been cached
+    def load(symbol : str,
+             frequency_type : FrequencyType,
+             frequency : int,
+             path : str = None,
+             storage : "CandleStorage" = None) -> "MarketData":
+        if (path is None):
+            path = MarketData.get_path(frequency_type, frequency)
+        if (storage is None):
+            storage = default_storage
+        if (not storage.exists(path, symbol)):
+            return None
+        return storage.load(path, symbol, frequency_type, frequency)
+
+
+# Candles of several symbols on a shared time index (the union of the dates of every symbol),
+# as 2-D arrays of bars x symbols. Candles a symbol does not have are NaN and valid tells which
+# ones exist. Indexing a panel by column name returns its 2-D array, so the studies can take a
+# panel wherever they take a MarketData and calculate every symbol at once.
+class MarketPanel:
+
+    def __init__(self, symbols : list,
+                 timestamps : np.ndarray,
+                 columns : dict,
+                 frequency_type : FrequencyType,
+                 frequency : int) -> None:
+        self.symbols = list(symbols)
+        self.timestamps = np.asarray(timestamps, dtype=np.int64) # Milliseconds since the epoch (UTC)
+        self.columns = columns
+        self.frequency_type = frequency_type
+        self.frequency = frequency
+        self.version = next_version() # The columns are never replaced
+        self.valid = ~np.isnan(columns["close"])
+        # First and last valid bar of every symbol, -1 for a symbol without candles
+        has_candles = self.valid.any(axis=0)
+        self.first_index = np.where(has_candles, self.valid.argmax(axis=0), -1)
+        self.last_index = np.where(has_candles, len(self.timestamps) - 1 - self.valid[::-1].argmax(axis=0), -1)
+        # Whether some symbol has no candle on a date between its first and last ones (see pack)
+        self.has_gaps = bool(np.any(self.valid.sum(axis=0) != self.last_index - self.first_index + 1 - (~has_candles)))
+        self.packed = None
+
+    # Builds a panel from the market data of every symbol, all with the same frequency
+    def from_market_datas(market_datas : list) -> "MarketPanel":
+        if (len(market_datas) == 0):
+            raise ValueError("A panel needs at least one market data.")
+        timestamps_list = [market_data.get_timestamps() for market_data in market_datas]
+        timestamps = np.unique(np.concatenate(timestamps_list))
+        columns = {column: np.full(shape=(len(timestamps), len(market_datas)), fill_value=np.nan) for column in CANDLE_COLUMNS}
+        for j, market_data in enumerate(market_datas):
+            rows = np.searchsorted(timestamps, timestamps_list[j])
+            for column in CANDLE_COLUMNS:
+                columns[column][rows, j] = market_data.candles[column].to_numpy(dtype=np.float64)
+        return MarketPanel([market_data.symbol for market_data in market_datas],
+                           timestamps,
+                           columns,
+                           market_datas[0].frequency_type,
+                           market_datas[0].frequency)
+
+    # The panel takes the place of the candles of a MarketData
+    @property
+    def candles(self) -> "MarketPanel":
+        return self
+
+    def __getitem__(self, column : str) -> np.ndarray:
+        return self.columns[column]
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def get_index(self) -> pd.DatetimeIndex:
+        index = pd.DatetimeIndex(self.timestamps.astype("datetime64[ms]"), name="datetime")
+        return index.tz_localize("UTC").tz_convert("US/Pacific")
+
+    def get_timestamps(self) -> np.ndarray:
+        return self.timestamps
+
+    def get_key(self) -> tuple:
+        if (len(self.timestamps) == 0):
+            return ("panel", tuple(self.symbols), self.frequency_type, self.frequency, 0, self.version)
+        return ("panel", tuple(self.symbols), self.frequency_type, self.frequency, len(self.timestamps),
+                self.timestamps[0], self.timestamps[-1], self.version)
+
+    # Market data of one symbol, with the bars from its first to its last valid candle
+    def get_market_data(self, symbol : Union[str, int]) -> MarketData:
+        j = symbol if isinstance(symbol, int) else self.symbols.index(symbol)
+        rows = slice(self.first_index[j], self.last_index[j] + 1) if self.first_index[j] >= 0 else slice(0, 0)
+        volume = self.columns["volume"][rows, j]
+        candles = MarketData.columns_to_dataframe(*[self.columns[column][rows, j] for column in CANDLE_COLUMNS[:-1]],
+                                                  np.where(np.isnan(volume), 0, volume).astype(np.int64),
+                                                  self.timestamps[rows])
+        return MarketData(self.symbols[j], candles, self.frequency_type, self.frequency)
+
+    # The panel without the dates each symbol has no candle on (see PackedPanel), built once
+    def pack(self) -> "PackedPanel":
+        if (self.packed is None):
+            self.packed = PackedPanel(self)
+        return self.packed
+
+    # Values of a Series indexed by date (like a study of a MarketData) on the dates of the panel, NaN where it has no value
+    def align(self, values : pd.Series) -> np.ndarray:
+        timestamps = MarketData.index_to_timestamps(values.index)
+        result = np.full(shape=len(self.timestamps), fill_value=np.nan)
+        if (len(timestamps) == 0):
+            return result
+        positions = np.minimum(np.searchsorted(timestamps, self.timestamps), len(timestamps) - 1)
+        found = timestamps[positions] == self.timestamps
+        result[found] = values.to_numpy(dtype=np.float64)[positions[found]]
+        return result
+
+
+# Candles of a panel where those of every symbol are moved up to the first rows, one after the other without
+# the dates the symbol has no candle on. The windows of the studies calculated on it span the last candles
+# of every symbol, like on the MarketData of the symbol, instead of the last dates of the panel, and their
+# values are put back on the dates of the panel with unpack. rows is the row of the panel every candle
+# comes from, -1 after the last candle of a symbol. A packed panel has no dates of its own.
+class PackedPanel(MarketPanel):
+
+    def __init__(self, panel : MarketPanel) -> None:
+        counts = panel.valid.sum(axis=0)
+        length = int(counts.max()) if len(counts) > 0 else 0
+        # A stable sort keeps the valid rows of every symbol in their order
+        rows = np.argsort(~panel.valid, axis=0, kind="stable")[:length]
+        filled = np.arange(length)[:, None] < counts
+        self.panel = panel
+        self.rows = np.where(filled, rows, -1)
+        columns = {column: np.where(filled, np.take_along_axis(values, rows, axis=0), np.nan) for column, values in panel.columns.items()}
+        MarketPanel.__init__(self, panel.symbols, np.arange(length), columns, panel.frequency_type, panel.frequency)
+
+    def get_key(self) -> tuple:
+        return ("packed",) + self.panel.get_key()
+
+    # Rows of values on the dates of the panel (1-D, the same for every symbol, or 2-D) taken on the rows of every symbol
+    def pack_values(self, values : np.ndarray) -> np.ndarray:
+        values = values[:, None] if values.ndim == 1 else values
+        packed = np.take_along_axis(np.broadcast_to(values, (len(values), len(self.symbols))), np.maximum(self.rows, 0), axis=0)
+        return np.where(self.rows >= 0, packed, np.nan)
+
+    # Values on the dates of a Series indexed by date (like a study of a MarketData), for every symbol
+    def align(self, values : pd.Series) -> np.ndarray:
+        return self.pack_values(self.panel.align(values))
+
+    # Values calculated on the packed panel (2-D, or a dictionary of them) on the dates of the panel,
+    # fill_value where a symbol has no candle
+    def unpack(self, values : Union[np.ndarray, dict], fill_value = np.nan) -> Union[np.ndarray, dict]:
+        if (isinstance(values, dict)):
+            return {line: self.unpack(line_values, fill_value) for line, line_values in values.items()}
+        result = np.full(shape=(len(self.panel),) + values.shape[1:], fill_value=fill_value, dtype=values.dtype)
+        filled = self.rows >= 0
+        result[self.rows[filled], np.nonzero(filled)[1]] = values[filled]
+        return result
+
+
+# Backend used to cache candles on disk. Every backend keeps the files of a symbol
+# inside the directory returned by MarketData.get_path
+class CandleStorage:
+
+    def get_fname(self, path : str, symbol : str) -> str:
+        raise NotImplementedError(f"{type(self).__name__} does not implement get_fname.")
+
+    def exists(self, path : str, symbol : str) -> bool:
+        return os.path.exists(self.get_fname(path, symbol))
+
+    def save(self, market_data : MarketData, path : str) -> None:
+        raise NotImplementedError(f"{type(self).__name__} does not implement save.")
+
+    def load(self, path : str, symbol : str, frequency_type : FrequencyType, frequency : int) -> MarketData:
+        raise NotImplementedError(f"{type(self).__name__} does not implement load.")
+
+# Candles as a pretty-printed JSON file per symbol
+class JSONStorage(CandleStorage):
+
+    def get_fname(self, path : str, symbol : str) -> str:
+        return path + f"\\{symbol}.json"
+
+    def save(self, market_data : MarketData, path : str) -> None:
         if (not os.path.exists(path)):
             os.makedirs(path)
-        fname = path + f"\\{self.symbol}.json"
-        self.candles.to_json(fname, orient="index", indent=4, date_format="iso", date_unit="ms")
+        fname = self.get_fname(path, market_data.symbol)
+        with instrumentation.stage("cache-save", market_data.symbol, bars=len(market_data.candles)) as save_stage:
+            market_data.candles.to_json(fname, orient="index", indent=4, date_format="iso", date_unit="ms")
+            save_stage.add(bytes_written=os.path.getsize(fname))
+
+    def load(self, path : str, symbol : str, frequency_type : FrequencyType, frequency : int) -> MarketData:
+        with instrumentation.stage("cache-load", symbol) as load_stage:
+            with open(self.get_fname(path, symbol), "r") as file:
+                content = file.read()
+                market_data = MarketData(symbol, pd.read_json(StringIO(content), orient="index", date_unit="ms"), frequency_type, frequency)
+            market_data.candles.index = pd.to_datetime(market_data.candles.index)
+            load_stage.add(bytes_read=len(content), bars=len(market_data.candles))
+        return market_data
+
+# Candles as a directory per symbol holding one .npy file per column, plus the dates
+# as milliseconds since the epoch. Columns are memory-mapped when loaded.
+class NumpyStorage(CandleStorage):
+
+    def __init__(self, mmap_mode : str = "r") -> None:
+        self.mmap_mode = mmap_mode
+
+    def get_fname(self, path : str, symbol : str) -> str:
+        return path + f"\\{symbol}"
+
+    def exists(self, path : str, symbol : str) -> bool:
+        return os.path.isfile(self.get_fname(path, symbol) + "\\datetime.npy")
+
+    def save(self, market_data : MarketData, path : str) -> None:
+        fname = self.get_fname(path, market_data.symbol)
+        if (not os.path.exists(fname)):
+            os.makedirs(fname)
+        # The columns may be memory-mapped from these same files, so they are written to temporary files
+        # that then replace them, instead of being overwritten in place
+        with instrumentation.stage("cache-save", market_data.symbol, bars=market_data.get_length()) as save_stage:
+            for column in CANDLE_COLUMNS:
+                dtype = np.int64 if column == "volume" else np.float64
+                values = market_data.get_column(column).astype(dtype, copy=False)
+                NumpyStorage.write_column(fname + f"\\{column}.npy", values)
+                save_stage.add(bytes_written=values.nbytes)
+            # The dates are written last, so a symbol only counts as cached once every column is on disk
+            NumpyStorage.write_column(fname + "\\datetime.npy", market_data.get_timestamps())
+
+    def write_column(fname : str, values : np.ndarray) -> None:
+        temporary_fname = f"{fname}.{os.getpid()}.tmp"
+        with open(temporary_fname, "wb") as file:
+            np.save(file, values)
+        os.replace(temporary_fname, fname)
+
+    def load(self, path : str, symbol : str, frequency_type : FrequencyType, frequency : int) -> MarketData:
+        fname = self.get_fname(path, symbol)
+        with instrumentation.stage("cache-load", symbol) as load_stage:
+            columns = [np.load(fname + f"\\{column}.npy", mmap_mode=self.mmap_mode) for column in CANDLE_COLUMNS + ["datetime"]]
+            # Memory-mapped columns are only read from disk when used, these are the bytes mapped
+            load_stage.add(bytes_read=sum(column.nbytes for column in columns), bars=len(columns[-1]))
+            return MarketData(symbol, MarketData.columns_to_dataframe(*columns), frequency_type, frequency)
 
-        
+default_storage = NumpyStorage()
 
-            
\ No newline at end of file
+# Copies every symbol cached as JSON into another storage (one-time migration of the old cache).
+# Returns the number of symbols that were migrated.
+def migrate_json_cache(storage : CandleStorage = None, remove_json : bool = False) -> int:
+    if (storage is None):
+        storage = default_storage
+    json_storage = JSONStorage()
+    paths = [MarketData.get_path(FrequencyType.Minute, frequency) for frequency in [1, 5, 10, 15, 30]]
+    paths += [MarketData.get_path(frequency_type, 1) for frequency_type in FrequencyType if frequency_type != FrequencyType.Minute]
+    migrated = 0
+    for path in paths:
+        for fname in glob.glob(json_storage.get_fname(path, "*")):
+            symbol = fname.replace("/", "\\").split("\\")[-1][:-len(".json")]
+            if (not storage.exists(path, symbol)):
+                # The frequency is not needed to copy the candles
+                market_data = json_storage.load(path, symbol, None, None)
+                storage.save(market_data, path)
+                migrated += 1
+            if (remove_json):
+                os.remove(json_storage.get_fname(path, symbol))
+    return migrated
@@ -1,14 +1,5 @@
 from enum import Enum
+from studies import STUDY_REGISTRY
 
-class AvailableStudies(Enum):
-	AverageTrueRange = 0
-	BollingerBands = 1
-	DonchianChannels = 2
-	ExponentialMovingAverage = 3
-	PercentR = 4
-	RealRelativeStrength = 5
-	SimpleMovingAverage = 6
-	TrueRange = 7
-	WeightedMovingAverage = 8
-	WildersMovingAverage = 9
-	
\ No newline at end of file
+# The registered studies (see studies.register_study), numbered in the order they are defined
+AvailableStudies = Enum("AvailableStudies", [(name, index) for index, name in enumerate(STUDY_REGISTRY)])
@@ -31,4 +31,9 @@ class PriceType(Enum):
     Volume  = 4
     HL2     = 5
     HLC3    = 6
-    OHLC4   = 7 
\ No newline at end of file
+    OHLC4   = 7 
+
+class PositionSizing(Enum):
+    FixedFraction = 0 # A fraction of the equity
+    FixedAmount = 1 # The same amount of cash
+    EqualWeight = 2 # The equity split between the maximum number of positions
@@ -0,0 +1,324 @@
+from typing import Callable, Union
+
+import numpy as np
+import pandas as pd
+
+# Operators written with symbols, longest first so that "<=" is not read as "<"
+SYMBOL_OPERATORS = ["<=", ">=", "!=", "<", ">", "=", "+", "-", "*", "/", "&", "|"]
+# Operators written between '$' symbols, like $crosses-above$
+WORD_OPERATORS = ["and", "or", "crosses-above", "crosses-below"]
+CROSSOVER_OPERATORS = ["crosses-above", "crosses-below"]
+# Operators with the same meaning, so that both spellings share their results
+OPERATOR_ALIASES = {"and": "&", "or": "|"}
+
+# Indicates the value of precedence of operators, from largest to smallest
+def precedence(operator : str) -> int:
+    if operator == "*" or operator == "/":
+        return 5
+    elif operator == "+" or operator == "-":
+        return 4
+    elif (operator == "<" or operator == "<=" or
+        operator == ">" or operator == ">=" or
+        operator == "crosses-above" or operator == "crosses-below"):
+        return 3
+    elif operator == "=" or operator == "!=":
+        return 2
+    elif operator == "&" or operator == "and":
+        return 1
+    elif operator == "|" or operator == "or":
+        return 0
+    else:
+        raise NotImplementedError(f"Operator '{operator}' has not been implemented.")
+
+# Operators evaluated by ExpressionPlan into a buffer of their results
+OPERATOR_UFUNCS = {"+": np.add, "-": np.subtract, "*": np.multiply, "/": np.true_divide,
+                   ">": np.greater, ">=": np.greater_equal, "=": np.equal, "!=": np.not_equal,
+                   "<=": np.less_equal, "<": np.less, "&": np.bitwise_and, "|": np.bitwise_or,
+                   "and": np.bitwise_and, "or": np.bitwise_or}
+# Elements of the intermediate results of a chunk of bars, so that they stay in the CPU cache
+CHUNK_ELEMENTS = 2**15
+
+# Whether value1 crosses above (or below) value2 on every bar: it was not above (below) value2 on the
+# previous bar and is on this one. The previous bars are the same values offset by one row, with the
+# bars in the first axis, and a constant is the same on every bar. The first bar never crosses.
+def crossover(value1 : Union[pd.Series, np.ndarray, float],
+              value2 : Union[pd.Series, np.ndarray, float],
+              above : bool,
+              out : np.ndarray = None) -> Union[pd.Series, np.ndarray]:
+    index = next((value.index for value in [value1, value2] if isinstance(value, pd.Series)), None)
+    value1, value2 = [value.to_numpy() if isinstance(value, pd.Series) else value for value in [value1, value2]]
+    shape = np.broadcast_shapes(np.shape(value1), np.shape(value2))
+    if len(shape) == 0:
+        raise ValueError(f"Operator '{'crosses-above' if above else 'crosses-below'}' needs at least one operand that is not a constant.")
+    if out is None:
+        out = np.empty(shape=shape, dtype=bool)
+    current1, previous1 = (value1, value1) if np.ndim(value1) == 0 else (value1[1:], value1[:-1])
+    current2, previous2 = (value2, value2) if np.ndim(value2) == 0 else (value2[1:], value2[:-1])
+    out[:1] = False
+    if above:
+        np.less_equal(previous1, previous2, out=out[1:])
+        out[1:] &= current1 > current2
+    else:
+        np.greater_equal(previous1, previous2, out=out[1:])
+        out[1:] &= current1 < current2
+    return out if index is None else pd.Series(out, index=index)
+
+# Result of an operator on two operands. With out, arrays are operated into it instead of a new array.
+def apply_operator(value1 : Union[pd.Series, np.ndarray, float],
+                   value2 : Union[pd.Series, np.ndarray, float],
+                   operator : str,
+                   out : np.ndarray = None) -> Union[pd.Series, np.ndarray]:
+    if out is not None and operator in OPERATOR_UFUNCS:
+        return OPERATOR_UFUNCS[operator](value1, value2, out=out)
+    if operator == "+":
+        return value1 + value2
+    elif operator == "-":
+        return value1 - value2
+    elif operator == "*":
+        return value1 * value2
+    elif operator == "/":
+        return value1 / value2
+    elif operator == ">":
+        return value1 > value2
+    elif operator == ">=":
+        return value1 >= value2
+    elif operator == "=":
+        return value1 == value2
+    elif operator == "!=":
+        return value1 != value2
+    elif operator == "<=":
+        return value1 <= value2
+    elif operator == "<":
+        return value1 < value2
+    elif operator == "|" or operator == "or":
+        return value1 | value2
+    elif operator == "&" or operator == "and":
+        return value1 & value2
+    elif operator == "crosses-above" or operator == "crosses-below":
+        return crossover(value1, value2, operator == "crosses-above", out)
+    else:
+        raise NotImplementedError(f"Operator '{operator}' has not been implemented.")
+
+# Splits an expression into constants, studies (S<n>), parentheses and operators.
+# Every token is a tuple (kind, value, position in the expression).
+def tokenize(expression : str) -> list:
+    tokens = []
+    index = 0
+    while index < len(expression):
+        char = expression[index]
+        # Skip blank spaces
+        if char.isspace():
+            index += 1
+        # It's a constant
+        elif char.isdigit() or char == ".":
+            start_idx = index
+            while index < len(expression) and (expression[index].isdigit() or expression[index] == "."):
+                index += 1
+            try:
+                tokens.append(("constant", float(expression[start_idx:index]), start_idx))
+            except ValueError:
+                raise ValueError(f"Invalid constant '{expression[start_idx:index]}' at position {start_idx} of '{expression}'.")
+        elif char == "(" or char == ")":
+            tokens.append((char, char, index))
+            index += 1
+        # It's a study
+        elif char == "S" or char == "s":
+            start_idx = index
+            index += 1
+            while index < len(expression) and expression[index].isdigit():
+                index += 1
+            if index == start_idx + 1:
+                raise ValueError(f"Missing study index at position {start_idx} of '{expression}'.")
+            tokens.append(("study", int(expression[start_idx + 1:index]), start_idx))
+        # It's an operator between '$' symbols
+        elif char == "$":
+            end_idx = expression.find("$", index + 1)
+            if end_idx < 0:
+                raise ValueError(f"Missing closing '$' for the operator at position {index} of '{expression}'.")
+            operator = expression[index + 1:end_idx].strip().lower()
+            if operator not in WORD_OPERATORS and operator not in SYMBOL_OPERATORS:
+                raise ValueError(f"Unknown operator '{operator}' at position {index} of '{expression}'.")
+            tokens.append(("operator", OPERATOR_ALIASES.get(operator, operator), index))
+            index = end_idx + 1
+        else:
+            for operator in SYMBOL_OPERATORS:
+                if expression.startswith(operator, index):
+                    tokens.append(("operator", operator, index))
+                    index += len(operator)
+                    break
+            else:
+                raise ValueError(f"Unexpected character '{char}' at position {index} of '{expression}'.")
+    return tokens
+
+# Parses an expression into a tree of tuples:
+# ("constant", value), ("study", index) or (operator, left operand, right operand)
+def parse(expression : str) -> tuple:
+    operator_stack = []
+    operand_stack = []
+
+    def reduce() -> None:
+        operator = operator_stack.pop()
+        operand2 = operand_stack.pop()
+        operand1 = operand_stack.pop()
+        operand_stack.append(fold((operator, operand1, operand2)))
+
+    expect_operand = True
+    for kind, value, position in tokenize(expression):
+        if expect_operand:
+            if kind == "constant" or kind == "study":
+                operand_stack.append((kind, value))
+                expect_operand = False
+            elif kind == "(":
+                operator_stack.append("(")
+            # A minus sign in front of a constant makes it negative
+            elif kind == "operator" and value == "-":
+                operator_stack.append("negate")
+            else:
+                raise ValueError(f"Expected a constant, a study or '(' at position {position} of '{expression}'.")
+            while (not expect_operand) and len(operator_stack) > 0 and operator_stack[-1] == "negate":
+                operator_stack.pop()
+                operand_stack.append(fold(("*", ("constant", -1.0), operand_stack.pop())))
+        else:
+            if kind == "operator":
+                while (len(operator_stack) > 0 and operator_stack[-1] != "(" and
+                       precedence(value) <= precedence(operator_stack[-1])):
+                    reduce()
+                operator_stack.append(value)
+                expect_operand = True
+            elif kind == ")":
+                # Calculate everything between parentheses
+                while len(operator_stack) > 0 and operator_stack[-1] != "(":
+                    reduce()
+                if len(operator_stack) == 0:
+                    raise ValueError(f"Unmatched ')' at position {position} of '{expression}'.")
+                operator_stack.pop()
+                while len(operator_stack) > 0 and operator_stack[-1] == "negate":
+                    operator_stack.pop()
+                    operand_stack.append(fold(("*", ("constant", -1.0), operand_stack.pop())))
+            else:
+                raise ValueError(f"Expected an operator or ')' at position {position} of '{expression}'.")
+    if expect_operand:
+        raise ValueError(f"Incomplete expression '{expression}'.")
+    while len(operator_stack) > 0:
+        if operator_stack[-1] == "(":
+            raise ValueError(f"Unmatched '(' in '{expression}'.")
+        reduce()
+    return operand_stack.pop()
+
+# Constant folding: an operation between two constants is replaced by its result
+def fold(node : tuple) -> tuple:
+    operator, operand1, operand2 = node
+    if operand1[0] == "constant" and operand2[0] == "constant":
+        if operator in CROSSOVER_OPERATORS:
+            raise ValueError(f"Operator '{operator}' needs at least one operand that is not a constant.")
+        return ("constant", apply_operator(operand1[1], operand2[1], operator))
+    return node
+
+# A list of expressions compiled into a single list of instructions.
+# Common subexpressions (also the ones shared between expressions) are calculated only once.
+class ExpressionPlan:
+
+    def __init__(self, expressions : list, study_count : int = None) -> None:
+        self.expressions = expressions
+        # Every instruction is a tuple (operator, argument1, argument2). For "constant" argument1 is the value,
+        # for "study" it is the study index and for operators both arguments are indices of previous instructions
+        self.instructions = []
+        self.outputs = []
+        node_indices = {}
+
+        def compile_node(node : tuple) -> int:
+            if node in node_indices:
+                return node_indices[node]
+            if node[0] == "constant" or node[0] == "study":
+                if node[0] == "study" and study_count is not None and node[1] >= study_count:
+                    raise ValueError(f"Study S{node[1]} does not exist, there are {study_count} studies.")
+                instruction = (node[0], node[1], None)
+            else:
+                instruction = (node[0], compile_node(node[1]), compile_node(node[2]))
+            self.instructions.append(instruction)
+            node_indices[node] = len(self.instructions) - 1
+            return node_indices[node]
+
+        for expression in expressions:
+            self.outputs.append(compile_node(parse(expression)))
+        # Index of the last instruction that reads each result, so intermediate results can be freed early
+        self.last_use = list(range(len(self.instructions)))
+        for index, (operator, argument1, argument2) in enumerate(self.instructions):
+            if operator != "constant" and operator != "study":
+                self.last_use[argument1] = index
+                self.last_use[argument2] = index
+        for output in self.outputs:
+            self.last_use[output] = len(self.instructions)
+        # Bars before a chunk that it also evaluates, so that its crossovers (and the crossovers of
+        # their results) can look at the previous bar
+        depths = []
+        for operator, argument1, argument2 in self.instructions:
+            if operator == "constant" or operator == "study":
+                depths.append(0)
+            else:
+                depths.append(max(depths[argument1], depths[argument2]) + (operator in CROSSOVER_OPERATORS))
+        self.overlap = max(depths, default=0)
+
+    # Indices of the studies used by the expressions
+    def get_studies(self) -> list:
+        return sorted(set(argument1 for operator, argument1, argument2 in self.instructions if operator == "study"))
+
+    # Type of the results of an instruction on operands value1 and value2
+    def __get_dtype(operator : str, value1 : Union[np.ndarray, float], value2 : Union[np.ndarray, float]) -> np.dtype:
+        if operator in CROSSOVER_OPERATORS or operator in [">", ">=", "=", "!=", "<=", "<"]:
+            return np.dtype(bool)
+        if operator == "/":
+            return np.result_type(value1, value2, 1.0)
+        return np.result_type(value1, value2)
+
+    # Evaluates every expression, get_study returns the values of a study from its index (with the bars
+    # in the first axis). The bars are evaluated a chunk at a time, chunk_rows bars (by default as many as
+    # fit in CHUNK_ELEMENTS), and the buffers of the intermediate results are reused between instructions
+    # and between chunks. Expressions that are a constant or a single study give it as it is.
+    def execute(self, get_study : Callable, chunk_rows : int = None) -> list:
+        study_values = {argument1: get_study(argument1) for operator, argument1, argument2 in self.instructions if operator == "study"}
+        length = max((len(values) for values in study_values.values()), default=0)
+        if chunk_rows is None:
+            row_size = max((int(np.prod(np.shape(values)[1:])) for values in study_values.values()), default=1)
+            chunk_rows = max(1, CHUNK_ELEMENTS // max(row_size, 1))
+        outputs = [None] * len(self.outputs)
+        free_buffers = {} # Buffers no longer used, by type and shape
+        for start in range(0, max(length, 1), chunk_rows):
+            stop = min(length, start + chunk_rows)
+            first = max(0, start - self.overlap)
+            results = [None] * len(self.instructions)
+            buffers = [] # Indices of the results written to a buffer of this chunk
+            for index, (operator, argument1, argument2) in enumerate(self.instructions):
+                if operator == "constant":
+                    results[index] = argument1
+                elif operator == "study":
+                    results[index] = study_values[argument1][first:stop]
+                else:
+                    value1 = results[argument1]
+                    value2 = results[argument2]
+                    key = (ExpressionPlan.__get_dtype(operator, value1, value2),
+                           np.broadcast_shapes(np.shape(value1), np.shape(value2)))
+                    buffer = free_buffers[key].pop() if len(free_buffers.get(key, [])) > 0 else np.empty(shape=key[1], dtype=key[0])
+                    results[index] = apply_operator(value1, value2, operator, buffer)
+                    buffers.append(index)
+                    for argument in [argument1, argument2]:
+                        if self.last_use[argument] == index and argument in buffers:
+                            free_buffers.setdefault((results[argument].dtype, results[argument].shape), []).append(results[argument])
+                            buffers.remove(argument)
+                            results[argument] = None
+            for output_idx, output in enumerate(self.outputs):
+                operator = self.instructions[output][0]
+                if operator == "constant" or operator == "study":
+                    outputs[output_idx] = results[output] if operator == "constant" else study_values[self.instructions[output][1]]
+                # A single chunk is the whole result
+                elif start == 0 and stop >= length:
+                    outputs[output_idx] = results[output]
+                    if output in buffers:
+                        buffers.remove(output)
+                else:
+                    if outputs[output_idx] is None:
+                        outputs[output_idx] = np.empty(shape=(length,) + results[output].shape[1:], dtype=results[output].dtype)
+                    outputs[output_idx][start:stop] = results[output][start - first:]
+            for index in buffers:
+                free_buffers.setdefault((results[index].dtype, results[index].shape), []).append(results[index])
+        return outputs
@@ -0,0 +1,251 @@
+from collections import deque
+from enums import AverageType
+
+import math
+import numpy as np
+
+# Accumulators that take one value at a time and return the latest value of a study in O(1)
+# (amortized O(1) for the rolling minimum and maximum). They give the same values as the
+# calculations over the whole column: NaN during the warm-up and for windows with a NaN.
+#
+# Instead of being updated with every value of the history, a new accumulator can be primed with all
+# of them at once (a numpy array): the windowed ones only depend on their last window, so they are
+# updated with it, and the exponential average sums the decayed weights of the history.
+
+# Running sums drift with every update, so the windowed accumulators add their window
+# up again after this many updates (times the length of the window)
+RESUM_PERIOD = 64
+
+# Updates a new accumulator with the last count values (all of them if there are fewer)
+def update_last(accumulator, values : np.ndarray, count : int) -> None:
+    for value in values[max(len(values) - count, 0):]:
+        accumulator.update(float(value))
+
+# Values of length bars ago (values displaced like pandas' shift), None for the first length bars
+class Delay:
+
+    def __init__(self, length : int) -> None:
+        self.values = deque([None] * length, maxlen=length + 1)
+
+    def update(self, value):
+        self.values.append(value)
+        return self.values.popleft()
+
+    # Values (a list) before the next update, the last length of them are given by the next updates
+    def prime(self, values : list) -> None:
+        for value in values[max(len(values) - self.values.maxlen + 1, 0):]:
+            self.values.append(value)
+            self.values.popleft()
+
+# Window of the last length values, with their NaN count, shared by the windowed accumulators
+class Window:
+
+    def __init__(self, length : int) -> None:
+        self.length = length
+        self.values = deque()
+        self.nan_count = 0
+
+    # Adds a value (NaN counted as 0.0) and returns the one that left the window (0.0 if none did)
+    def push(self, value : float) -> float:
+        if math.isnan(value):
+            self.nan_count += 1
+            value = 0.0
+            self.values.append(None)
+        else:
+            self.values.append(value)
+        if len(self.values) <= self.length:
+            return 0.0
+        removed = self.values.popleft()
+        if removed is None:
+            self.nan_count -= 1
+            return 0.0
+        return removed
+
+    def is_valid(self) -> bool:
+        return len(self.values) == self.length and self.nan_count == 0
+
+    def get_values(self) -> list:
+        return [0.0 if value is None else value for value in self.values]
+
+class SimpleAverage:
+
+    def __init__(self, length : int) -> None:
+        self.window = Window(length)
+        self.sum = 0.0
+        self.updates = 0
+
+    def update(self, value : float) -> float:
+        removed = self.window.push(value)
+        self.updates += 1
+        if self.updates % (RESUM_PERIOD * self.window.length) == 0:
+            self.sum = math.fsum(self.window.get_values())
+        else:
+            self.sum += (0.0 if math.isnan(value) else value) - removed
+        return self.sum / self.window.length if self.window.is_valid() else math.nan
+
+    def prime(self, values : np.ndarray) -> None:
+        update_last(self, values, self.window.length)
+
+# Weighted average with weights 1, 2, ..., length (the latest value has the largest weight)
+class WeightedAverage:
+
+    def __init__(self, length : int) -> None:
+        self.window = Window(length)
+        self.sum = 0.0
+        self.weighted_sum = 0.0
+        self.updates = 0
+
+    def update(self, value : float) -> float:
+        length = self.window.length
+        full = len(self.window.values) == length
+        removed = self.window.push(value)
+        value = 0.0 if math.isnan(value) else value
+        self.updates += 1
+        if self.updates % (RESUM_PERIOD * length) == 0:
+            values = self.window.get_values()
+            self.sum = math.fsum(values)
+            self.weighted_sum = math.fsum((i + 1) * x for i, x in enumerate(values))
+        elif full:
+            # Every value in the window loses one weight and the new one gets the largest
+            self.weighted_sum += length * value - self.sum
+            self.sum += value - removed
+        else:
+            self.sum += value
+            self.weighted_sum += len(self.window.values) * value
+        return self.weighted_sum / (length * (length + 1) / 2) if self.window.is_valid() else math.nan
+
+    def prime(self, values : np.ndarray) -> None:
+        update_last(self, values, self.window.length)
+
+# Same as pandas' ewm(alpha=alpha).mean(): the weights of the previous values decay by 1 - alpha
+# every bar (also on NaN bars, which keep the previous average)
+class ExponentialAverage:
+
+    def __init__(self, alpha : float) -> None:
+        self.decay = 1 - alpha
+        self.numerator = 0.0
+        self.denominator = 0.0
+
+    def update(self, value : float) -> float:
+        self.numerator *= self.decay
+        self.denominator *= self.decay
+        if not math.isnan(value):
+            self.numerator += value
+            self.denominator += 1.0
+        return self.numerator / self.denominator if self.denominator > 0 else math.nan
+
+    def prime(self, values : np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        weights = self.decay ** np.arange(len(values) - 1, -1, -1, dtype=np.float64)
+        valid = ~np.isnan(values)
+        self.numerator = float(np.dot(values[valid], weights[valid]))
+        self.denominator = float(weights[valid].sum())
+
+# WMA(2 * WMA(value, ceil(length / 2)) - WMA(value, length), round(sqrt(length)))
+class HullAverage:
+
+    def __init__(self, length : int) -> None:
+        self.half_average = WeightedAverage(math.ceil(length / 2))
+        self.full_average = WeightedAverage(length)
+        self.average = WeightedAverage(max(1, round(math.sqrt(length))))
+
+    def update(self, value : float) -> float:
+        return self.average.update(2 * self.half_average.update(value) - self.full_average.update(value))
+
+    # The last values of the outer average come from the last window of the inner ones
+    def prime(self, values : np.ndarray) -> None:
+        update_last(self, values, self.full_average.window.length + self.average.window.length - 1)
+
+# Population standard deviation of the last length values
+class Deviation:
+
+    def __init__(self, length : int) -> None:
+        self.window = Window(length)
+        self.sum = 0.0
+        self.squares_sum = 0.0
+        self.updates = 0
+
+    def update(self, value : float) -> float:
+        length = self.window.length
+        removed = self.window.push(value)
+        value = 0.0 if math.isnan(value) else value
+        self.updates += 1
+        if self.updates % (RESUM_PERIOD * length) == 0:
+            values = self.window.get_values()
+            self.sum = math.fsum(values)
+            self.squares_sum = math.fsum(x * x for x in values)
+        else:
+            self.sum += value - removed
+            self.squares_sum += value * value - removed * removed
+        if not self.window.is_valid():
+            return math.nan
+        mean = self.sum / length
+        return math.sqrt(max(self.squares_sum / length - mean * mean, 0.0))
+
+    def prime(self, values : np.ndarray) -> None:
+        update_last(self, values, self.window.length)
+
+# Maximum of the last length values with a monotonic deque: the deque holds (position, value)
+# of the values that are larger than every value after them, so its first item is the maximum
+class RollingMaximum:
+
+    def __init__(self, length : int) -> None:
+        self.length = length
+        self.candidates = deque()
+        self.position = 0
+        self.last_nan = -length # Position of the latest NaN
+
+    def is_before(self, value1 : float, value2 : float) -> bool:
+        return value1 > value2
+
+    def update(self, value : float) -> float:
+        if math.isnan(value):
+            self.last_nan = self.position
+        else:
+            while len(self.candidates) > 0 and not self.is_before(self.candidates[-1][1], value):
+                self.candidates.pop()
+            self.candidates.append((self.position, value))
+        while len(self.candidates) > 0 and self.candidates[0][0] <= self.position - self.length:
+            self.candidates.popleft()
+        self.position += 1
+        if self.position < self.length or self.last_nan > self.position - 1 - self.length:
+            return math.nan
+        return self.candidates[0][1]
+
+    # The values before the last window take their positions without being candidates
+    def prime(self, values : np.ndarray) -> None:
+        self.position = max(len(values) - self.length, 0)
+        update_last(self, values, self.length)
+
+class RollingMinimum(RollingMaximum):
+
+    def is_before(self, value1 : float, value2 : float) -> bool:
+        return value1 < value2
+
+class TrueRange:
+
+    def __init__(self) -> None:
+        self.previous_close = math.nan
+
+    def update(self, high : float, low : float, close : float) -> float:
+        # Like np.fmax, a missing previous close is skipped
+        ranges = [x for x in [high - low, abs(high - self.previous_close), abs(low - self.previous_close)] if not math.isnan(x)]
+        self.previous_close = close
+        return max(ranges) if len(ranges) > 0 else math.nan
+
+    def prime(self, close : np.ndarray) -> None:
+        self.previous_close = float(close[-1]) if len(close) > 0 else math.nan
+
+# Accumulator of a moving average for any of the average types
+def moving_average(length : int, average_type : AverageType):
+    if (average_type == AverageType.Simple):
+        return SimpleAverage(length)
+    if (average_type == AverageType.Exponential):
+        return ExponentialAverage(2 / (length + 1))
+    if (average_type == AverageType.Weighted):
+        return WeightedAverage(length)
+    if (average_type == AverageType.Wilders):
+        return ExponentialAverage(1.0 / length)
+    if (average_type == AverageType.Hull):
+        return HullAverage(length)
+    raise NotImplementedError(f"Average type {average_type.name} has not been implemented.")
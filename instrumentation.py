@@ -0,0 +1,152 @@
+from typing import Callable
+
+import json
+import threading
+import time
+
+# Timings and counters of the stages of the pipeline (HTTP requests, decoding, cache I/O, studies,
+# condition evaluation, trade simulation), sent to every registered sink. Without sinks nothing is
+# measured: a stage only checks that the sink list is empty.
+#
+#   sink = instrumentation.MemorySink()
+#   instrumentation.add_sink(sink)
+#   with instrumentation.stage("download", symbol) as current_stage:
+#       ...
+#       current_stage.add(bytes_read=len(content))
+#
+# Every event is a dictionary {"stage", "symbol", "seconds", "counts", "timestamp"}. "seconds" is None
+# for events that only count something (see count).
+
+_sinks = []
+_lock = threading.Lock()
+
+# Receives the events of every stage
+class Sink:
+
+    def record(self, event : dict) -> None:
+        raise NotImplementedError(f"{type(self).__name__} does not implement record.")
+
+    def close(self) -> None:
+        pass
+
+# Writes every event as a line of text, to print or to any other function taking a string (like logger.info)
+class LogSink(Sink):
+
+    def __init__(self, write : Callable = print) -> None:
+        self.write = write
+
+    def record(self, event : dict) -> None:
+        line = event["stage"]
+        if event["symbol"] is not None:
+            line += f" [{event['symbol']}]"
+        if event["seconds"] is not None:
+            line += f" {event['seconds'] * 1000:.3f} ms"
+        for name, value in event["counts"].items():
+            line += f" {name}={value}"
+        self.write(line)
+
+# Appends every event to a file as a line of JSON
+class JSONFileSink(Sink):
+
+    def __init__(self, file_name : str) -> None:
+        self.file_name = file_name
+        self.file = open(file_name, "a", encoding="utf-8")
+
+    def record(self, event : dict) -> None:
+        self.file.write(json.dumps(event) + "\n")
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+# Keeps the events in a list, for tests and for summaries at the end of a run
+class MemorySink(Sink):
+
+    def __init__(self) -> None:
+        self.events = []
+
+    def record(self, event : dict) -> None:
+        self.events.append(event)
+
+    def get_events(self, stage : str = None, symbol : str = None) -> list:
+        return [event for event in self.events
+                if (stage is None or event["stage"] == stage) and (symbol is None or event["symbol"] == symbol)]
+
+    def get_summary(self, by_symbol : bool = False) -> dict:
+        return summarize(self.events, by_symbol)
+
+    def clear(self) -> None:
+        self.events = []
+
+# Totals of a list of events for every stage (and symbol, if by_symbol): number of events, seconds and counts
+def summarize(events : list, by_symbol : bool = False) -> dict:
+    summary = {}
+    for event in events:
+        key = (event["stage"], event["symbol"]) if by_symbol else event["stage"]
+        totals = summary.setdefault(key, {"events": 0, "seconds": 0.0})
+        totals["events"] += 1
+        if event["seconds"] is not None:
+            totals["seconds"] += event["seconds"]
+        for name, value in event["counts"].items():
+            totals[name] = totals.get(name, 0) + value
+    return summary
+
+def add_sink(sink : Sink) -> Sink:
+    with _lock:
+        _sinks.append(sink)
+    return sink
+
+def remove_sink(sink : Sink) -> None:
+    with _lock:
+        _sinks.remove(sink)
+    sink.close()
+
+def clear_sinks() -> None:
+    with _lock:
+        sinks = list(_sinks)
+        _sinks.clear()
+    for sink in sinks:
+        sink.close()
+
+def is_enabled() -> bool:
+    return len(_sinks) > 0
+
+def _emit(stage_name : str, symbol : str, seconds : float, counts : dict) -> None:
+    event = {"stage": stage_name, "symbol": symbol, "seconds": seconds, "counts": counts, "timestamp": time.time()}
+    # Stages may end in several threads at once (concurrent downloads)
+    with _lock:
+        for sink in _sinks:
+            sink.record(event)
+
+# Records counters that are not timed, like cache hits
+def count(stage_name : str, symbol : str = None, **counts) -> None:
+    if len(_sinks) > 0:
+        _emit(stage_name, symbol, None, counts)
+
+# Times the code inside a with statement and records it with its counters. More counters can be added
+# inside the with statement, and they are only kept if some sink is registered when the stage starts.
+class stage:
+
+    __slots__ = ["name", "symbol", "counts", "start"]
+
+    def __init__(self, name : str, symbol : str = None, **counts) -> None:
+        self.name = name
+        self.symbol = symbol
+        self.counts = counts
+        self.start = None
+
+    def __enter__(self) -> "stage":
+        if len(_sinks) > 0:
+            self.start = time.perf_counter()
+        return self
+
+    def add(self, **counts) -> None:
+        if self.start is not None:
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        if self.start is not None:
+            if exception_type is not None:
+                self.counts["errors"] = self.counts.get("errors", 0) + 1
+            _emit(self.name, self.symbol, time.perf_counter() - self.start, self.counts)
@@ -0,0 +1,159 @@
+from enums import AverageType
+
+import math
+import numpy as np
+import pandas as pd
+
+# Moving averages of a column for several lengths at once, as a 2-D array with a column per length.
+# The simple, weighted and Hull averages share one pass of cumulative sums for every length (see WindowSums).
+def moving_averages(column : np.ndarray, lengths : list, average_type : AverageType) -> np.ndarray:
+    column = np.asarray(column, dtype=np.float64)
+    averages = np.empty(shape=(len(column), len(lengths)), dtype=np.float64)
+    if (average_type == AverageType.Exponential or average_type == AverageType.Wilders):
+        series = pd.Series(column)
+        for j, length in enumerate(lengths):
+            alpha = 2 / (length + 1) if average_type == AverageType.Exponential else 1.0 / length
+            averages[:, j] = series.ewm(alpha=alpha).mean().to_numpy()
+    elif (average_type == AverageType.Simple):
+        sums = WindowSums(column, max(lengths, default=1))
+        for j, length in enumerate(lengths):
+            averages[:, j] = sums.mean(length)
+    elif (average_type == AverageType.Weighted):
+        sums = WindowSums(column, max(lengths, default=1), weighted=True)
+        for j, length in enumerate(lengths):
+            averages[:, j] = sums.weighted_mean(length)
+    elif (average_type == AverageType.Hull):
+        sums = WindowSums(column, max(lengths, default=1), weighted=True)
+        for j, length in enumerate(lengths):
+            averages[:, j] = sums.hull_mean(length)
+    else:
+        raise NotImplementedError(f"Average type {average_type.name} has not been implemented.")
+    return averages
+
+# Shifts the rows of a (bars x columns) array like pandas' shift
+def shift_rows(values : np.ndarray, displace : int) -> np.ndarray:
+    if (displace == 0):
+        return values
+    result = np.full(shape=values.shape, fill_value=np.nan)
+    if (displace > 0):
+        result[displace:] = values[:-displace]
+    else:
+        result[:displace] = values[-displace:]
+    return result
+
+# Cumulative sums of the values along the first axis from which the sum (and the sum weighted by
+# 1, 2, ..., length) of every window of any length up to max_length is a difference of two values.
+# The sums are taken within blocks of rows, each one long enough for the windows starting in it, so
+# that they (and their rounding errors) stay small no matter how long the column is, and the values
+# are centered on their mean for the same reason. Windows with a NaN give NaN, like pandas' rolling
+# functions. O(n) time to build and for every length.
+class WindowSums:
+
+    def __init__(self, values : np.ndarray, max_length : int, weighted : bool = False) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        self.shape = values.shape
+        self.max_length = max(1, min(max_length, len(values)))
+        self.block = max(4 * self.max_length, 64)
+        nans = np.isnan(values)
+        self.nan_counts = np.zeros(shape=(len(values) + 1,) + values.shape[1:], dtype=np.int64)
+        np.cumsum(nans, axis=0, out=self.nan_counts[1:])
+        finite_counts = np.maximum((~nans).sum(axis=0), 1)
+        self.center = np.where(nans, 0.0, values).sum(axis=0) / finite_counts
+        blocks = max(1, -(-len(values) // self.block))
+        rest = values.shape[1:]
+        padded = np.zeros(shape=(blocks * self.block + self.max_length - 1,) + rest, dtype=np.float64)
+        padded[:len(values)] = np.where(nans, 0.0, values - self.center)
+        # Rows [k * block, (k + 1) * block + max_length - 1) hold every window starting in block k
+        view = np.lib.stride_tricks.sliding_window_view(padded, self.block + self.max_length - 1, axis=0)[::self.block]
+        view = np.moveaxis(view, -1, 1)
+        self.sums = np.zeros(shape=(blocks, self.block + self.max_length) + rest, dtype=np.float64)
+        np.cumsum(view, axis=1, out=self.sums[:, 1:])
+        self.weighted_sums = None
+        if weighted:
+            positions = np.arange(self.block + self.max_length - 1, dtype=np.float64).reshape(self.__axis_shape())
+            self.weighted_sums = np.zeros(shape=self.sums.shape, dtype=np.float64)
+            np.cumsum(view * positions, axis=1, out=self.weighted_sums[:, 1:])
+
+    # Shape that lays a range along the rows of a block
+    def __axis_shape(self) -> tuple:
+        return (1, -1) + (1,) * (len(self.shape) - 1)
+
+    # Differences of cumulative sums over the windows of the given length starting in every row of each block
+    def __windows(self, cumulative : np.ndarray, length : int) -> np.ndarray:
+        return cumulative[:, length:length + self.block] - cumulative[:, :self.block]
+
+    # The window values in their rows (the last row of each window), NaN in the warm-up and in windows with a NaN
+    def __result(self, windows : np.ndarray, length : int) -> np.ndarray:
+        result = np.full(shape=self.shape, fill_value=np.nan)
+        windows = windows.reshape((-1,) + self.shape[1:])[:self.shape[0] - length + 1]
+        valid = (self.nan_counts[length:] - self.nan_counts[:-length]) == 0
+        result[length - 1:] = np.where(valid, windows + self.center, np.nan)
+        return result
+
+    def __check_length(self, length : int) -> bool:
+        if (length > self.max_length and length <= self.shape[0]):
+            raise ValueError(f"Window sums were taken for lengths up to {self.max_length}, not {length}.")
+        return length >= 1 and length <= self.shape[0]
+
+    def mean(self, length : int) -> np.ndarray:
+        if (not self.__check_length(length)):
+            return np.full(shape=self.shape, fill_value=np.nan)
+        return self.__result(self.__windows(self.sums, length) / length, length)
+
+    # The value in position p of the window starting in s has weight p - (s - 1)
+    def weighted_mean(self, length : int) -> np.ndarray:
+        if (not self.__check_length(length)):
+            return np.full(shape=self.shape, fill_value=np.nan)
+        window_start = np.arange(self.block, dtype=np.float64).reshape(self.__axis_shape())
+        weighted_sums = self.__windows(self.weighted_sums, length) - (window_start - 1) * self.__windows(self.sums, length)
+        return self.__result(weighted_sums / (length * (length + 1) / 2), length)
+
+    # Hull moving average: WMA(2 * WMA(price, ceil(length / 2)) - WMA(price, length), round(sqrt(length)))
+    def hull_mean(self, length : int) -> np.ndarray:
+        difference = 2 * self.weighted_mean(math.ceil(length / 2)) - self.weighted_mean(length)
+        return weighted_moving_average(difference, max(1, round(math.sqrt(length))))
+
+def simple_moving_average(values : np.ndarray, length : int) -> np.ndarray:
+    return WindowSums(values, length).mean(length)
+
+def weighted_moving_average(values : np.ndarray, length : int) -> np.ndarray:
+    return WindowSums(values, length, weighted=True).weighted_mean(length)
+
+def hull_moving_average(values : np.ndarray, length : int) -> np.ndarray:
+    return WindowSums(values, length, weighted=True).hull_mean(length)
+
+# Whether each window of the given length (one per window, the first one ending in position length - 1) has no NaN
+def __valid_windows(nans : np.ndarray, length : int) -> np.ndarray:
+    nan_counts = np.zeros(shape=(len(nans) + 1,) + nans.shape[1:], dtype=np.int64)
+    np.cumsum(nans, axis=0, out=nan_counts[1:])
+    return (nan_counts[length:] - nan_counts[:-length]) == 0
+
+# Rolling maximum (or minimum, with np.minimum) along the first axis with the van Herk/Gil-Werman method.
+# The rows are split in blocks of length rows: every window spans the end of a block and the start of the
+# next one, so its extremum is the one of the suffix of the first block and the prefix of the second.
+# Three passes over the values whatever the length, and NaN in the warm-up and in windows with a NaN.
+def __rolling_extremum(values : np.ndarray, length : int, extremum : np.ufunc, fill_value : float) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(shape=values.shape, fill_value=np.nan)
+    if (length > len(values) or length < 1):
+        return result
+    nans = np.isnan(values)
+    blocks = -(-len(values) // length)
+    padded = np.full(shape=(blocks * length,) + values.shape[1:], fill_value=fill_value)
+    padded[:len(values)] = np.where(nans, fill_value, values)
+    blocked = padded.reshape((blocks, length) + values.shape[1:])
+    prefix = extremum.accumulate(blocked, axis=1).reshape(padded.shape)
+    suffix = extremum.accumulate(blocked[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    windows = extremum(suffix[:len(values) - length + 1], prefix[length - 1:len(values)])
+    result[length - 1:] = np.where(__valid_windows(nans, length), windows, np.nan)
+    return result
+
+def rolling_maximum(values : np.ndarray, length : int) -> np.ndarray:
+    return __rolling_extremum(values, length, np.maximum, -np.inf)
+
+def rolling_minimum(values : np.ndarray, length : int) -> np.ndarray:
+    return __rolling_extremum(values, length, np.minimum, np.inf)
+
+# Lowest low and highest high of every window of the given length
+def rolling_extrema(low : np.ndarray, high : np.ndarray, length : int) -> tuple[np.ndarray, np.ndarray]:
+    return rolling_minimum(low, length), rolling_maximum(high, length)
@@ -0,0 +1,116 @@
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+# Statistics of the trades of many symbols (or of many parameter sets) computed in one pass over the trade
+# table: every trade carries the index of its group, and the sums of each group are taken with np.bincount
+# instead of splitting the table. The profits and losses are percentages, like "final-pl" in the reports.
+STATISTICS = ["trades", "wins", "losses", "win-rate", "average-win", "average-loss", "profit-factor",
+              "expectancy", "max-drawdown", "sharpe", "sortino", "time-in-market"]
+
+# Largest drop (in %) of the equity of every group when its trades are compounded one after the other
+# in the given order, starting from the equity before the first one
+def max_drawdowns(group : np.ndarray, pl : np.ndarray, order : np.ndarray, count : int) -> np.ndarray:
+    drawdowns = np.full(shape=count, fill_value=np.nan)
+    if len(group) == 0:
+        return drawdowns
+    order = np.asarray(order, dtype=np.int64)
+    low, high = order.min(), order.max()
+    # A single key sorts much faster than np.lexsort, when it fits in 64 bits
+    if (int(high) - int(low) + 1) * count < 2**62:
+        sort = np.argsort(group * (high - low + 1) + (order - low), kind="stable")
+    else:
+        sort = np.lexsort((order, group))
+    group = group[sort]
+    # A trade losing everything would take the log of 0
+    growth = np.log1p(np.maximum(pl[sort], -100 + 1e-9) / 100)
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    sizes = np.diff(np.r_[starts, len(group)])
+    cumulative = np.cumsum(growth)
+    log_equity = cumulative - np.repeat(cumulative[starts] - growth[starts], sizes)
+    # Raising every group above the previous ones lets a single running maximum restart at each group
+    offsets = np.repeat(np.arange(len(starts)) * (np.ptp(np.r_[log_equity, 0.0]) + 1), sizes)
+    peaks = np.maximum(np.maximum.accumulate(log_equity + offsets) - offsets, 0.0)
+    drawdowns[group[starts]] = np.maximum.reduceat(-np.expm1(log_equity - peaks) * 100, starts) + 0.0 # Not -0.0
+    return drawdowns
+
+# Statistics of closed trades by group (see STATISTICS). group is the index of the group of every trade,
+# order sorts the trades of a group in time (their closing time, as integers) and holding is how long
+# they lasted, in any unit, summed in "time-in-market". The Sharpe and Sortino ratios are per trade and
+# not annualized.
+def trade_statistics(group : np.ndarray, pl : np.ndarray, order : np.ndarray, holding : np.ndarray, count : int) -> dict:
+    group = np.asarray(group, dtype=np.int64)
+    pl = np.asarray(pl, dtype=np.float64)
+    trades = np.bincount(group, minlength=count)
+    wins = np.bincount(group, weights=pl > 0, minlength=count)
+    losses = np.bincount(group, weights=pl < 0, minlength=count)
+    gross_win = np.bincount(group, weights=np.maximum(pl, 0), minlength=count)
+    gross_loss = np.bincount(group, weights=np.minimum(pl, 0), minlength=count)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = (gross_win + gross_loss) / trades
+        deviation = np.sqrt(np.bincount(group, weights=(pl - mean[group])**2, minlength=count) / (trades - 1))
+        downside = np.sqrt(np.bincount(group, weights=np.minimum(pl, 0)**2, minlength=count) / trades)
+        return {"trades": trades,
+                "wins": wins.astype(np.int64),
+                "losses": losses.astype(np.int64),
+                "win-rate": wins / trades * 100,
+                "average-win": gross_win / wins,
+                "average-loss": gross_loss / losses,
+                "profit-factor": gross_win / np.abs(gross_loss),
+                "expectancy": mean,
+                "max-drawdown": max_drawdowns(group, pl, order, count),
+                "sharpe": mean / deviation,
+                "sortino": mean / downside,
+                "time-in-market": np.bincount(group, weights=holding, minlength=count)}
+
+# Dates of a report (naive, in any time zone or read back from a CSV file as text with their UTC offsets)
+# as UTC datetime64[ns] values, also for a single date
+def to_utc(dates : Union[pd.Series, pd.Timestamp, str]) -> Union[np.ndarray, np.datetime64]:
+    if dates is None:
+        return np.datetime64("NaT", "ns")
+    dates = pd.to_datetime(dates, utc=True)
+    if isinstance(dates, pd.Series):
+        return dates.dt.tz_convert(None).to_numpy(dtype="datetime64[ns]")
+    return dates.tz_convert(None).to_datetime64()
+
+# Statistics of the trades of a report (or of the trades of Strategy.simulate_portfolio) for every value of
+# the column by, or for all of them together if by is None. Trades still open are left out. "exposure" is
+# the time in the market over the period from start to end (by default from the first opening to the last
+# closing of the report), in %; for several symbols together it adds up, so it can go above 100.
+def get_trade_statistics(report : pd.DataFrame, by : str = "symbol", start : pd.Timestamp = None, end : pd.Timestamp = None) -> pd.DataFrame:
+    report = report[report["final-pl"].notna()]
+    opening = to_utc(report["opening-date"])
+    closing = to_utc(report["closing-date"])
+    if by is None:
+        group = np.zeros(shape=len(report), dtype=np.int64)
+        index = pd.Index(["all"])
+    else:
+        group, index = pd.factorize(report[by], sort=True)
+        index = pd.Index(index, name=by)
+    statistics = trade_statistics(group,
+                                  report["final-pl"].to_numpy(),
+                                  closing.view(np.int64) // 10**9,
+                                  (closing - opening) / np.timedelta64(1, "s"),
+                                  len(index))
+    start = opening.min() if start is None and len(report) > 0 else to_utc(start)
+    end = closing.max() if end is None and len(report) > 0 else to_utc(end)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        statistics["exposure"] = statistics["time-in-market"] / ((end - start) / np.timedelta64(1, "s")) * 100
+    statistics["time-in-market"] = pd.to_timedelta(statistics["time-in-market"], unit="s")
+    return pd.DataFrame(statistics, index=index)
+
+# Statistics of the equity of a portfolio (the first result of Strategy.simulate_portfolio). The Sharpe and
+# Sortino ratios are annualized from the returns of every bar, with periods_per_year bars a year.
+def get_portfolio_statistics(results : pd.DataFrame, initial_balance : float, periods_per_year : float = 252) -> pd.Series:
+    equity = results["equity"].to_numpy(dtype=np.float64)
+    returns = np.diff(np.r_[initial_balance, equity]) / np.r_[initial_balance, equity[:-1]]
+    peaks = np.maximum.accumulate(np.r_[initial_balance, equity])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annualized = np.mean(returns) * np.sqrt(periods_per_year)
+        return pd.Series({"total-return": (equity[-1] / initial_balance - 1) * 100 if len(equity) > 0 else 0.0,
+                          "max-drawdown": np.max(1 - np.r_[initial_balance, equity] / peaks) * 100,
+                          "sharpe": annualized / np.std(returns, ddof=1),
+                          "sortino": annualized / np.sqrt(np.mean(np.minimum(returns, 0)**2)),
+                          "average-exposure": results["exposure"].mean() * 100,
+                          "time-in-market": np.mean(results["positions"].to_numpy() > 0) * 100})
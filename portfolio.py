@@ -0,0 +1,166 @@
+from enums import PositionSizing
+from simulation import ExitRules, find_stop_trades, find_trades_many
+
+import numpy as np
+
+# Simulates the trades of every symbol in a single account: positions are bought with the cash of the
+# account when there is enough of it, following the sizing rules, and the account is valued every bar.
+# The prices and signals are (bars x symbols) arrays on a shared timeline (see MarketPanel), NaN where a
+# symbol has no candle. Every bar is one step over all the symbols at once, so the time taken grows with
+# the number of bars and barely with the number of symbols.
+
+# Position sizing and capital limits of a portfolio, given in the "portfolio" entry of the strategy file:
+# {"sizing": "FixedFraction", "positionSize": 0.1, "maxPositions": 20, "maxExposure": 1.0, "wholeShares": false}
+class PortfolioRules:
+
+    def __init__(self, sizing : PositionSizing = PositionSizing.FixedFraction,
+                 position_size : float = 0.1,
+                 max_positions : int = None,
+                 max_exposure : float = 1.0,
+                 whole_shares : bool = False) -> None:
+        if sizing == PositionSizing.EqualWeight and max_positions is None:
+            raise ValueError("Equal weight sizing needs a maximum number of positions.")
+        self.sizing = sizing
+        self.position_size = position_size # Fraction of the equity or amount of cash, depending on the sizing
+        self.max_positions = max_positions # Positions open at once, None for no limit
+        self.max_exposure = max_exposure # Value of the positions over the equity, above 1 buys on margin
+        self.whole_shares = whole_shares
+
+    def from_dict(rules_dict : dict) -> "PortfolioRules":
+        return PortfolioRules(PositionSizing[rules_dict.get("sizing", "FixedFraction")],
+                              rules_dict.get("positionSize", 0.1),
+                              rules_dict.get("maxPositions"),
+                              rules_dict.get("maxExposure", 1.0),
+                              rules_dict.get("wholeShares", False))
+
+    # Cash to put in every new position when the account is worth equity
+    def get_position_amount(self, equity : float) -> float:
+        if self.sizing == PositionSizing.FixedFraction:
+            return self.position_size * equity
+        if self.sizing == PositionSizing.FixedAmount:
+            return self.position_size
+        if self.sizing == PositionSizing.EqualWeight:
+            return equity / self.max_positions
+        raise NotImplementedError(f"Position sizing {self.sizing.name} has not been implemented.")
+
+# Entry and exit bars of the trades of every symbol, as (bars x symbols) boolean arrays, from the opening
+# and closing signals of the strategy. Trades are paired like in the reports of every symbol (see find_trades).
+# With exit rules (and the candles of every symbol, and the average true range if the rules use it), trades
+# also exit at their stops within a bar and open again after them like in simulate_trades (see
+# find_stop_trades), and exit_prices has the price they exit at on their exit bars. It is NaN on the bars
+# where trades exit at the open.
+def signals_to_trades(opening_signals : np.ndarray,
+                      closing_signals : np.ndarray,
+                      open : np.ndarray = None,
+                      high : np.ndarray = None,
+                      low : np.ndarray = None,
+                      exit_rules : ExitRules = None,
+                      atr : np.ndarray = None,
+                      short : bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    exit_prices = np.full(shape=opening_signals.shape, fill_value=np.nan)
+    if exit_rules is not None:
+        sign = 1.0
+        if short:
+            sign = -1.0
+            open, high, low = -open, -low, -high
+        entries, exits, stop_prices, columns = find_stop_trades(opening_signals, closing_signals, open, high, low, exit_rules, atr)
+        # Trades exit at the open on the bar after their closing signal, on any other bar they were stopped
+        stopped = ~closing_signals[exits - 1, columns]
+        exit_prices[exits[stopped], columns[stopped]] = sign * stop_prices[stopped]
+    else:
+        entries, exits, columns = find_trades_many(opening_signals, closing_signals)
+    entry_bars = np.zeros(shape=opening_signals.shape, dtype=bool)
+    exit_bars = np.zeros(shape=opening_signals.shape, dtype=bool)
+    entry_bars[entries, columns] = True
+    exit_bars[exits, columns] = True
+    return entry_bars, exit_bars, exit_prices
+
+# Trades at the open of their entry and exit bars, or at the exit price within their exit bar where exit_prices
+# has one (the stop exits of signals_to_trades), after the entries at the open of that bar. A trade that cannot
+# be bought (not enough capital, too many positions, or no candle on its entry bar) is skipped, and a position
+# whose exit bar has no candle is sold at the next one. With short, positions are sold short (with negative
+# shares) and bought back on their exits, and the sizing rules apply to their value. Positions are valued at
+# the last close, and the ones still open at the end are left open. Returns the equity, cash, value of the
+# positions (negative for short ones), exposure and number of positions of every bar and the trades that
+# were made ("closing-index" is -1 for the ones still open).
+def simulate_portfolio(entry_bars : np.ndarray,
+                       exit_bars : np.ndarray,
+                       open : np.ndarray,
+                       close : np.ndarray,
+                       initial_balance : float,
+                       rules : PortfolioRules = None,
+                       exit_prices : np.ndarray = None,
+                       short : bool = False) -> dict:
+    if rules is None:
+        rules = PortfolioRules()
+    length, count = entry_bars.shape
+    side = -1.0 if short else 1.0
+    cash = float(initial_balance)
+    shares = np.zeros(shape=count, dtype=np.float64)
+    last_close = np.zeros(shape=count, dtype=np.float64) # Only read for the symbols with a position
+    entry_index = np.full(shape=count, fill_value=-1)
+    entry_price = np.zeros(shape=count, dtype=np.float64)
+    exit_pending = np.zeros(shape=count, dtype=bool)
+    series = {name: np.empty(shape=length, dtype=np.float64) for name in ["equity", "cash", "invested", "exposure"]}
+    series["positions"] = np.empty(shape=length, dtype=np.int64)
+    trades = {name: [] for name in ["column", "opening-index", "closing-index", "shares", "opening-price", "closing-price"]}
+
+    def record_trades(columns : np.ndarray, closing_index : np.ndarray, closing_price : np.ndarray) -> None:
+        for name, values in [("column", columns), ("opening-index", entry_index[columns]), ("closing-index", closing_index),
+                             ("shares", shares[columns]), ("opening-price", entry_price[columns]), ("closing-price", closing_price)]:
+            trades[name].append(values)
+
+    def close_positions(columns : np.ndarray, bar : int, prices : np.ndarray) -> None:
+        nonlocal cash
+        record_trades(columns, np.full(shape=len(columns), fill_value=bar), prices)
+        cash += shares[columns] @ prices
+        shares[columns] = 0
+        exit_pending[columns] = False
+
+    for bar in range(length):
+        price = open[bar]
+        tradable = ~np.isnan(price)
+        held = shares != 0
+        stop_exits = exit_bars[bar] & ~np.isnan(exit_prices[bar]) if exit_prices is not None else np.zeros(shape=count, dtype=bool)
+        # The exits at the open go first, so that their cash can buy the entries of the same bar
+        exit_pending |= exit_bars[bar] & ~stop_exits & held
+        selling = np.flatnonzero(exit_pending & tradable)
+        if len(selling) > 0:
+            close_positions(selling, bar, price[selling])
+            held[selling] = False
+        buying = np.flatnonzero(entry_bars[bar] & tradable & ~held)
+        if len(buying) > 0:
+            invested = abs(shares[held] @ np.where(tradable, price, last_close)[held])
+            equity = cash + side * invested
+            if rules.max_positions is not None:
+                buying = buying[:max(0, rules.max_positions - np.count_nonzero(held))]
+            amount = rules.get_position_amount(equity)
+            # Positions are bought in the order of the symbols until the exposure limit is reached
+            budget = rules.max_exposure * equity - invested
+            if amount > 0 and budget > 0:
+                buying = buying[:int(budget / amount + 1e-9)]
+                new_shares = amount / price[buying]
+                if rules.whole_shares:
+                    new_shares = np.floor(new_shares)
+                bought = new_shares > 0
+                buying = buying[bought]
+                shares[buying] = side * new_shares[bought]
+                entry_index[buying] = bar
+                entry_price[buying] = price[buying]
+                cash -= shares[buying] @ price[buying]
+        # The stops are hit within the bar, after the entries at its open
+        stopping = np.flatnonzero(stop_exits & (shares != 0))
+        if len(stopping) > 0:
+            close_positions(stopping, bar, exit_prices[bar, stopping])
+        last_close = np.where(np.isnan(close[bar]), last_close, close[bar])
+        invested = shares @ last_close
+        series["equity"][bar] = cash + invested
+        series["cash"][bar] = cash
+        series["invested"][bar] = invested
+        series["exposure"][bar] = abs(invested) / (cash + invested) if cash + invested != 0 else np.nan
+        series["positions"][bar] = np.count_nonzero(shares)
+
+    still_open = np.flatnonzero(shares != 0)
+    record_trades(still_open, np.full(shape=len(still_open), fill_value=-1), np.full(shape=len(still_open), fill_value=np.nan))
+    series["trades"] = {name: np.concatenate(values) for name, values in trades.items()}
+    return series
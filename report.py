@@ -0,0 +1,106 @@
+from typing import Callable
+
+import json
+import os
+import pandas as pd
+import time
+
+# Writes the trades of every symbol to a CSV file as the symbols finish, a few thousand rows at a time,
+# instead of keeping the whole report in memory until the end. The rows are also written every
+# flush_symbols symbols and every flush_seconds seconds, so that an interrupted run with few trades
+# loses little. Next to the report, a progress file records the symbols written and the size of the
+# report after every write, once the rows are on disk, so that an interrupted run can be resumed: the
+# symbols already written are skipped and anything written after the last recorded size (a write that
+# was cut short) is removed.
+#
+#   with ReportWriter("report.csv", REPORT_COLUMNS, resume=True) as writer:
+#       symbols = [symbol for symbol in symbols if symbol not in writer.done_symbols]
+#       for symbol in symbols:
+#           writer.write(symbol, get_report(symbol))
+class ReportWriter:
+
+    def __init__(self, file_name : str,
+                 columns : list,
+                 resume : bool = False,
+                 flush_rows : int = 10000,
+                 flush_symbols : int = 100,
+                 flush_seconds : float = 30.0,
+                 clock : Callable = time.monotonic) -> None:
+        self.file_name = file_name
+        self.progress_file_name = file_name + ".progress"
+        self.columns = columns
+        self.flush_rows = flush_rows
+        self.flush_symbols = flush_symbols
+        self.flush_seconds = flush_seconds
+        self.clock = clock
+        self.flushed = clock() # Time of the last write
+        self.done_symbols = set() # Symbols already in the report
+        self.rows = 0 # Rows written by this writer
+        self.reports = []
+        self.pending_symbols = []
+        self.pending_rows = 0
+        if resume:
+            self.__load_progress()
+        else:
+            for name in [self.file_name, self.progress_file_name]:
+                if os.path.exists(name):
+                    os.remove(name)
+
+    def __load_progress(self) -> None:
+        size = 0
+        if os.path.exists(self.progress_file_name):
+            with open(self.progress_file_name, "r") as file:
+                for line in file:
+                    try:
+                        progress = json.loads(line)
+                    except ValueError: # The last line may have been cut short
+                        break
+                    self.done_symbols.update(progress["symbols"])
+                    size = progress["size"]
+        if os.path.exists(self.file_name):
+            with open(self.file_name, "r+b") as file:
+                file.truncate(size)
+
+    # Adds the trades of a symbol (its report may be empty, the symbol is still recorded as done)
+    def write(self, symbol : str, report : pd.DataFrame) -> None:
+        if len(report) > 0:
+            self.reports.append(report)
+            self.pending_rows += len(report)
+        self.pending_symbols.append(symbol)
+        if (self.pending_rows >= self.flush_rows or len(self.pending_symbols) >= self.flush_symbols
+                or self.clock() - self.flushed >= self.flush_seconds):
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.pending_symbols) == 0:
+            return
+        new_file = not os.path.exists(self.file_name) or os.path.getsize(self.file_name) == 0
+        if len(self.reports) > 0 or new_file:
+            report = pd.concat(self.reports, ignore_index=True) if len(self.reports) > 0 else pd.DataFrame(columns=self.columns)
+            with open(self.file_name, "a", newline="") as file:
+                report.to_csv(file, header=new_file, index=False)
+                file.flush()
+                os.fsync(file.fileno())
+        # The symbols only count as written once their rows are on disk
+        with open(self.progress_file_name, "a") as file:
+            file.write(json.dumps({"symbols": self.pending_symbols, "size": os.path.getsize(self.file_name)}) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        self.flushed = self.clock()
+        self.done_symbols.update(self.pending_symbols)
+        self.rows += self.pending_rows
+        self.reports = []
+        self.pending_symbols = []
+        self.pending_rows = 0
+
+    # Writes what is left, and the header of the columns if there were no trades at all
+    def close(self) -> None:
+        self.flush()
+        if not os.path.exists(self.file_name):
+            pd.DataFrame(columns=self.columns).to_csv(self.file_name, index=False)
+
+    def __enter__(self) -> "ReportWriter":
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        self.close()
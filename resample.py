@@ -0,0 +1,158 @@
+from datamodels import CANDLE_COLUMNS, CandleStorage, MarketData, default_storage
+from enums import FrequencyType
+
+import instrumentation
+import json
+import numpy as np
+import os.path
+import pandas as pd
+
+# Builds the candles of a higher timeframe from a finer series: the open of the first candle, the
+# highest high, the lowest low, the close of the last candle and the total volume of each bar.
+# The bars follow the sessions of the exchange (New York time): intraday bars start at the open
+# (9:30) and never span two days, daily bars hold the candles of a date, weekly bars start on
+# Monday and monthly bars on the first of the month. Every bar is dated when it starts, like
+# the candles of the API.
+#
+# Derived series are cached (see get_resampled) with the candles they were built from, so they
+# are extended when the finer series grows instead of being downloaded again.
+
+SESSION_TIMEZONE = "America/New_York"
+SESSION_OPEN_MINUTES = 9 * 60 + 30
+SESSION_CLOSE_MINUTES = 16 * 60
+
+# Finer series each frequency is derived from by get_market_data. Only the ones the API returns over the
+# same period are derived, monthly bars are still downloaded since the daily candles cover half the years.
+def get_base_frequency(frequency_type : FrequencyType, frequency : int) -> tuple[FrequencyType, int]:
+    if (frequency_type == FrequencyType.Minute and frequency in (5, 10, 15, 30)):
+        return (FrequencyType.Minute, 1)
+    if (frequency_type == FrequencyType.Weekly):
+        return (FrequencyType.Daily, 1)
+    return None
+
+# Whether the bars of a frequency can be built from the candles of another one
+def can_resample(base_frequency_type : FrequencyType, base_frequency : int, frequency_type : FrequencyType, frequency : int) -> bool:
+    if (frequency_type == FrequencyType.Minute):
+        return base_frequency_type == FrequencyType.Minute and frequency % base_frequency == 0
+    # Daily and longer bars only group candles into longer bars
+    return base_frequency_type == FrequencyType.Minute or base_frequency_type.value < frequency_type.value
+
+# Start of the bar each candle belongs to, as local time of the session in nanoseconds
+def get_bar_starts(timestamps : np.ndarray, frequency_type : FrequencyType, frequency : int) -> np.ndarray:
+    index = pd.DatetimeIndex(np.asarray(timestamps).astype("datetime64[ms]")).tz_localize("UTC").tz_convert(SESSION_TIMEZONE)
+    local = index.tz_localize(None).as_unit("ns").asi8
+    day_length = 24 * 60 * 60 * 10**9
+    days = local // day_length
+    if (frequency_type == FrequencyType.Minute):
+        bar_length = frequency * 60 * 10**9
+        session_open = days * day_length + SESSION_OPEN_MINUTES * 60 * 10**9
+        return session_open + (local - session_open) // bar_length * bar_length
+    if (frequency_type == FrequencyType.Daily):
+        return days * day_length
+    if (frequency_type == FrequencyType.Weekly):
+        # The epoch was a Thursday, three days after a Monday
+        return (days - (days + 3) % 7) * day_length
+    if (frequency_type == FrequencyType.Monthly):
+        return local.astype("datetime64[ns]").astype("datetime64[M]").astype("datetime64[ns]").astype(np.int64)
+    raise NotImplementedError(f"Frequency type {frequency_type.name} has not been implemented.")
+
+# Bars of a frequency built from the candles of market_data
+def resample(market_data : MarketData, frequency_type : FrequencyType, frequency : int) -> MarketData:
+    if (not can_resample(market_data.frequency_type, market_data.frequency, frequency_type, frequency)):
+        raise ValueError(f"{market_data.frequency} {market_data.frequency_type.name} candles cannot be resampled "
+                         f"to {frequency} {frequency_type.name}.")
+    with instrumentation.stage("resample", market_data.symbol, bars=market_data.get_length()) as resample_stage:
+        starts = get_bar_starts(market_data.get_timestamps(), frequency_type, frequency)
+        # The candles are sorted, so every bar is a run of candles with the same start
+        first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]]) if len(starts) > 0 else np.empty(0, dtype=np.intp)
+        last = np.r_[first[1:], len(starts)] - 1
+        columns = {}
+        if (len(first) > 0):
+            columns["open"] = market_data.get_column("open")[first]
+            columns["high"] = np.maximum.reduceat(market_data.get_column("high"), first)
+            columns["low"] = np.minimum.reduceat(market_data.get_column("low"), first)
+            columns["close"] = market_data.get_column("close")[last]
+            columns["volume"] = np.add.reduceat(market_data.get_column("volume"), first)
+        else:
+            columns = {column: np.empty(0, dtype=np.int64 if column == "volume" else np.float64) for column in CANDLE_COLUMNS}
+        local_starts = pd.DatetimeIndex(starts[first].astype("datetime64[ns]"))
+        # Bars start during the day, where the local times are never ambiguous
+        columns["datetime"] = MarketData.index_to_timestamps(local_starts.tz_localize(SESSION_TIMEZONE))
+        resample_stage.add(resampled_bars=len(first))
+        return MarketData(market_data.symbol, columns, frequency_type, frequency)
+
+# Extends the bars resampled from the first candles of market_data with the ones after them. The last
+# bar may have been built before all of its candles existed, so it is built again.
+def extend_resampled(resampled : MarketData, market_data : MarketData) -> MarketData:
+    if (resampled.get_length() == 0):
+        return resample(market_data, resampled.frequency_type, resampled.frequency)
+    last_start = resampled.get_timestamps()[-1]
+    new_candles = MarketData(market_data.symbol,
+                             {column: values[market_data.get_timestamps() >= last_start]
+                              for column, values in get_columns(market_data).items()},
+                             market_data.frequency_type,
+                             market_data.frequency)
+    new_bars = get_columns(resample(new_candles, resampled.frequency_type, resampled.frequency))
+    columns = {column: np.concatenate([values[:-1], new_bars[column]]) for column, values in get_columns(resampled).items()}
+    return MarketData(market_data.symbol, columns, resampled.frequency_type, resampled.frequency)
+
+def get_columns(market_data : MarketData) -> dict:
+    columns = {column: market_data.get_column(column) for column in CANDLE_COLUMNS}
+    columns["datetime"] = market_data.get_timestamps()
+    return columns
+
+# Where the resampled bars are cached, apart from the ones downloaded from the API
+def get_resampled_path(frequency_type : FrequencyType, frequency : int) -> str:
+    return MarketData.get_path(frequency_type, frequency).replace("json\\", "json\\Resampled\\", 1)
+
+# Describes the candles a series was resampled from, to tell when the cached bars are outdated
+def get_source(market_data : MarketData) -> dict:
+    timestamps = market_data.get_timestamps()
+    return {"frequencyType": market_data.frequency_type.name,
+            "frequency": market_data.frequency,
+            "bars": len(timestamps),
+            "first": int(timestamps[0]) if len(timestamps) > 0 else None,
+            "last": int(timestamps[-1]) if len(timestamps) > 0 else None}
+
+# Bars of a frequency resampled from market_data, from the cache when it was built from the same candles.
+# When market_data only has new candles after the ones the cache was built from, the cached bars are extended.
+def get_resampled(market_data : MarketData,
+                  frequency_type : FrequencyType,
+                  frequency : int,
+                  path : str = None,
+                  storage : CandleStorage = None) -> MarketData:
+    if (path is None):
+        path = get_resampled_path(frequency_type, frequency)
+    if (storage is None):
+        storage = default_storage
+    source_fname = path + f"\\{market_data.symbol}.source.json"
+    source = get_source(market_data)
+    cached_source = None
+    if (os.path.isfile(source_fname)):
+        with open(source_fname, "r") as file:
+            cached_source = json.load(file)
+    cached = None
+    if (cached_source is not None and storage.exists(path, market_data.symbol)):
+        cached = storage.load(path, market_data.symbol, frequency_type, frequency)
+    if (cached is not None and cached_source == source):
+        instrumentation.count("resample-cache", market_data.symbol, cache_hits=1)
+        return cached
+    if (cached is not None
+            and cached_source["frequencyType"] == source["frequencyType"] and cached_source["frequency"] == source["frequency"]
+            and cached_source["first"] == source["first"] and cached_source["last"] is not None
+            and source["last"] > cached_source["last"]):
+        instrumentation.count("resample-cache", market_data.symbol, extensions=1)
+        resampled = extend_resampled(cached, market_data)
+    else:
+        instrumentation.count("resample-cache", market_data.symbol, misses=1)
+        resampled = resample(market_data, frequency_type, frequency)
+    # Unmaps the cached files, which Windows can not replace while they are mapped (the resampled bars are new
+    # arrays), and only trusts them again once they are saved
+    del cached
+    if (os.path.isfile(source_fname)):
+        os.remove(source_fname)
+    resampled.save(path=path, storage=storage)
+    # Written after the bars, so that a partial save is never taken as up to date
+    with open(source_fname, "w") as file:
+        json.dump(source, file)
+    return resampled
@@ -0,0 +1,154 @@
+from typing import Callable
+
+import instrumentation
+import multiprocessing
+import random
+import requests
+import threading
+import time
+
+# Sends the requests to the API within its rate limit, retrying the ones that are throttled (429)
+# or fail on the server (5xx) or on the way (connection errors, timeouts) after a growing delay.
+#
+#   scheduler = RequestScheduler(requests_per_minute=120)
+#   response = scheduler.send(lambda: session.get(url, params=params), symbol)
+#
+# Every request first takes a token from a bucket that refills at the allowed rate, so concurrent
+# downloads of many symbols spread themselves over time instead of tripping the limit. A throttled
+# response also empties the bucket, which makes every other request wait too.
+
+# Statuses worth sending the same request again for
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# A request that failed for good, after its retries
+class RequestError(Exception):
+
+    def __init__(self, message : str, symbol : str = None, status_code : int = None, attempts : int = 1) -> None:
+        Exception.__init__(self, message)
+        self.symbol = symbol
+        self.status_code = status_code
+        self.attempts = attempts
+
+# Allows rate requests per second on average and up to capacity requests at once. A shared bucket keeps
+# its tokens in shared memory, so that it limits the requests of every process it is handed to (as an
+# argument of the process, like the initargs of a ProcessPoolExecutor) together, and not each one apart.
+class TokenBucket:
+
+    def __init__(self, rate : float, capacity : float, clock : Callable = time.monotonic, sleep : Callable = time.sleep, shared : bool = False) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        # The tokens and the time they were counted at
+        if shared:
+            self.state = multiprocessing.Array("d", [capacity, clock()])
+            self.lock = self.state.get_lock()
+        else:
+            self.state = [capacity, clock()]
+            self.lock = threading.Lock()
+
+    @property
+    def tokens(self) -> float:
+        return self.state[0]
+
+    @tokens.setter
+    def tokens(self, tokens : float) -> None:
+        self.state[0] = tokens
+
+    @property
+    def updated(self) -> float:
+        return self.state[1]
+
+    @updated.setter
+    def updated(self, updated : float) -> None:
+        self.state[1] = updated
+
+    def __refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Waits until a token is available and takes it, returns the seconds waited
+    def acquire(self) -> float:
+        waited = 0.0
+        while True:
+            with self.lock:
+                self.__refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+    # No token is given for the next seconds
+    def pause(self, seconds : float) -> None:
+        with self.lock:
+            self.__refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+# How many times and after how long a failed request is sent again. The delays grow exponentially
+# and are drawn at random below that bound (full jitter), so the retries of concurrent requests
+# do not all arrive at once. A Retry-After header sets the delay instead.
+class RetryPolicy:
+
+    def __init__(self, max_retries : int = 5,
+                 base_delay : float = 0.5,
+                 max_delay : float = 30.0,
+                 retry_statuses : set = RETRY_STATUSES,
+                 seed : int = None) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.random = random.Random(seed)
+
+    def get_delay(self, retry : int, response : requests.Response = None) -> float:
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                return min(self.max_delay, float(response.headers["Retry-After"]))
+            except ValueError: # Retry-After can also be a date
+                pass
+        return self.random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+
+# With shared, the rate limit is kept by a shared TokenBucket and holds for the requests of every process
+# the scheduler is handed to, all together.
+class RequestScheduler:
+
+    def __init__(self, requests_per_minute : float = 120,
+                 burst : int = 10,
+                 retry_policy : RetryPolicy = None,
+                 clock : Callable = time.monotonic,
+                 sleep : Callable = time.sleep,
+                 shared : bool = False) -> None:
+        self.bucket = TokenBucket(requests_per_minute / 60, burst, clock, sleep, shared)
+        self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        self.sleep = sleep
+
+    # Sends a request (a function returning the response) until it succeeds or cannot be retried anymore.
+    # Returns the last response, which may be an error that is not retried (like 400), and raises
+    # RequestError if the request could not be sent or was still failing after the last retry.
+    def send(self, request : Callable, symbol : str = None) -> requests.Response:
+        policy = self.retry_policy
+        for retry in range(policy.max_retries + 1):
+            self.bucket.acquire()
+            response = None
+            try:
+                response = request()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if retry == policy.max_retries:
+                    raise RequestError(f"Request failed after {retry + 1} attempts: {type(e).__name__}: {e}", symbol, None, retry + 1)
+            if response is not None:
+                if response.status_code not in policy.retry_statuses:
+                    return response
+                if retry == policy.max_retries:
+                    raise RequestError(f"Request failed after {retry + 1} attempts with status {response.status_code}: {response.text[:200]}",
+                                       symbol, response.status_code, retry + 1)
+            delay = policy.get_delay(retry, response)
+            throttled = response is not None and response.status_code == 429
+            instrumentation.count("http-retry", symbol, retries=1, throttled=1 if throttled else 0, delay_seconds=delay)
+            if throttled:
+                # The limit applies to every request, so they all wait (this one in the next acquire)
+                self.bucket.pause(delay)
+            else:
+                self.sleep(delay)
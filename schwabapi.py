@@ -1,21 +1,54 @@
 import base64
-from datamodels import MarketData
+import copy
+from concurrent.futures import ThreadPoolExecutor
+from datamodels import MarketData, decode_candles
 from enums import PeriodType, FrequencyType
+from requests.adapters import HTTPAdapter
+from scheduler import RequestError, RequestScheduler
+from typing import Union
+import instrumentation
 import json 
+import os
 import requests
+import threading
 import time
 import webbrowser
 
+API_URL = "https://api.schwabapi.com"
+TOKENS_FILE = "tokens.json"
+ACCESS_TOKEN_LIFETIME = 1800 # Seconds an access token is valid for (30 minutes)
+
 class SchwabAPIClient:
-    def __init__(self) -> None:
+    def __init__(self, base_url : str = API_URL,
+                 max_connections : int = 10,
+                 scheduler : RequestScheduler = None,
+                 timeout : float = 30.0,
+                 token_lock = None) -> None:
         self.key, self.secret = self.__load_credentials()
+        self.base_url = base_url
         self.start_time = 0
         self.end_time = 0
+        # One session for every request so the TCP/TLS connections are reused
+        self.session = requests.Session()
+        self.session.mount(base_url, HTTPAdapter(pool_connections=1, pool_maxsize=max_connections))
+        # Every request goes through the scheduler, which keeps them within the rate limit and retries them.
+        # An expired access token (401) is also retried, once the token has been refreshed.
+        # The scheduler given is copied with its own retry policy, which leaves the caller's one as it was
+        # (a shallow copy, so that its rate limit is still shared with the other users of the scheduler).
+        self.scheduler = RequestScheduler() if scheduler is None else copy.copy(scheduler)
+        self.scheduler.retry_policy = copy.copy(self.scheduler.retry_policy)
+        self.scheduler.retry_policy.retry_statuses = self.scheduler.retry_policy.retry_statuses | {401}
+        self.timeout = timeout
+        # Concurrent requests that find the access token expired refresh it only once. A lock shared by
+        # several processes (a multiprocessing.Lock) makes them refresh it only once between them all.
+        self.token_lock = threading.Lock() if token_lock is None else token_lock
+        self.expiration = 0
         tokens_dict = self.__load_tokens()
         try:
             self.refresh_token = tokens_dict["refresh_token"]
             self.access_token = tokens_dict["access_token"]
             expiration = tokens_dict["expiration"]
+            self.expiration = expiration
             seconds_until_exp = expiration - time.time()
             # Tokens found already expired
             if (seconds_until_exp <= 0):
@@ -32,7 +65,7 @@ class SchwabAPIClient:
         return (data["key"], data["secret"])
 
     def __construct_init_auth_url(self) -> tuple[str, str, str]:
-        auth_url = f"https://api.schwabapi.com/v1/oauth/authorize?client_id={self.key}&redirect_uri=https://127.0.0.1"
+        auth_url = f"{self.base_url}/v1/oauth/authorize?client_id={self.key}&redirect_uri=https://127.0.0.1"
 
         print("Click to authenticate:")
         print(auth_url)
@@ -41,7 +74,7 @@ class SchwabAPIClient:
     
     def __load_tokens(self) -> dict:
         try:
-            with open("tokens.json") as file:
+            with open(TOKENS_FILE) as file:
                 return json.load(file) 
         except:
             print("No tokens were found")
@@ -68,8 +101,8 @@ class SchwabAPIClient:
 
 
     def __retrieve_tokens(self, headers, payload) -> dict:
-        init_token_response = requests.post(
-            url="https://api.schwabapi.com/v1/oauth/token",
+        init_token_response = self.session.post(
+            url=f"{self.base_url}/v1/oauth/token",
             headers=headers,
             data=payload,
         )
@@ -77,6 +110,24 @@ class SchwabAPIClient:
         init_tokens_dict = init_token_response.json()
 
         return init_tokens_dict
+
+    # Keeps the new tokens and writes them to the tokens file. The file is replaced at once, so that other
+    # processes never read it half written.
+    def __save_tokens(self, tokens_dict : dict) -> None:
+        self.refresh_token = tokens_dict["refresh_token"]
+        self.access_token = tokens_dict["access_token"]
+        self.expiration = time.time() + ACCESS_TOKEN_LIFETIME
+
+        custom_dict = {}
+        custom_dict["refresh_token"] = tokens_dict["refresh_token"]
+        custom_dict["access_token"] = tokens_dict["access_token"]
+        custom_dict["id_token"] = tokens_dict["id_token"]
+        custom_dict["expiration"] = self.expiration
+
+        temporary_file = f"{TOKENS_FILE}.{os.getpid()}.tmp"
+        with open(temporary_file, "w", encoding="utf-8") as file:
+            json.dump(custom_dict, file, ensure_ascii=False, indent=4)
+        os.replace(temporary_file, TOKENS_FILE)
         
     def refresh_tokens(self) -> None:
         print("Initializing...")
@@ -90,30 +141,41 @@ class SchwabAPIClient:
             "Content-Type": "application/x-www-form-urlencoded",
         }
 
-        refresh_token_response = requests.post(
-            url="https://api.schwabapi.com/v1/oauth/token",
-            headers=headers,
-            data=payload,
-        )
+        with instrumentation.stage("token-refresh", http_calls=1):
+            refresh_token_response = self.session.post(
+                url=f"{self.base_url}/v1/oauth/token",
+                headers=headers,
+                data=payload,
+            )
         if refresh_token_response.status_code == 200:
             print("Retrieved new tokens successfully using refresh token.")
         else:
             print(f"Error refreshing access token: {refresh_token_response.text}")
             return None
 
-        refresh_token_dict = refresh_token_response.json()
-
-        custom_dict = {}
-        custom_dict["refresh_token"] = refresh_token_dict["refresh_token"]
-        custom_dict["access_token"] = refresh_token_dict["access_token"]
-        custom_dict["id_token"] = refresh_token_dict["id_token"]
-        custom_dict["expiration"] = self.start_time + 1800
-
-        with open("tokens.json", "w", encoding="utf-8") as file:
-            json.dump(custom_dict, file, ensure_ascii=False, indent=4)
+        self.__save_tokens(refresh_token_response.json())
         
         print("Tokens refreshed successfully")
 
+    # Refreshes the tokens unless another request already did it since access_token was read. A request
+    # of another process leaves its new tokens in the tokens file, which are taken from there instead.
+    def refresh_tokens_once(self, access_token : str) -> None:
+        with self.token_lock:
+            tokens_dict = self.__load_tokens()
+            if tokens_dict.get("access_token", access_token) != access_token:
+                self.refresh_token = tokens_dict["refresh_token"]
+                self.access_token = tokens_dict["access_token"]
+                self.expiration = tokens_dict["expiration"]
+            elif self.access_token == access_token:
+                self.refresh_tokens()
+
+    # Access token to send, refreshed first if it is about to expire
+    def get_access_token(self) -> str:
+        access_token = self.access_token
+        if self.expiration - time.time() <= 60:
+            self.refresh_tokens_once(access_token)
+        return self.access_token
+
     def first_time_setup(self) -> None:
         cs_auth_url = self.__construct_init_auth_url()
         webbrowser.open(cs_auth_url)
@@ -127,14 +189,7 @@ class SchwabAPIClient:
         self.start_time = time.time()
         self.end_time = self.start_time + 1500 # Expiration will be in 25 minutes (1500 seconds)
 
-        custom_dict = {}
-        custom_dict["refresh_token"] = init_tokens_dict["refresh_token"]
-        custom_dict["access_token"] = init_tokens_dict["access_token"]
-        custom_dict["id_token"] = init_tokens_dict["id_token"]
-        custom_dict["expiration"] = self.start_time + 1800
-
-        with open("tokens.json", "w", encoding="utf-8") as file:
-            json.dump(custom_dict, file, ensure_ascii=False, indent=4)
+        self.__save_tokens(init_tokens_dict)
         
         print("Tokens obtained successfully")
 
@@ -147,8 +202,8 @@ class SchwabAPIClient:
                         end_date : int = None,
                         need_extended_hours_data : bool = None,
                         need_previous_close : bool = None) -> MarketData:
-        
-        endpoint = "https://api.schwabapi.com/marketdata/v1/pricehistory"
+        # Raises RequestError when the price history could not be obtained
+        endpoint = f"{self.base_url}/marketdata/v1/pricehistory"
 
         payload = {
                 "symbol": symbol,
@@ -165,27 +220,83 @@ class SchwabAPIClient:
             payload["needExtendedHoursData"] = need_extended_hours_data
         if (need_previous_close != None):
             payload["needPreviousClose"] = need_previous_close
-        headers = {
-            "Authorization": f"Bearer {self.access_token}"
-        }
 
-        price_history_response = requests.get(
-                url=endpoint,
-                headers=headers,
-                params=payload,
-            )
+        def send_request() -> requests.Response:
+            access_token = self.get_access_token()
+            headers = {
+                "Authorization": f"Bearer {access_token}"
+            }
+            with instrumentation.stage("http-request", symbol, http_calls=1) as request_stage:
+                response = self.session.get(
+                        url=endpoint,
+                        headers=headers,
+                        params=payload,
+                        timeout=self.timeout,
+                    )
+                request_stage.add(bytes_read=len(response.content))
+            if response.status_code == 401:
+                self.refresh_tokens_once(access_token)
+            return response
+
+        price_history_response = self.scheduler.send(send_request, symbol)
         
         if price_history_response.status_code != 200:
-            print(f"Error obtaining price history: {price_history_response.text}")
-            return None
+            raise RequestError(f"Error obtaining price history of {symbol} (status {price_history_response.status_code}): {price_history_response.text[:200]}",
+                               symbol,
+                               price_history_response.status_code)
         
-        price_history_dict = price_history_response.json()
+        with instrumentation.stage("decode", symbol, bytes_read=len(price_history_response.content)) as decode_stage:
+            price_history = MarketData(
+                symbol,
+                decode_candles(price_history_response.content),
+                frequency_type,
+                frequency
+            )
+            decode_stage.add(bars=price_history.get_length())
 
-        price_history = MarketData(
-            symbol,
-            price_history_dict["candles"],
-            frequency_type,
-            frequency
-        )
+        return price_history
 
-        return price_history
\ No newline at end of file
+    # Gets the price history of several symbols concurrently over the pooled session.
+    # start_date can also be a dictionary with the start date of each symbol (symbols not in it have none).
+    # Symbols whose request fails are left out of the result, with their error in errors (if given).
+    def get_price_history_many(self, symbols : list,
+                               period_type : PeriodType,
+                               period : int,
+                               frequency_type : FrequencyType,
+                               frequency : int,
+                               start_date : Union[int, dict] = None,
+                               end_date : int = None,
+                               need_extended_hours_data : bool = None,
+                               need_previous_close : bool = None,
+                               max_workers : int = 8,
+                               errors : dict = None) -> dict[str, MarketData]:
+        def get_one(symbol : str) -> Union[MarketData, RequestError]:
+            symbol_start_date = start_date
+            symbol_end_date = end_date
+            if isinstance(start_date, dict):
+                symbol_start_date = start_date.get(symbol)
+                # Symbols without a start date get the whole period
+                if symbol_start_date is None:
+                    symbol_end_date = None
+            try:
+                return self.get_price_history(symbol,
+                                              period_type,
+                                              period,
+                                              frequency_type,
+                                              frequency,
+                                              symbol_start_date,
+                                              symbol_end_date,
+                                              need_extended_hours_data,
+                                              need_previous_close)
+            except RequestError as e:
+                return e
+        price_histories = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for symbol, price_history in zip(symbols, executor.map(get_one, symbols)):
+                if isinstance(price_history, RequestError):
+                    print(f"Error obtaining price history of {symbol}: {price_history}")
+                    if errors is not None:
+                        errors[symbol] = price_history
+                else:
+                    price_histories[symbol] = price_history
+        return price_histories
@@ -0,0 +1,124 @@
+from datamodels import CANDLE_COLUMNS, MarketData
+from enums import FrequencyType
+from multiprocessing import shared_memory
+from typing import Union
+
+import numpy as np
+
+# Candles shared between the processes of a backtest. The parent process copies the columns of each
+# market data once into a block of shared memory, and the worker processes attach to the blocks and
+# read the columns in place, as read-only MarketData views, instead of unpickling their own copy.
+#
+#   with SharedCandleStore() as store:
+#       handles = [store.add(market_data) for market_data in market_datas]
+#       # in the workers (the handles are small and can be pickled)
+#       market_datas = [handle.attach() for handle in handles]
+#
+# The prices can be stored as float32 to halve the memory of the blocks. The studies calculate in
+# float64 anyway, so only the precision of the stored prices is lost.
+
+# Bytes every column starts at a multiple of
+ALIGNMENT = 64
+
+# Blocks this process attached to, kept open (and mapped) while the views of their columns are used
+_attached = {}
+
+# dtype of each column of the candles when the prices are stored as price_dtype
+def get_column_dtypes(price_dtype : np.dtype) -> dict:
+    return {column: np.dtype(np.int64) if column in ["volume", "datetime"] else np.dtype(price_dtype)
+            for column in CANDLE_COLUMNS + ["datetime"]}
+
+# Where each column is in a block: its offset in bytes and its dtype
+def get_layout(bars : int, price_dtype : np.dtype) -> tuple[dict, int]:
+    layout = {}
+    offset = 0
+    for column, dtype in get_column_dtypes(price_dtype).items():
+        layout[column] = (offset, dtype)
+        offset += -(-bars * dtype.itemsize // ALIGNMENT) * ALIGNMENT
+    return layout, offset
+
+def get_columns(buffer : memoryview, bars : int, price_dtype : np.dtype) -> dict:
+    layout = get_layout(bars, price_dtype)[0]
+    return {column: np.ndarray(shape=(bars,), dtype=dtype, buffer=buffer, offset=offset)
+            for column, (offset, dtype) in layout.items()}
+
+# Attaches to a block created by another process. The process that created it unlinks it, so this one
+# does not track it. Before Python 3.13 it cannot opt out, but the worker processes share the resource
+# tracker of their parent, where registering the block again changes nothing.
+def attach_block(name : str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+# What a worker needs to attach to the candles of a market data in a store
+class SharedMarketData:
+
+    def __init__(self, name : str, symbol : str, frequency_type : FrequencyType, frequency : int, bars : int, price_dtype : np.dtype) -> None:
+        self.name = name # Name of the block of shared memory
+        self.symbol = symbol
+        self.frequency_type = frequency_type
+        self.frequency = frequency
+        self.bars = bars
+        self.price_dtype = np.dtype(price_dtype)
+
+    # Read-only MarketData whose columns are views of the shared block (nothing is copied)
+    def attach(self) -> MarketData:
+        if (self.name not in _attached):
+            _attached[self.name] = attach_block(self.name)
+        columns = get_columns(_attached[self.name].buf, self.bars, self.price_dtype)
+        for values in columns.values():
+            values.flags.writeable = False
+        return MarketData(self.symbol, columns, self.frequency_type, self.frequency)
+
+# Creates and owns the blocks of shared memory, which are removed when the store is closed
+class SharedCandleStore:
+
+    def __init__(self, price_dtype : Union[type, np.dtype] = np.float64) -> None:
+        if (np.dtype(price_dtype) not in [np.dtype(np.float64), np.dtype(np.float32)]):
+            raise ValueError(f"Prices can be stored as float64 or float32, not {np.dtype(price_dtype)}.")
+        self.price_dtype = np.dtype(price_dtype)
+        self.blocks = []
+        self.handles = {} # Handles by the id of the market data they were created from
+
+    # Copies the candles of a market data to a new block and returns the handle to attach to it
+    def add(self, market_data : MarketData) -> SharedMarketData:
+        if (id(market_data) in self.handles):
+            return self.handles[id(market_data)]
+        bars = market_data.get_length()
+        layout, size = get_layout(bars, self.price_dtype)
+        # Shared memory cannot be empty
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.blocks.append(block)
+        columns = get_columns(block.buf, bars, self.price_dtype)
+        for column, values in columns.items():
+            source = market_data.get_timestamps() if column == "datetime" else market_data.get_column(column)
+            values[:] = np.asarray(source).astype(values.dtype, copy=False)
+        # The arrays must not export the buffer anymore, or the block cannot be closed
+        del columns, values
+        handle = SharedMarketData(block.name, market_data.symbol, market_data.frequency_type, market_data.frequency, bars, self.price_dtype)
+        self.handles[id(market_data)] = handle
+        return handle
+
+    # Bytes of shared memory used by the store
+    def get_size(self) -> int:
+        return sum(block.size for block in self.blocks)
+
+    # Removes the blocks. Views attached in this process must not be used after that.
+    def close(self) -> None:
+        for block in self.blocks:
+            if (block.name in _attached):
+                try:
+                    _attached.pop(block.name).close()
+                except BufferError: # Views still in use keep the memory mapped until they are freed
+                    pass
+            block.close()
+            block.unlink()
+        self.blocks = []
+        self.handles = {}
+
+    def __enter__(self) -> "SharedCandleStore":
+        return self
+
+    def __exit__(self, exception_type, exception, traceback) -> None:
+        self.close()
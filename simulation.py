@@ -0,0 +1,250 @@
+from enums import AverageType
+
+import numpy as np
+
+
+# Pairs the opening and closing signals into trades.
+# A signal on bar i - 1 opens (or closes) the position at the open of bar i, so the closing
+# signals split the bars into intervals (exit[j - 1], exit[j]]. While flat, the first opening
+# signal in an interval opens a trade that is closed at exit[j]; any other opening signal in
+# the same interval happens while that trade is still open and is ignored.
+# With keep_unclosed, a trade without a closing signal after it is kept, with its exit at the
+# number of bars (past the last one).
+def find_trades(opening_signals : np.ndarray, closing_signals : np.ndarray, keep_unclosed : bool = False) -> tuple[np.ndarray, np.ndarray]:
+    entries, exits, columns = find_trades_many(opening_signals[:, None], closing_signals[:, None], keep_unclosed)
+    return entries, exits
+
+# Same as find_trades for 2-D signals (bars x columns), where each column is simulated on its own.
+# Returns the entry and exit bars of every trade and the column it belongs to.
+def find_trades_many(opening_signals : np.ndarray, closing_signals : np.ndarray, keep_unclosed : bool = False) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    length, count = opening_signals.shape
+    # Number the bars of all the columns one after the other
+    columns, bars = np.nonzero(opening_signals[:-1].T)
+    entries = columns * length + bars + 1
+    columns, bars = np.nonzero(closing_signals[:-1].T)
+    exits = columns * length + bars + 1
+    # The end of each column also ends an interval, one without a closing signal
+    column_ends = np.arange(1, count + 1) * length
+    exits = np.sort(np.concatenate([exits, column_ends]))
+    interval = np.searchsorted(exits, entries, side="left")
+    first_in_interval = np.ones(len(entries), dtype=bool)
+    first_in_interval[1:] = interval[1:] != interval[:-1]
+    entries = entries[first_in_interval]
+    exits = exits[interval[first_in_interval]]
+    # A trade without a closing signal after it is discarded (its exit is the end of the column),
+    # and so is one where the closing and opening condition occur simultaneously
+    valid = (keep_unclosed | (exits % max(length, 1) != 0)) & (entries != exits)
+    entries = entries[valid]
+    exits = exits[valid]
+    columns = entries // max(length, 1)
+    return entries - columns * length, exits - columns * length, columns
+
+# Exits of a trade before its closing signal, given in the "closing" entry of the strategy file.
+# Every exit is a distance from a price, either a percentage of it or a multiple of the average true
+# range on the bar before the entry (the bar of the opening signal):
+# {"condition": "...", "stopLoss": {"percent": 5}, "takeProfit": {"atr": 3}, "trailingStop": {"percent": 8},
+#  "atrLength": 14, "atrAverageType": "Wilders"}
+# The stop loss and take profit are distances from the entry price, the trailing stop is a distance from
+# the best price since the entry (the entry price or the best high of the bars before).
+class ExitRules:
+
+    def __init__(self, stop_loss : dict = None,
+                 take_profit : dict = None,
+                 trailing_stop : dict = None,
+                 atr_length : int = 14,
+                 atr_average_type : AverageType = AverageType.Wilders) -> None:
+        for name, distance in [("stopLoss", stop_loss), ("takeProfit", take_profit), ("trailingStop", trailing_stop)]:
+            if distance is not None and (len(distance) != 1 or next(iter(distance)) not in ["percent", "atr"]):
+                raise ValueError(f"The {name} exit must be either {{\"percent\": value}} or {{\"atr\": value}}, not {distance}.")
+        self.stop_loss = stop_loss
+        self.take_profit = take_profit
+        self.trailing_stop = trailing_stop
+        self.atr_length = atr_length
+        self.atr_average_type = atr_average_type
+
+    # Exit rules of the closing entry of a strategy file, None if it has none
+    def from_dict(closing_dict : dict) -> "ExitRules":
+        if all(name not in closing_dict for name in ["stopLoss", "takeProfit", "trailingStop"]):
+            return None
+        return ExitRules(closing_dict.get("stopLoss"),
+                         closing_dict.get("takeProfit"),
+                         closing_dict.get("trailingStop"),
+                         closing_dict.get("atrLength", 14),
+                         AverageType[closing_dict.get("atrAverageType", "Wilders")])
+
+    def uses_atr(self) -> bool:
+        return any(distance is not None and "atr" in distance for distance in [self.stop_loss, self.take_profit, self.trailing_stop])
+
+    # Distance from the prices for the given exit, atr being the average true range on the entry of each price
+    def get_distance(distance : dict, prices : np.ndarray, atr : np.ndarray) -> np.ndarray:
+        if "percent" in distance:
+            return distance["percent"] / 100 * np.abs(prices)
+        return distance["atr"] * atr
+
+# Finds the first bar of every trade where its stop (the stop loss or the trailing stop, whichever is
+# higher) or its take profit is hit, among the bars from its entry to the bar before its exit, and returns
+# the exit bars and prices of the trades with their stop exits. A stop is hit when the low reaches it and a
+# take profit when the high does, and the trade exits at that price, or at the open if the bar opened past
+# it. If both are hit on the same bar the stop is assumed to come first. Trades without a closing signal
+# (an exit at the number of bars) that are not stopped have a NaN exit price.
+# The bars of all the trades are laid end to end, so that the search runs over all of them at once.
+def find_stop_exits(entries : np.ndarray,
+                    exits : np.ndarray,
+                    open : np.ndarray,
+                    high : np.ndarray,
+                    low : np.ndarray,
+                    rules : ExitRules,
+                    atr : np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+    length = len(open)
+    exit_prices = np.where(exits < length, open[np.minimum(exits, length - 1)], np.nan)
+    if len(entries) == 0:
+        return exits, exit_prices
+    if rules.uses_atr() and atr is None:
+        raise ValueError("The exit rules need the average true range.")
+    sizes = exits - entries
+    starts = np.cumsum(sizes) - sizes
+    trade = np.repeat(np.arange(len(entries)), sizes)
+    bars = np.arange(len(trade)) - np.repeat(starts - entries, sizes)
+    entry_prices = open[entries]
+    entry_atr = atr[entries - 1] if atr is not None else None
+    stop = np.full(shape=len(trade), fill_value=-np.inf)
+    target = np.full(shape=len(trade), fill_value=np.inf)
+    if rules.stop_loss is not None:
+        stop = np.repeat(entry_prices - ExitRules.get_distance(rules.stop_loss, entry_prices, entry_atr), sizes)
+    if rules.take_profit is not None:
+        target = np.repeat(entry_prices + ExitRules.get_distance(rules.take_profit, entry_prices, entry_atr), sizes)
+    if rules.trailing_stop is not None:
+        # Best price before every bar: the entry price on the first bar of a trade, the highs after it.
+        # Complex numbers compare by their real part first, so with the trade as the real part a single
+        # running maximum restarts at each trade.
+        best = high[bars - 1]
+        best[starts] = entry_prices
+        trade_best = np.empty(shape=len(trade), dtype=np.complex128)
+        trade_best.real = trade
+        trade_best.imag = np.where(np.isnan(best), -np.inf, best)
+        best = np.maximum.accumulate(trade_best).imag
+        distance = ExitRules.get_distance(rules.trailing_stop, best, None if entry_atr is None else np.repeat(entry_atr, sizes))
+        stop = np.fmax(stop, best - distance)
+    stopped = low[bars] <= stop
+    hits = np.flatnonzero(stopped | (high[bars] >= target))
+    exits = exits.copy()
+    if len(hits) == 0:
+        return exits, exit_prices
+    # The first hit of every trade
+    hits = hits[np.r_[True, trade[hits][1:] != trade[hits][:-1]]]
+    exits[trade[hits]] = bars[hits]
+    exit_prices[trade[hits]] = np.where(stopped[hits],
+                                        np.fmin(open[bars[hits]], stop[hits]),
+                                        np.fmax(open[bars[hits]], target[hits]))
+    return exits, exit_prices
+
+# Trades of the signals (bars x columns) with their stop exits. After a trade exits at a stop (or its take
+# profit), the first opening signal from the bar of that exit on opens a new trade, which ends at the same
+# closing signal as the stopped one or at its own stop. The candles are 1-D, the same for every column, or
+# 2-D with the candles of every column. Returns the entry and exit bars, the exit prices and the columns of
+# the trades that were closed, by column and entry.
+def find_stop_trades(opening_signals : np.ndarray,
+                     closing_signals : np.ndarray,
+                     open : np.ndarray,
+                     high : np.ndarray,
+                     low : np.ndarray,
+                     rules : ExitRules,
+                     atr : np.ndarray = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    length, count = opening_signals.shape
+    entries, exits, columns = find_trades_many(opening_signals, closing_signals, keep_unclosed=True)
+
+    # The candles of the columns are laid end to end, each one followed by a row of NaN where the trades
+    # without a closing signal exit, and the bars of a column are numbered from its first row
+    def flatten(values : np.ndarray) -> np.ndarray:
+        if values.ndim == 1:
+            return np.r_[values, np.nan]
+        return np.vstack([values, np.full(shape=(1, count), fill_value=np.nan)]).T.ravel()
+
+    open, high, low = flatten(open), flatten(high), flatten(low)
+    atr = None if atr is None else flatten(atr)
+    stride = 0 if len(open) == length + 1 else length + 1
+    # Every opening signal of every column, as the entry it would make numbered like the bars of all the columns
+    signal_columns, signal_bars = np.nonzero(opening_signals[:-1].T)
+    signal_entries = signal_columns * (length + 1) + signal_bars + 1
+    results = []
+    while len(entries) > 0:
+        offsets = columns * stride
+        stop_exits, exit_prices = find_stop_exits(entries + offsets, exits + offsets, open, high, low, rules, atr)
+        stop_exits -= offsets
+        results.append((entries, stop_exits, exit_prices, columns))
+        stopped = stop_exits < exits
+        # The next trade of every stopped one, if an opening signal comes before its closing signal
+        column_starts = columns[stopped] * (length + 1)
+        following = np.searchsorted(signal_entries, column_starts + stop_exits[stopped] + 1, side="left")
+        next_entries = signal_entries[np.minimum(following, len(signal_entries) - 1)] if len(signal_entries) > 0 else following
+        reentered = (following < len(signal_entries)) & (next_entries < column_starts + exits[stopped])
+        entries = next_entries[reentered] - column_starts[reentered]
+        exits = exits[stopped][reentered]
+        columns = columns[stopped][reentered]
+    if len(results) == 0:
+        empty = np.empty(shape=0, dtype=np.int64)
+        return empty, empty, np.empty(shape=0, dtype=np.float64), empty
+    entries, exits, exit_prices, columns = [np.concatenate(values) for values in zip(*results)]
+    # Trades without a closing signal are only kept if they were stopped
+    closed = exits < length
+    order = np.lexsort((entries[closed], columns[closed]))
+    return entries[closed][order], exits[closed][order], exit_prices[closed][order], columns[closed][order]
+
+# Calculates statistics on all the trades resulting from the signals:
+# %P/L
+# Min, max %P/L
+# Entry, exit price
+# With 2-D signals (bars x columns) every column is a separate simulation on the same candles,
+# and the "column" entry tells which one each trade belongs to.
+# With exit rules, trades can also exit at their stops within a bar, and open again on the next opening
+# signal (see find_stop_trades), and atr must be given if they use the average true range. Short trades
+# are simulated as long trades on the negated prices, where the highs are the lows and the P/L has the
+# opposite sign.
+def simulate_trades(opening_signals : np.ndarray,
+                    closing_signals : np.ndarray,
+                    open : np.ndarray,
+                    high : np.ndarray,
+                    low : np.ndarray,
+                    exit_rules : ExitRules = None,
+                    atr : np.ndarray = None,
+                    short : bool = False) -> dict:
+    sign = 1.0
+    if short:
+        sign = -1.0
+        open, high, low = -open, -low, -high
+    if exit_rules is not None:
+        entries, exits, closing_prices, columns = find_stop_trades(opening_signals.reshape(len(open), -1),
+                                                                   closing_signals.reshape(len(open), -1),
+                                                                   open, high, low, exit_rules, atr)
+    else:
+        if opening_signals.ndim == 2:
+            entries, exits, columns = find_trades_many(opening_signals, closing_signals)
+        else:
+            entries, exits = find_trades(opening_signals, closing_signals)
+        closing_prices = open[exits]
+    opening_prices = open[entries]
+    if len(entries) > 0:
+        # Each trade spans the bars [entry, exit), the closing bar is left at its open.
+        # Only the even reductions are used, so the bounds do not need to increase between trades
+        bounds = np.column_stack([entries, exits]).ravel()
+        lowest = np.minimum.reduceat(low, bounds)[::2]
+        highest = np.maximum.reduceat(high, bounds)[::2]
+        if exit_rules is not None:
+            # A trade stopped on its entry bar only saw its entry and exit prices, and a stopped trade
+            # also saw its exit price on the bar it exited
+            same_bar = entries == exits
+            lowest = np.fmin(np.where(same_bar, opening_prices, lowest), closing_prices)
+            highest = np.fmax(np.where(same_bar, opening_prices, highest), closing_prices)
+    else:
+        lowest = np.empty(shape=0, dtype=np.float64)
+        highest = np.empty(shape=0, dtype=np.float64)
+    trades = {"opening-index": entries,
+              "closing-index": exits,
+              "opening-price": sign * opening_prices,
+              "closing-price": sign * closing_prices,
+              "lowest-pl": sign * (lowest / opening_prices - 1) * 100,
+              "highest-pl": sign * (highest / opening_prices - 1) * 100,
+              "final-pl": sign * (closing_prices / opening_prices - 1) * 100}
+    if opening_signals.ndim == 2:
+        trades["column"] = columns
+    return trades
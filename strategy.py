@@ -1,372 +1,374 @@
-from dynamic_enums import AvailableStudies
-from enums import AverageType, FrequencyType, OpeningPositionEffect, PriceType
+from alignment import align
+from concurrent.futures import ProcessPoolExecutor
+from datamodels import MarketData, MarketPanel
+from enums import FrequencyType, OpeningPositionEffect
+from expression import ExpressionPlan
+from portfolio import PortfolioRules, signals_to_trades, simulate_portfolio
+from report import ReportWriter
+from shared_store import SharedCandleStore, SharedMarketData
+from simulation import ExitRules, simulate_trades
 from typing import Union
-from utils import get_market_data
+from utils import get_market_data, get_market_data_many, share_client, use_shared_client
 
+import instrumentation
 import json
+import math
 import numpy as np
 import pandas as pd
 import studies
 
+REPORT_COLUMNS = ["symbol", "opening-date", "closing-date", "opening-price", "closing-price", "lowest-pl", "highest-pl", "final-pl"]
+
+# Result of a condition as a boolean array of the given shape: missing (NaN) and zero values do not meet it
+def to_signals(values : Union[np.ndarray, float], shape : tuple) -> np.ndarray:
+    values = np.asarray(values)
+    if values.dtype != bool:
+        values = (values != 0) & ~np.isnan(values)
+    return np.broadcast_to(values, shape)
+
 class Strategy:
 
-    def __init__(self, file_name) -> None:
+    def __init__(self, file_name : Union[str, dict], get_fresh_data : bool = True) -> None:
         self.main_symbols_list = [] # Holds the list of symbols used to test the strategy (for multi-symbol testing)
         self.current_main_symbol_index = None
         self.main_frequency = None
         self.main_frequency_type = None
-        self.market_data_list = []
+        self.market_data_list = [] # Loaded when needed (see load and load_symbol)
+        self.market_data_specs = [] # Holds the (symbol, frequency type, frequency) of each market data
         self.studies_list = []
+        self.study_specs = [] # Holds the (name, params) of each study so they can be rebuilt for every symbol
         self.desired_column = {}
         self.opening_position_effect = None
         self.opening_condition_str = None
         self.closing_condition_str = None
+        self.exit_rules = None # Stop loss, take profit and trailing stop exits, if any
         self.initial_balance = None
+        self.portfolio_rules = None # Position sizing and capital limits of the portfolio simulation
+        self.failed_symbols = {} # Symbols whose report could not be generated, with the reason
+        self.condition_plan = None # Opening and closing conditions compiled together
+        self.opening_indices = None # Evaluated on the current main symbol when needed
+        self.closing_indices = None
+        self.get_fresh_data = get_fresh_data # Whether to refresh the cached candles (False works offline)
         self.process_dict(file_name) # Get the strategy values from JSON file
-        self.opening_indices = self.evaluate_expression(self.opening_condition_str)
-        self.closing_indices = self.evaluate_expression(self.closing_condition_str)
 
-    def process_dict(self, file_name) -> None:
-        # Open file as dictionary
-        with open(file_name, "r") as file:
-            strategy_dict = json.load(file)
+    def process_dict(self, file_name : Union[str, dict]) -> None:
+        # Open file as dictionary (unless the dictionary itself was given)
+        if isinstance(file_name, dict):
+            strategy_dict = file_name
+        else:
+            with open(file_name, "r") as file:
+                strategy_dict = json.load(file)
         
+        # Only the strategy is parsed and validated here, the market data is downloaded when first needed
+        self.opening_condition_str = strategy_dict["opening"]["condition"]
+        self.closing_condition_str = strategy_dict["closing"]["condition"]
+        self.condition_plan = ExpressionPlan([self.opening_condition_str, self.closing_condition_str],
+                                             len(strategy_dict["studies"]))
+
         # Get market data list
         data_list = strategy_dict["marketData"]
         self.main_symbols_list = data_list[0]
         self.main_symbols_list = self.main_symbols_list["symbol"]
         self.main_symbols_list = [x.strip() for x in data_list[0]["symbol"].split(",")] # Split comma-separated list and remove extra spaces
         # Check if the symbols list is a filename
-        current_symbol = self.main_symbols_list[0]
-        print(type(current_symbol))
-        test = current_symbol[-4:].lower()
         if len(self.main_symbols_list) == 1 and len(self.main_symbols_list[0]) > 4 and self.main_symbols_list[0][-4:].lower() == ".txt":
             with open(self.main_symbols_list[0], "r") as file:
                 # Get the lines in the file and put them into the symbols list
                 self.main_symbols_list = [x.strip() for x in file.readlines()]
         self.main_frequency = data_list[0]["frequency"]
         self.main_frequency_type = FrequencyType[data_list[0]["frequencyType"]]
-        market_data = get_market_data(self.main_symbols_list[0],
-                                      self.main_frequency_type,
-                                      self.main_frequency,
-                                      True)
-        self.market_data_list.append(market_data)
-        self.current_main_symbol_index = 0
-        for index in range(1, len(data_list)):
-            data = data_list[index]
-            market_data = get_market_data(data["symbol"],
-                                          FrequencyType[data["frequencyType"]],
-                                          data["frequency"],
-                                          True)
-            self.market_data_list.append(market_data)
+        for data in data_list:
+            self.market_data_specs.append((data["symbol"], FrequencyType[data["frequencyType"]], data["frequency"]))
+        self.market_data_list = [None] * len(data_list)
         # Get studies list
         for study in strategy_dict["studies"]:
-            study_name = study["name"]
-            params = study["params"]
-            params["marketDatas"] = []
-            # Turn the market data IDs the study uses to an actual list in params
-            for index in params["marketDataIds"]:
-                params["marketDatas"].append(self.market_data_list[index])
-            self.studies_list.append(Strategy.__get_study(study_name, params))
+            studies.get_registered_study(study["name"]).validate(study["params"])
+            for index in study["params"]["marketDataIds"]:
+                if index < 0 or index >= len(data_list):
+                    raise ValueError(f"Study {study['id']} uses the market data ID {index}, but there are {len(data_list)} market data.")
+            self.study_specs.append((study["name"], study["params"]))
             # If this is a study with multiple columns, then the "desiredColumn" entry must exist in the dictionary
             if "desiredColumn" in study:
                 self.desired_column[study["id"]] = study["desiredColumn"]
         pos_effect_str = strategy_dict["opening"]["type"]
         self.opening_position_effect = OpeningPositionEffect[pos_effect_str]
-        self.opening_condition_str = strategy_dict["opening"]["condition"]
-        self.closing_condition_str = strategy_dict["closing"]["condition"]
+        self.exit_rules = ExitRules.from_dict(strategy_dict["closing"])
         self.initial_balance = float(strategy_dict["initialBalance"])
-    
+        self.portfolio_rules = PortfolioRules.from_dict(strategy_dict.get("portfolio", {}))
 
-    def __get_study(name : str,
-                    params : dict) -> studies.Study:
-        study_type = AvailableStudies[name]
-        if study_type == AvailableStudies.AverageTrueRange:
-            study = studies.AverageTrueRange(params["marketDatas"][0],
-                                             params["length"],
-                                             AverageType[params["averageType"]],
-                                             params["displace"])
-        elif study_type == AvailableStudies.BollingerBands:
-            study = studies.BollingerBands(params["marketDatas"][0],
-                                           PriceType[params["price"].capitalize()],
-                                           params["length"],
-                                           params["stdDevs"],
-                                           AverageType[params["averageType"]],
-                                           params["displace"])
-        elif study_type == AvailableStudies.DonchianChannels:
-            study = studies.DonchianChannels(params["marketDatas"][0],
-                                             params["length"],
-                                             params["displace"])
-        elif study_type == AvailableStudies.ExponentialMovingAverage:
-            study = studies.ExponentialMovingAverage(params["marketDatas"][0],
-                                                     params["length"],
-                                                     PriceType[params["price"].capitalize()],
-                                                     params["displace"])
-        elif study_type == AvailableStudies.PercentR:
-            study = studies.PercentR(params["marketDatas"][0],
-                                     params["length"],
-                                     params["displace"])
-        elif study_type == AvailableStudies.RealRelativeStrength:
-            study = studies.RealRelativeStrength(params["marketDatas"][0],
-                                                 params["marketDatas"][1],
-                                                 params["length"],
-                                                 params["displace"])
-        elif study_type == AvailableStudies.SimpleMovingAverage:
-            study = studies.SimpleMovingAverage(params["marketDatas"][0],
-                                                params["length"],
-                                                PriceType[params["price"].capitalize()],
-                                                params["displace"])
-        elif study_type == AvailableStudies.TrueRange:
-            study = studies.TrueRange(params["marketDatas"][0],
-                                      params["displace"])
-        elif study_type == AvailableStudies.WeightedMovingAverage:
-            study = studies.WeightedMovingAverage(params["marketDatas"][0],
-                                                  params["length"],
-                                                  PriceType[params["price"].capitalize()],
-                                                  params["displace"])
-        elif study_type == AvailableStudies.WildersMovingAverage:
-            study = studies.WildersMovingAverage(params["marketDatas"][0],
-                                                  params["length"],
-                                                  PriceType[params["price"].capitalize()],
-                                                  params["displace"])
-        else:
-            raise NotImplementedError(f"Study {study_type.name} has not been implemented.")
-        return study
-
-    # Indicates the value of precedence of operators, from largest to smallest
-    def __precedence(operator : str) -> int:
-        if operator == "*" or operator == "/":
-            return 5
-        elif operator == "+" or operator == "-":
-            return 4
-        elif (operator == "<" or operator == "<=" or
-            operator == ">" or operator == ">=" or
-            operator == "crosses-above" or operator == "crosses-below"):
-            return 3
-        elif operator == "=" or operator == "!=":
-            return 2
-        elif operator == "&" or operator == "and":
-            return 1
-        elif operator == "|" or operator == "or":
-            return 0
-        else:
-            raise NotImplementedError(f"Operator '{operator}' has not been implemented.")
-
-    def __apply_operator(value1 : Union[pd.Series, float],
-                value2 : Union[pd.Series, float],
-                operator : str) -> pd.Series:
-        if operator == "+":
-            return value1 + value2
-        elif operator == "-":
-            return value1 - value2
-        elif operator == "*":
-            return value1 * value2
-        elif operator == "/":
-            return value1 / value2
-        elif operator == ">":
-            return value1 > value2
-        elif operator == ">=":
-            return value1 >= value2
-        elif operator == "=":
-            return value1 == value2
-        elif operator == "!=":
-            return value1 != value2
-        elif operator == "<=":
-            return value1 <= value2
-        elif operator == "<":
-            return value1 < value2
-        elif operator == "|" or operator == "or":
-            return value1 | value2
-        elif operator == "&" or operator == "and":
-            return value1 & value2
-        elif operator == "crosses-above":
-            # In this case value2 must be a pandas Series
-            # A constant crossing above a series is the same as the series crossing below the constant
-            if type(value1) == float or type(value1) == int:
-                prev_value2 = value2.shift(1)
-                return (prev_value2 >= value1) & (value2 < value1)
-            # In this case value1 must be a pandas Series
-            elif type(value2) == float or type(value2) == int:
-                prev_value1 = value1.shift(1)
-                return (prev_value1 <= value2) & (prev_value1 > value2)
-            # In this case a pandas.Series is compared against a pandas.Series
-            # If they are not series, then the program will crash
-            else:
-                prev_value1 = value1.shift(1)
-                prev_value2 = value2.shift(1)
-                return (prev_value1 <= prev_value2) & (value1 > value2)
-        elif operator == "crosses-below":
-            # In this case value2 must be a pandas Series
-            # A constant crossing below a series is the same as the series crossing above the constant
-            if type(value1) == float or type(value1) == int:
-                prev_value2 = value2.shift(1)
-                return (prev_value2 <= value1) & (value2 > value1)
-            # In this case value1 must be a pandas Series
-            elif type(value2) == float or type(value2) == int:
-                prev_value1 = value1.shift(1)
-                return (prev_value1 >= value2) & (prev_value1 < value2)
-            # In this case a pandas.Series is compared against a pandas.Series
-            # If they are not series, then the program will crash
-            else:
-                prev_value1 = value1.shift(1)
-                prev_value2 = value2.shift(1)
-                return (prev_value1 >= prev_value2) & (value1 < value2)
-        else:
-            raise NotImplementedError(f"Operator '{operator}' has not been implemented.")
+    def __load_studies(self) -> None:
+        self.studies_list = []
+        for study_name, study_params in self.study_specs:
+            params = dict(study_params)
+            # Turn the market data IDs the study uses to an actual list in params
+            params["marketDatas"] = [self.market_data_list[index] for index in params["marketDataIds"]]
+            self.studies_list.append(Strategy.get_study(study_name, params))
+
+    # Downloads the market data other than the main symbol that are not loaded yet
+    def __load_other_market_data(self) -> None:
+        for index in range(1, len(self.market_data_specs)):
+            if self.market_data_list[index] is None:
+                symbol, frequency_type, frequency = self.market_data_specs[index]
+                self.market_data_list[index] = get_market_data(symbol, frequency_type, frequency, self.get_fresh_data, incremental=True)
+
+    # Loads the first symbol and evaluates the conditions on it, unless some symbol is already loaded
+    def load(self) -> None:
+        if self.current_main_symbol_index is None:
+            self.load_symbol(0)
+        if self.opening_indices is None:
+            self.__evaluate_conditions()
+
+    # Loads the market data of a symbol in the main symbols list and its studies.
+    # The conditions are evaluated on it when first needed.
+    def load_symbol(self, index : int, market_data : MarketData = None) -> None:
+        if index == self.current_main_symbol_index and len(self.studies_list) > 0:
+            return
+        self.__load_other_market_data()
+        if market_data is None:
+            market_data = get_market_data(self.main_symbols_list[index],
+                                          self.main_frequency_type,
+                                          self.main_frequency,
+                                          self.get_fresh_data,
+                                          incremental=True)
+        self.market_data_list[0] = market_data
+        self.current_main_symbol_index = index
+        self.__load_studies()
+        self.opening_indices = None
+        self.closing_indices = None
+
+    # Generates the report of a single symbol, returning the error instead of raising it
+    # so that one bad symbol does not stop the whole run
+    def report_symbol(self, index : int, market_data : MarketData = None) -> tuple[str, pd.DataFrame, str]:
+        symbol = self.main_symbols_list[index]
+        with instrumentation.stage("symbol-report", symbol, symbols=1) as report_stage:
+            try:
+                self.load_symbol(index, market_data)
+                return (symbol, self.generate_single_report(), None)
+            except Exception as e:
+                report_stage.add(failed_symbols=1)
+                return (symbol, None, f"{type(e).__name__}: {e}")
+
+    # Generates the reports of a chunk of symbols, downloading their market data concurrently first.
+    # Symbols whose download failed are reported with its error instead of being downloaded again.
+    def report_chunk(self, indices : list) -> list:
+        symbols = [self.main_symbols_list[index] for index in indices]
+        errors = {}
+        try:
+            market_datas = get_market_data_many(symbols, self.main_frequency_type, self.main_frequency, self.get_fresh_data,
+                                                incremental=True, errors=errors)
+        except Exception as e:
+            print(f"Error downloading market data: {type(e).__name__}: {e}")
+            market_datas = {}
+        return [(symbol, None, f"{type(errors[symbol]).__name__}: {errors[symbol]}") if symbol in errors
+                else self.report_symbol(index, market_datas.get(symbol))
+                for index, symbol in zip(indices, symbols)]
+
+    # The studies and signals depend on the main symbol, so workers rebuild them instead of unpickling them.
+    # The other market data are not pickled either, the workers attach to them in shared memory.
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["market_data_list"] = [None] * len(self.market_data_list)
+        state["current_main_symbol_index"] = None
+        state["studies_list"] = []
+        state["opening_indices"] = None
+        state["closing_indices"] = None
+        return state
+
+    # Creates a study from its name and params in the strategy file (see studies.register_study)
+    def get_study(name : str,
+                  params : dict) -> studies.Study:
+        return studies.create_study(name, params)
+
+    # Values of the study with the given index, as used in the conditions: an array on the bars of the main
+    # symbol, whatever market data the study is calculated on (see alignment.align)
+    def __get_study_values(self, study_idx : int) -> np.ndarray:
+        study = self.studies_list[study_idx]
+        study.calculate()
+        values = study.values
+        # If the study requires a specific column (like bollinger bands lower, middle, or upper)
+        if study_idx in self.desired_column:
+            values = values[self.desired_column[study_idx]]
+        return align(values, study.market_data, self.market_data_list[0])
+
+    def __evaluate_conditions(self) -> None:
+        symbol = self.main_symbols_list[self.current_main_symbol_index]
+        # Calculating the studies is part of the evaluation, they are also recorded on their own
+        with instrumentation.stage("evaluation", symbol, bars=len(self.market_data_list[0].candles)):
+            opening, closing = self.condition_plan.execute(self.__get_study_values)
+            self.opening_indices = to_signals(opening, (len(self.market_data_list[0].candles),))
+            self.closing_indices = to_signals(closing, (len(self.market_data_list[0].candles),))
 
     def evaluate_expression(self, expression : str) -> pd.Series:
-        operator_stack = []
-        operand_stack = []
-        
-        index = 0
-        while index < len(expression):
-            char = expression[index]
-            # Skip blank spaces
-            if char == " ":
-                index += 1
-                continue
-            # It's a constant
-            elif char.isdigit():
-                start_idx = index
-                # Get the constant substring
-                while index < len(expression) and (char.isdigit() or char == "."):
-                    index += 1
-                    char = expression[index]
-                # Push constant onto the operand stack
-                operand_stack.append(float(expression[start_idx:index]))
-                index -= 1
-            elif char == "(":
-                operator_stack.append("(")
-            elif char == ")":
-                # Calculate everything between parentheses
-                while operator_stack[-1] != "(":
-                    operand2 = operand_stack.pop()
-                    operand1 = operand_stack.pop()
-                    operator = operator_stack.pop()
-                    result = Strategy.__apply_operator(operand1, operand2, operator)
-                    operand_stack.push(result)
-                operator_stack.pop()
-            # It's a study
-            elif char == "S" or char == "s":
-                index += 1
-                char = expression[index]
-                start_idx = index
-                # Get the study index
-                while char.isdigit():
-                    index += 1
-                    if index == len(expression):
-                        break
-                    char = expression[index]
-                study_idx = int(expression[start_idx:index])
-                index -= 1
-                study = self.studies_list[study_idx]
-                study.calculate()
-                # If the study requires a specific column (like bollinger bands lower, middle, or upper)
-                if study_idx in self.desired_column:
-                    # Push the study onto the operand stack
-                    operand_stack.append(study.values[self.desired_column[study_idx]])
-                else:
-                    operand_stack.append(study.values)
-            # It's an operator
-            else:
-                if char == "$":
-                    start_idx = index + 1 # + 1 to ignore '$' symbol
-                    # Find the closing '$' symbol
-                    index = expression.find("$", start_idx)
-                    operator = expression[start_idx:index]
-                else:
-                    start_idx = index
-                    # Find the whole operator (should work for operators with more than one character)
-                    while char.isdigit() is False and char.isalpha() is False:
-                        index += 1
-                        char = expression[index]
-                    operator = expression[start_idx:index]
-                    index -= 1
-                while len(operator_stack) > 0 and Strategy.__precedence(operator) <= Strategy.__precedence(operator_stack[-1]):
-                    result = Strategy.__apply_operator(operand1, operand2, operator)
-                    operand_stack.append(result)
-                operator_stack.append(operator)
-            index += 1
-
-        # All the characters in the expression have been visited and put on the stack
-        # with some operations done whenever necessary.
-        # Now just calculate everything you have in stack
-        while len(operator_stack) > 0:
-            operand2 = operand_stack.pop()
-            operand1 = operand_stack.pop()
-            operator = operator_stack.pop()
-            result = Strategy.__apply_operator(operand1, operand2, operator)
-            operand_stack.append(result)
-        
-        return operand_stack.pop()
+        if self.current_main_symbol_index is None:
+            self.load_symbol(0)
+        values = ExpressionPlan([expression], len(self.studies_list)).execute(self.__get_study_values)[0]
+        return pd.Series(values, index=self.market_data_list[0].candles.index)
 
-    def generate_single_report(self) -> dict:
+    def generate_single_report(self) -> pd.DataFrame:
+        self.load()
         # Main market data on which to trade
         main_market_data = self.market_data_list[0].candles
         current_symbol = self.main_symbols_list[self.current_main_symbol_index]
-        opening_indices = []
-        closing_indices = []
-        opening_prices = []
-        closing_prices = []
-        lowest_pl = []
-        highest_pl = []
-        final_pl = []
-        # Calculates statistics on all the trades resulting from a strategy:
-        # %P/L
-        # Min, max %P/L
-        # Entry, exit price
-        def trade_stats() -> pd.DataFrame:
-            is_open = False
-            for index in range(1, len(main_market_data.index)):
-                # We look for an opening signal in previous index and open in the current one
-                if self.opening_indices.iat[index - 1] and not is_open:
-                    # Save the opening index, opening price
-                    opening_indices.append(index)
-                    opening_prices.append(main_market_data["open"].iat[index])
-                    # Set the current highest and lowest prices for the trade
-                    current_lowest = main_market_data["low"].iat[index]
-                    current_highest = main_market_data["high"].iat[index]
-                    is_open = True
-                if self.closing_indices.iat[index - 1] and is_open:
-                    # Save the closing index, closing price, lowest percent down, highest percent up, closing percent up/down
-                    closing_indices.append(index)
-                    closing_prices.append(main_market_data["open"].iat[index])
-                    lowest_pl.append((current_lowest/opening_prices[-1] - 1) * 100)
-                    highest_pl.append((current_highest/opening_prices[-1] - 1) * 100)
-                    final_pl.append((closing_prices[-1]/opening_prices[-1] - 1) * 100)
-                    is_open = False
-                    # If the closing and opening condition occur simultaneously, then skip those indices (ignore them)
-                    if opening_indices[-1] == closing_indices[-1]:
-                        opening_indices.pop()
-                        closing_indices.pop()
-                if is_open:
-                    # Update the current lowest and highest since open
-                    current_lowest = min(current_lowest, main_market_data["low"].iat[index])
-                    current_highest = max(current_highest, main_market_data["high"].iat[index])
-            # If there is a trading signal without a closing signal then remove the last trade
-            if len(opening_indices) > len(closing_indices):
-                opening_indices.pop()
-                opening_prices.pop()
-            result = pd.DataFrame({ "symbol": current_symbol,
-                                    "opening-date": main_market_data.index[opening_indices],
-                                    "closing-date": main_market_data.index[closing_indices],
-                                    "opening-price": opening_prices,
-                                    "closing-price": closing_prices,
-                                    "lowest-pl": lowest_pl,
-                                    "highest-pl": highest_pl,
-                                    "final-pl": final_pl})
-            return result
-        return trade_stats()
+        with instrumentation.stage("simulation", current_symbol, bars=len(main_market_data)) as simulation_stage:
+            trades = simulate_trades(self.opening_indices,
+                                     self.closing_indices,
+                                     main_market_data["open"].to_numpy(),
+                                     main_market_data["high"].to_numpy(),
+                                     main_market_data["low"].to_numpy(),
+                                     self.exit_rules,
+                                     self.get_exit_atr(self.market_data_list[0]),
+                                     self.opening_position_effect == OpeningPositionEffect.SellToOpen)
+            simulation_stage.add(trades=len(trades["opening-index"]))
+        return pd.DataFrame({ "symbol": current_symbol,
+                              "opening-date": main_market_data.index[trades["opening-index"]],
+                              "closing-date": main_market_data.index[trades["closing-index"]],
+                              "opening-price": trades["opening-price"],
+                              "closing-price": trades["closing-price"],
+                              "lowest-pl": trades["lowest-pl"],
+                              "highest-pl": trades["highest-pl"],
+                              "final-pl": trades["final-pl"]})
     
-    def generate_global_report(self) -> None:
-        prev_df = self.generate_single_report()
-        for index in range(1, len(self.main_symbols_list)):
-            self.current_main_symbol_index = index
-            # Update the market data to the next one on the list
-            self.market_data_list[0] = get_market_data(self.main_symbols_list[index],
-                                      self.main_frequency_type,
-                                      self.main_frequency,
-                                      True)
-            new_df = self.generate_single_report()
-            prev_df = pd.concat([prev_df, new_df], ignore_index=True)
-        prev_df.to_csv("report.csv", index=False)
\ No newline at end of file
+    # Average true range of the market data used by the exit rules, None if they do not need it.
+    # For a panel, the average of every symbol is taken over its own candles, as (bars x symbols).
+    def get_exit_atr(self, market_data : Union[MarketData, MarketPanel]) -> np.ndarray:
+        if self.exit_rules is None or not self.exit_rules.uses_atr():
+            return None
+        if isinstance(market_data, MarketPanel):
+            atr = np.full(shape=(len(market_data), len(market_data.symbols)), fill_value=np.nan)
+            for j in range(len(market_data.symbols)):
+                symbol_data = market_data.get_market_data(j)
+                symbol_data.candles = symbol_data.candles[symbol_data.candles["close"].notna()]
+                atr[:, j] = market_data.align(self.__get_exit_atr(symbol_data))
+            return atr
+        return self.__get_exit_atr(market_data).to_numpy()
+
+    def __get_exit_atr(self, market_data : MarketData) -> pd.Series:
+        return studies.AverageTrueRange.calculate(market_data, self.exit_rules.atr_length, self.exit_rules.atr_average_type)
+
+    # Candles of every symbol of the main symbols list on a shared timeline. Symbols that could not be
+    # downloaded are left out and recorded in failed_symbols.
+    def load_panel(self) -> MarketPanel:
+        errors = {}
+        market_datas = get_market_data_many(self.main_symbols_list, self.main_frequency_type, self.main_frequency, self.get_fresh_data,
+                                            incremental=True, errors=errors)
+        self.failed_symbols = {symbol: f"{type(error).__name__}: {error}" for symbol, error in errors.items()}
+        return MarketPanel.from_market_datas(list(market_datas.values()))
+
+    # Opening and closing signals of every symbol of a panel, as (bars x symbols) boolean arrays
+    def evaluate_panel(self, panel : MarketPanel) -> tuple[np.ndarray, np.ndarray]:
+        self.__load_other_market_data()
+        # When symbols miss dates, the conditions are evaluated on the packed panel (see PackedPanel), where
+        # the previous bar of a crossover is the previous candle of the symbol, like in its single report
+        main = panel.pack() if panel.has_gaps else panel
+        panel_studies = []
+        for study_name, study_params in self.study_specs:
+            params = dict(study_params)
+            params["marketDatas"] = [main if index == 0 else self.market_data_list[index] for index in params["marketDataIds"]]
+            panel_studies.append(Strategy.get_study(study_name, params))
+
+        def get_study_values(study_idx : int) -> np.ndarray:
+            study = panel_studies[study_idx]
+            study.calculate()
+            values = study.values
+            if study_idx in self.desired_column:
+                values = values[self.desired_column[study_idx]]
+            if study.market_data is main:
+                return values
+            values = align(values, study.market_data, panel)
+            if main is not panel:
+                return main.pack_values(values)
+            # Studies of other market data are the same for every symbol
+            return values[:, None] if values.ndim == 1 else values
+
+        with instrumentation.stage("evaluation", bars=len(panel), symbols=len(panel.symbols)):
+            opening, closing = self.condition_plan.execute(get_study_values)
+        shape = (len(main), len(panel.symbols))
+        opening, closing = to_signals(opening, shape), to_signals(closing, shape)
+        if main is not panel:
+            return main.unpack(opening, False), main.unpack(closing, False)
+        return opening, closing
+
+    # Simulates the strategy on every symbol at once in a single account starting with the initial balance,
+    # following the portfolio rules of the strategy file (see portfolio.simulate_portfolio), with the same
+    # direction and exit rules as the reports of every symbol.
+    # Returns the equity, cash, invested value, exposure and open positions of every bar and the trades made.
+    def simulate_portfolio(self, panel : MarketPanel = None, rules : PortfolioRules = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+        if panel is None:
+            panel = self.load_panel()
+        if rules is None:
+            rules = self.portfolio_rules
+        opening, closing = self.evaluate_panel(panel)
+        with instrumentation.stage("portfolio", bars=len(panel), symbols=len(panel.symbols)) as portfolio_stage:
+            short = self.opening_position_effect == OpeningPositionEffect.SellToOpen
+            entry_bars, exit_bars, exit_prices = signals_to_trades(opening, closing, panel["open"], panel["high"], panel["low"],
+                                                                   self.exit_rules, self.get_exit_atr(panel), short)
+            results = simulate_portfolio(entry_bars, exit_bars, panel["open"], panel["close"], self.initial_balance, rules, exit_prices, short)
+            portfolio_stage.add(trades=len(results["trades"]["column"]))
+        trades = results.pop("trades")
+        index = panel.get_index()
+        closed = trades["closing-index"] >= 0
+        trades = pd.DataFrame({"symbol": np.array(panel.symbols, dtype=object)[trades["column"]],
+                               "opening-date": index[trades["opening-index"]],
+                               "closing-date": pd.Series(index[trades["closing-index"]]).where(closed).to_numpy(),
+                               "shares": trades["shares"],
+                               "opening-price": trades["opening-price"],
+                               "closing-price": trades["closing-price"],
+                               "final-pl": np.sign(trades["shares"]) * (trades["closing-price"] / trades["opening-price"] - 1) * 100})
+        return pd.DataFrame(results, index=index), trades.sort_values("opening-date", kind="stable", ignore_index=True)
+
+    # Writes the trades of every symbol to file_name as they are generated (see ReportWriter).
+    # With resume, the symbols already in the report of an interrupted run are skipped.
+    def generate_global_report(self, workers : int = 1, chunk_size : int = None, file_name : str = "report.csv", resume : bool = False) -> None:
+        with instrumentation.stage("global-report", symbols=len(self.main_symbols_list), workers=workers) as report_stage:
+            with ReportWriter(file_name, REPORT_COLUMNS, resume) as writer:
+                self.__generate_global_report(workers, chunk_size, writer, report_stage)
+
+    def __generate_global_report(self, workers : int, chunk_size : int, writer : ReportWriter, report_stage : instrumentation.stage) -> None:
+        indices = [index for index, symbol in enumerate(self.main_symbols_list) if symbol not in writer.done_symbols]
+        report_stage.add(skipped_symbols=len(self.main_symbols_list) - len(indices))
+        self.failed_symbols = {}
+        if len(indices) == 0:
+            return
+        if chunk_size is None:
+            chunk_size = max(1, min(50, math.ceil(len(indices) / (workers * 4))))
+        chunks = [indices[i:i + chunk_size] for i in range(0, len(indices), chunk_size)]
+
+        def write_results(results : list) -> None:
+            for symbol, report, error in results:
+                if error is not None:
+                    print(f"Error generating report for {symbol}: {error}")
+                    self.failed_symbols[symbol] = error
+                else:
+                    writer.write(symbol, report)
+
+        # Downloaded once here instead of in every worker
+        self.__load_other_market_data()
+        if workers > 1:
+            # The other market data are copied once to shared memory, which every worker reads in place
+            with SharedCandleStore() as store:
+                shared_market_data = [store.add(market_data) for market_data in self.market_data_list[1:]]
+                # Hand each worker process a chunk of symbols at a time
+                with ProcessPoolExecutor(max_workers=workers,
+                                         initializer=_init_report_worker,
+                                         initargs=(self, shared_market_data, share_client())) as executor:
+                    # map() yields the chunks in submission order, which keeps the report ordered by symbol
+                    for chunk_results in executor.map(_report_chunk, chunks):
+                        write_results(chunk_results)
+        else:
+            for chunk in chunks:
+                write_results(self.report_chunk(chunk))
+        writer.flush()
+        report_stage.add(failed_symbols=len(self.failed_symbols), trades=writer.rows)
+
+# Strategy used by the current report worker process
+_worker_strategy = None
+
+# The workers download within one rate limit between them all
+def _init_report_worker(strategy : Strategy, shared_market_data : list[SharedMarketData], shared_client : tuple) -> None:
+    global _worker_strategy
+    use_shared_client(shared_client)
+    _worker_strategy = strategy
+    _worker_strategy.market_data_list[1:] = [market_data.attach() for market_data in shared_market_data]
+
+def _report_chunk(indices : list) -> list:
+    return _worker_strategy.report_chunk(indices)
@@ -0,0 +1,105 @@
+from alignment import align, get_alignment
+from expression import CROSSOVER_OPERATORS, apply_operator
+from strategy import Strategy
+from typing import Union
+
+import math
+import numpy as np
+
+# Evaluates the opening and closing conditions of a strategy on live candles, one bar at a time.
+# The studies of the current symbol are updated incrementally (see Study.update) and the compiled
+# conditions are evaluated on the latest bar only, keeping the results of the previous bar for the crossovers.
+# Studies of other market data (other symbols or timeframes) are taken as of the close of every bar, like
+# the full evaluation does (see alignment.align).
+class StreamingEvaluator:
+
+    def __init__(self, strategy : Strategy) -> None:
+        strategy.load()
+        self.plan = strategy.condition_plan
+        self.studies = strategy.studies_list
+        self.desired_column = strategy.desired_column
+        self.used_studies = self.plan.get_studies()
+        # Market data whose candles update each study
+        self.market_data_ids = [params["marketDataIds"][0] for name, params in strategy.study_specs]
+        for study_idx in self.used_studies:
+            study = self.studies[study_idx]
+            if not study.can_update():
+                raise ValueError(f"Study {type(study).__name__} (S{study_idx}) can not be updated incrementally, "
+                                 "so the conditions using it can not be evaluated on live candles.")
+        self.study_values = [math.nan] * len(self.studies)
+        self.previous = [math.nan] * len(self.plan.instructions) # Results of the previous bar
+        self.__prime(strategy.market_data_list)
+
+    # Starts the updates of the studies after the candles they already have, so that the live candles continue
+    # them, and evaluates the last bars with their calculated values
+    def __prime(self, market_data_list : list) -> None:
+        # A crossover of crossovers needs the results of two bars ago, and so on
+        depth = [0] * len(self.plan.instructions)
+        for index, (operator, argument1, argument2) in enumerate(self.plan.instructions):
+            if operator != "constant" and operator != "study":
+                depth[index] = max(depth[argument1], depth[argument2]) + (1 if operator in CROSSOVER_OPERATORS else 0)
+        evaluated_bars = max(depth, default=0) + 1
+        main_market_data = market_data_list[0]
+        last_values = {}
+        for study_idx in self.used_studies:
+            study = self.studies[study_idx]
+            # The candles of other market data that closed after the last candle of the main symbol are
+            # given by the next updates
+            alignment = get_alignment(study.market_data, main_market_data)
+            if alignment.is_identity():
+                study.prime()
+            else:
+                study.prime(int(alignment.positions[-1]) + 1 if len(alignment.positions) > 0 else 0)
+            study.calculate()
+            values = study.values
+            if study_idx in self.desired_column:
+                values = values[self.desired_column[study_idx]]
+            last_values[study_idx] = align(values, study.market_data, main_market_data)[-evaluated_bars:]
+        for bar in range(evaluated_bars, 0, -1):
+            for study_idx, values in last_values.items():
+                self.study_values[study_idx] = values[-bar] if bar <= len(values) else math.nan
+            self.__evaluate()
+
+    def __update_study(self, study_idx : int, candle) -> float:
+        value = self.studies[study_idx].update(candle)
+        if study_idx in self.desired_column:
+            value = value[self.desired_column[study_idx]]
+        return np.float64(value)
+
+    # Adds a new candle of the main symbol (and, optionally, new candles of other market data by index)
+    # and returns whether the opening and closing conditions are met on it. The candle of another market
+    # data is given with the candle of the main symbol that closes with it or after it (a daily candle with
+    # the last intraday candle of the session), and its studies keep their latest value until then.
+    def update(self, candle, other_candles : dict = None) -> list:
+        candles = {0: candle} if other_candles is None else {**other_candles, 0: candle}
+        for study_idx in self.used_studies:
+            market_data_id = self.market_data_ids[study_idx]
+            if market_data_id in candles:
+                self.study_values[study_idx] = self.__update_study(study_idx, candles[market_data_id])
+        return self.__evaluate()
+
+    # The values of an instruction on the previous and the latest bar (constants stay constants)
+    def __last_two(self, index : int, results : list) -> Union[np.ndarray, float]:
+        if self.plan.instructions[index][0] == "constant":
+            return results[index]
+        return np.array([self.previous[index], results[index]], dtype=np.float64)
+
+    def __evaluate(self) -> list:
+        results = [None] * len(self.plan.instructions)
+        with np.errstate(all="ignore"):
+            for index, (operator, argument1, argument2) in enumerate(self.plan.instructions):
+                if operator == "constant":
+                    results[index] = argument1
+                elif operator == "study":
+                    results[index] = self.study_values[argument1]
+                elif operator in CROSSOVER_OPERATORS:
+                    # Crossovers compare with the previous bar, so they are evaluated on the last two bars
+                    results[index] = apply_operator(self.__last_two(argument1, results),
+                                                    self.__last_two(argument2, results),
+                                                    operator)[-1]
+                else:
+                    results[index] = apply_operator(results[argument1], results[argument2], operator)
+        self.previous = results
+        # Like the full evaluation, a missing (NaN) result does not meet the condition
+        return [bool(results[output]) and not (isinstance(results[output], float) and math.isnan(results[output]))
+                for output in self.plan.outputs]
@@ -1,16 +1,221 @@
-from datamodels import MarketData
+from alignment import align
+from cache import StudyCache
+from datamodels import MarketData, MarketPanel, PackedPanel
 from enums import AverageType, PriceType
+from kernels import hull_moving_average, rolling_extrema, shift_rows, simple_moving_average, weighted_moving_average
+from typing import Callable, Union
+import incremental
+import inspect
+import instrumentation
+import math
 import pandas as pd
 import numpy as np
 from utils import get_price
 
+# Values of the studies, shared by every study of the process
+study_cache = StudyCache()
+
+# Key of the values of a study calculated on a market data with the given parameters
+def study_key(market_data : MarketData, name : str, params : tuple, displace : int) -> tuple:
+    return (market_data.get_key(), name, params, displace)
+
+# Studies take the candles of a MarketData, where every column is a pandas Series, or the candles
+# of a MarketPanel, where every column is a 2-D array (bars x symbols) and every symbol is calculated
+# at once. The values of a panel are 2-D arrays, or a dictionary of them for studies with several lines.
+
+# pandas object to calculate a column with: the Series itself, or a DataFrame with a column per symbol of a panel
+def to_pandas(column : Union[pd.Series, np.ndarray]) -> Union[pd.Series, pd.DataFrame]:
+    if isinstance(column, np.ndarray):
+        return pd.DataFrame(column, copy=False)
+    return column
+
+# Values calculated from a column, as a Series with the index of the column or as the 2-D array of a panel
+def like_column(values : Union[pd.Series, pd.DataFrame, np.ndarray], column : Union[pd.Series, np.ndarray]) -> Union[pd.Series, np.ndarray]:
+    if isinstance(column, np.ndarray):
+        return values if isinstance(values, np.ndarray) else values.to_numpy()
+    if isinstance(values, np.ndarray):
+        return pd.Series(values, index=column.index)
+    return values
+
+# Same as pandas' shift, also for the arrays of a panel
+def shift(values : Union[pd.Series, np.ndarray], displace : int) -> Union[pd.Series, np.ndarray]:
+    if isinstance(values, np.ndarray):
+        return shift_rows(values, displace)
+    return values.shift(displace)
+
+# Lowest low and highest high of the last length candles. Several studies use them (Donchian Channels, %R),
+# so they are cached and calculated only once for every market data and length
+def get_rolling_extrema(market_data : Union[MarketData, MarketPanel], length : int) -> tuple:
+    def calculate_values() -> tuple:
+        low = market_data.candles["low"]
+        high = market_data.candles["high"]
+        lowest, highest = rolling_extrema(np.asarray(low, dtype=np.float64), np.asarray(high, dtype=np.float64), length)
+        return like_column(lowest, low), like_column(highest, high)
+    return study_cache.get(study_key(market_data, "RollingExtrema", (length,), 0), calculate_values)
+
 class Study:
 
     def __init__(self, market_data : MarketData, displace : int = 0) -> None:
         self.market_data = market_data
         self.displace = displace
         self.values = None
+        self.calculate = self.__calculate
+        self.delay = None # Displaces the values given by update
+
+    def __calculate(self) -> None:
+        with instrumentation.stage("study", getattr(self.market_data, "symbol", None), studies=1) as study_stage:
+            hits = study_cache.hits
+            if isinstance(self.market_data, MarketPanel) and self.market_data.has_gaps:
+                # Every symbol is calculated over its own candles, and not over the dates only other symbols have
+                panel = self.market_data
+                self.market_data = panel.pack()
+                try:
+                    self.values = self.market_data.unpack(self._calculate())
+                finally:
+                    self.market_data = panel
+            else:
+                self.values = self._calculate()
+            study_stage.add(cache_hits=study_cache.hits - hits)
+
+    # Returns the values of the study, subclasses get them through the study cache
+    def _calculate(self):
+        raise NotImplementedError(f"Study {type(self).__name__} has not been implemented.")
+
+    # Advances the study by one candle (a dictionary or a row with "open", "high", "low", "close" and "volume")
+    # in O(1) and returns the value of the study on it, a dictionary for studies with several lines.
+    # The first update starts from an empty history and values is not changed.
+    def update(self, candle) -> Union[float, dict]:
+        if self.delay is None:
+            if self.displace < 0:
+                raise ValueError(f"Study {type(self).__name__} is displaced into the future and can not be updated.")
+            self._start_updates()
+            self.delay = incremental.Delay(self.displace)
+        value = self.delay.update(self._update(candle))
+        if value is None:
+            return {line: math.nan for line in self.delay.values[-1]} if isinstance(self.delay.values[-1], dict) else math.nan
+        return value
+
+    # Starts the updates after the first bars candles of the market data (all of them by default), as if
+    # update had been called with every one of them. The accumulators are set from the columns at once,
+    # and the values the next updates displace are taken from the calculated (undisplaced) values.
+    def prime(self, bars : int = None) -> None:
+        if self.displace < 0:
+            raise ValueError(f"Study {type(self).__name__} is displaced into the future and can not be updated.")
+        self._start_updates()
+        self._prime(self.market_data.candles.iloc[:bars])
+        self.delay = incremental.Delay(self.displace)
+        if self.displace > 0:
+            displace = self.displace
+            self.displace = 0
+            try:
+                values = self._calculate().iloc[:bars]
+            finally:
+                self.displace = displace
+            self.delay.prime(values.to_dict("records") if isinstance(values, pd.DataFrame) else values.to_numpy(dtype=np.float64).tolist())
+
+    def can_update(self) -> bool:
+        return type(self)._start_updates is not Study._start_updates
+
+    # Creates the accumulators used by update
+    def _start_updates(self) -> None:
+        raise NotImplementedError(f"Study {type(self).__name__} can not be updated incrementally.")
+
+    # Primes the accumulators with the columns of candles (see incremental)
+    def _prime(self, candles : pd.DataFrame) -> None:
+        raise NotImplementedError(f"Study {type(self).__name__} can not be updated incrementally.")
+
+    def _update(self, candle) -> Union[float, dict]:
+        raise NotImplementedError(f"Study {type(self).__name__} can not be updated incrementally.")
+
+    def get_key(self, *params) -> tuple:
+        return study_key(self.market_data, type(self).__name__, params, self.displace)
+
+# Parameter of a study in the strategy files: its name there, the argument of the study's constructor
+# it is passed as and the function that converts its JSON value. It is required when the argument has
+# no default value.
+class StudyParameter:
+
+    def __init__(self, name : str, argument : str, convert : Callable = None) -> None:
+        self.name = name
+        self.argument = argument
+        self.convert = convert
+        self.required = True
+        self.default = None
+
+def to_price_type(value : Union[str, PriceType]) -> PriceType:
+    return value if isinstance(value, PriceType) else PriceType[value.capitalize()]
+
+def to_average_type(value : Union[str, AverageType]) -> AverageType:
+    return value if isinstance(value, AverageType) else AverageType[value]
+
+# A study class with the number of market data it takes and its parameters
+class RegisteredStudy:
+
+    def __init__(self, study_class : type, market_datas : int, parameters : list) -> None:
+        self.study_class = study_class
+        self.market_datas = market_datas
+        self.parameters = parameters
+        signature = inspect.signature(study_class.__init__)
+        for parameter in parameters:
+            default = signature.parameters[parameter.argument].default
+            parameter.required = default is inspect.Parameter.empty
+            parameter.default = None if parameter.required else default
+
+    # Arguments of the constructor from the parameters of the strategy file, without the market data.
+    # With defaults, the arguments left out get their default values.
+    def get_arguments(self, params : dict, defaults : bool = False) -> dict:
+        arguments = {}
+        for parameter in self.parameters:
+            if parameter.name in params:
+                value = params[parameter.name]
+                try:
+                    arguments[parameter.argument] = value if parameter.convert is None else parameter.convert(value)
+                except (KeyError, AttributeError):
+                    raise ValueError(f"Invalid value {value!r} for the parameter '{parameter.name}' of study {self.study_class.__name__}.")
+            elif parameter.required:
+                raise ValueError(f"Study {self.study_class.__name__} needs the parameter '{parameter.name}'.")
+            elif defaults:
+                arguments[parameter.argument] = parameter.default
+        return arguments
+
+    # Checks the parameters of the strategy file without creating the study
+    def validate(self, params : dict) -> None:
+        self.get_arguments(params)
+        if len(params.get("marketDataIds", [])) < self.market_datas:
+            raise ValueError(f"Study {self.study_class.__name__} needs {self.market_datas} market data IDs.")
+
+    def create(self, params : dict) -> "Study":
+        if len(params["marketDatas"]) < self.market_datas:
+            raise ValueError(f"Study {self.study_class.__name__} needs {self.market_datas} market data.")
+        return self.study_class(*params["marketDatas"][:self.market_datas], **self.get_arguments(params))
 
+    def get_schema(self) -> dict:
+        return {"marketDatas": self.market_datas,
+                "params": {parameter.name: {"required": parameter.required, "default": parameter.default}
+                           for parameter in self.parameters}}
+
+# Studies by name, in the order they are defined
+STUDY_REGISTRY = {}
+
+# Class decorator adding a study to the registry with the parameters it takes from the strategy files
+def register_study(*parameters : StudyParameter, market_datas : int = 1) -> Callable:
+    def register(study_class : type) -> type:
+        STUDY_REGISTRY[study_class.__name__] = RegisteredStudy(study_class, market_datas, list(parameters))
+        return study_class
+    return register
+
+def get_registered_study(name : str) -> RegisteredStudy:
+    if name not in STUDY_REGISTRY:
+        raise ValueError(f"Unknown study '{name}', the available studies are {list(STUDY_REGISTRY)}.")
+    return STUDY_REGISTRY[name]
+
+# Creates a study from its name and its parameters in a strategy file, with "marketDatas" holding its market data
+def create_study(name : str, params : dict) -> Study:
+    return get_registered_study(name).create(params)
+
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("averageType", "average_type", to_average_type),
+                StudyParameter("displace", "displace"))
 class AverageTrueRange(Study):
 
     def __init__(self, market_data : MarketData,
@@ -20,74 +225,181 @@ class AverageTrueRange(Study):
         self.length = length
         self.average_type = average_type
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
 
-    def __calculate(self) -> None:
-        self.values = AverageTrueRange.calculate(self.market_data, self.length, self.average_type, self.displace)
+    def _calculate(self) -> pd.Series:
+        return AverageTrueRange.calculate(self.market_data, self.length, self.average_type, self.displace)
+
+    def _start_updates(self) -> None:
+        self.true_range = incremental.TrueRange()
+        self.average = incremental.moving_average(self.length, self.average_type)
+
+    def _update(self, candle) -> float:
+        return self.average.update(self.true_range.update(float(candle["high"]), float(candle["low"]), float(candle["close"])))
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.true_range.prime(np.asarray(candles["close"], dtype=np.float64))
+        self.average.prime(np.asarray(TrueRange.calculate(candles), dtype=np.float64))
 
     def calculate(market_data : MarketData, length : int, average_type : AverageType, displace : int = 0) -> pd.Series:
-        if (average_type == AverageType.Simple):
-            return SimpleMovingAverage.calculate(TrueRange.calculate(market_data.candles), length).shift(displace)
-        if (average_type == AverageType.Exponential):
-            return ExponentialMovingAverage.calculate(TrueRange.calculate(market_data.candles), length).shift(displace)
-        if (average_type == AverageType.Weighted):
-            return WeightedMovingAverage.calculate(TrueRange.calculate(market_data.candles), length).shift(displace)
-        if (average_type == AverageType.Wilders):
-            return WildersMovingAverage.calculate(TrueRange.calculate(market_data.candles), length).shift(displace)
+        def calculate_values() -> pd.Series:
+            true_range = TrueRange.calculate(market_data.candles)
+            return shift(moving_average(true_range, length, average_type), displace)
+        return study_cache.get(study_key(market_data, "AverageTrueRange", (length, average_type), displace), calculate_values)
 
+@register_study(StudyParameter("price", "price", to_price_type),
+                StudyParameter("length", "length"),
+                StudyParameter("stdDevs", "std_devs"),
+                StudyParameter("averageType", "average_type", to_average_type),
+                StudyParameter("displace", "displace"))
 class BollingerBands(Study):
-    
+
     def __init__(self, market_data : MarketData,
                  price : PriceType = PriceType.Close,
                  length : int = 20,
                  std_devs : float = 2.0,
                  average_type : AverageType = AverageType.Simple,
                  displace : int = 0) -> None:
+        self.price = price
+        self.length = length
+        self.std_devs = std_devs
+        self.average_type = average_type
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
 
+    def _calculate(self) -> pd.DataFrame:
+        def calculate_values() -> pd.DataFrame:
+            data = get_price(self.market_data.candles, self.price)
+            return BollingerBands.calculate(data, self.length, self.std_devs, self.average_type, self.displace)
+        return study_cache.get(self.get_key(self.price, self.length, self.std_devs, self.average_type), calculate_values)
+
+    def _start_updates(self) -> None:
+        self.average = incremental.moving_average(self.length, self.average_type)
+        self.deviation = incremental.Deviation(self.length)
+
+    def _update(self, candle) -> dict:
+        price = float(get_price(candle, self.price))
+        middleBand = self.average.update(price)
+        deviation = self.std_devs * self.deviation.update(price)
+        return {"lower": middleBand - deviation, "middle": middleBand, "upper": middleBand + deviation}
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        price = np.asarray(get_price(candles, self.price), dtype=np.float64)
+        self.average.prime(price)
+        self.deviation.prime(price)
+
+    def calculate(column : pd.Series, length : int, std_devs : float, average_type : AverageType, displace : int = 0) -> pd.DataFrame:
+        middleBand = shift(moving_average(column, length, average_type), displace)
+        deviation = std_devs * shift(like_column(to_pandas(column).rolling(length).std(ddof=0), column), displace)
+        dict = {
+            "lower": middleBand - deviation,
+            "middle": middleBand,
+            "upper": middleBand + deviation
+        }
+        return dict if isinstance(column, np.ndarray) else pd.DataFrame(dict)
+
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("displace", "displace"))
 class DonchianChannels(Study):
-     
+
     def __init__(self, market_data : MarketData,
                 length : int = 20,
                 displace : int = 0) -> None:
         self.length = length
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
 
-    def __calculate(self) -> None:
-        data = get_price(self.market_data.candles, self.priceType)
-        self.values = SimpleMovingAverage.calculate(data, self.length, self.displace)
-    
-    def calculate(dataframe : pd.DataFrame, length : int, displace : int = 0) -> pd.DataFrame:
-        lowerChannel = dataframe["low"].rolling(length).min().shift(displace)
-        upperChannel = dataframe["high"].rolling(length).max().shift(displace)
+    def _calculate(self) -> pd.DataFrame:
+        def calculate_values() -> pd.DataFrame:
+            return DonchianChannels.calculate(self.market_data, self.length, self.displace)
+        return study_cache.get(self.get_key(self.length), calculate_values)
+
+    def _start_updates(self) -> None:
+        self.lowest = incremental.RollingMinimum(self.length)
+        self.highest = incremental.RollingMaximum(self.length)
+
+    def _update(self, candle) -> dict:
+        lowerChannel = self.lowest.update(float(candle["low"]))
+        upperChannel = self.highest.update(float(candle["high"]))
+        return {"lower": lowerChannel, "middle": (lowerChannel + upperChannel) / 2, "upper": upperChannel}
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.lowest.prime(np.asarray(candles["low"], dtype=np.float64))
+        self.highest.prime(np.asarray(candles["high"], dtype=np.float64))
+
+    def calculate(market_data : MarketData, length : int, displace : int = 0) -> pd.DataFrame:
+        lowest, highest = get_rolling_extrema(market_data, length)
+        lowerChannel = shift(lowest, displace)
+        upperChannel = shift(highest, displace)
         middleChannel = (lowerChannel + upperChannel) / 2
         dict = {
             "lower": lowerChannel,
             "middle": middleChannel,
             "upper": upperChannel
         }
-        return pd.DataFrame(dict)
+        return dict if isinstance(market_data, MarketPanel) else pd.DataFrame(dict)
 
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("price", "price_type", to_price_type),
+                StudyParameter("displace", "displace"))
 class ExponentialMovingAverage(Study):
-    
+
     def __init__(self, market_data : MarketData,
                  length : int = 20,
                  price_type : PriceType = PriceType.Close,
                  displace : int = 0) -> None:
         self.length = length
-        self.price_type: price_type
+        self.price_type = price_type
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
 
-    def __calculate(self) -> None:
-        data = get_price(self.market_data.candles, self.priceType)
-        self.values = SimpleMovingAverage.calculate(data, self.length, self.displace)
-    
+    def _calculate(self) -> pd.Series:
+        def calculate_values() -> pd.Series:
+            data = get_price(self.market_data.candles, self.price_type)
+            return ExponentialMovingAverage.calculate(data, self.length, self.displace)
+        return study_cache.get(self.get_key(self.length, self.price_type), calculate_values)
+
+    def _start_updates(self) -> None:
+        self.average = incremental.moving_average(self.length, AverageType.Exponential)
+
+    def _update(self, candle) -> float:
+        return self.average.update(float(get_price(candle, self.price_type)))
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.average.prime(np.asarray(get_price(candles, self.price_type), dtype=np.float64))
+
+    def calculate(column : pd.Series, length : int, displace : int = 0) -> pd.Series:
+        return shift(like_column(to_pandas(column).ewm(alpha=2/(length + 1)).mean(), column), displace)
+
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("price", "price_type", to_price_type),
+                StudyParameter("displace", "displace"))
+class HullMovingAverage(Study):
+
+    def __init__(self, market_data : MarketData,
+                 length : int = 20,
+                 price_type : PriceType = PriceType.Close,
+                 displace : int = 0) -> None:
+        self.length = length
+        self.price_type = price_type
+        Study.__init__(self, market_data, displace)
+
+    def _calculate(self) -> pd.Series:
+        def calculate_values() -> pd.Series:
+            data = get_price(self.market_data.candles, self.price_type)
+            return HullMovingAverage.calculate(data, self.length, self.displace)
+        return study_cache.get(self.get_key(self.length, self.price_type), calculate_values)
+
+    def _start_updates(self) -> None:
+        self.average = incremental.moving_average(self.length, AverageType.Hull)
+
+    def _update(self, candle) -> float:
+        return self.average.update(float(get_price(candle, self.price_type)))
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.average.prime(np.asarray(get_price(candles, self.price_type), dtype=np.float64))
+
     def calculate(column : pd.Series, length : int, displace : int = 0) -> pd.Series:
-        return column.ewm(alpha=2/(length + 1)).mean().shift(displace)
+        return shift(like_column(hull_moving_average(np.asarray(column, dtype=np.float64), length), column), displace)
 
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("displace", "displace"))
 class PercentR(Study):
 
     def __init__(self, market_data : MarketData,
@@ -95,16 +407,44 @@ class PercentR(Study):
                  displace : int = 0) -> None:
         self.length = length
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
-    
-    def __calculate(self) -> None:
-        self.values = PercentR.calculate(self.market_data, self.length, self.displace)
+
+    def _calculate(self) -> pd.Series:
+        return PercentR.calculate(self.market_data, self.length, self.displace)
+
+    def _start_updates(self) -> None:
+        self.lowest = incremental.RollingMinimum(self.length)
+        self.highest = incremental.RollingMaximum(self.length)
+
+    def _update(self, candle) -> float:
+        highest = self.highest.update(float(candle["high"]))
+        divisor = highest - self.lowest.update(float(candle["low"]))
+        if divisor == 0:
+            return math.nan
+        return 100 - (100 * (highest - float(candle["close"])) / divisor)
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.lowest.prime(np.asarray(candles["low"], dtype=np.float64))
+        self.highest.prime(np.asarray(candles["high"], dtype=np.float64))
 
     def calculate(market_data : MarketData, length : int, displace : int = 0) -> pd.Series:
-        highest = market_data.candles["high"].rolling(length).max()
-        divisor = highest - market_data.candles["low"].rolling(length).min()
-        return (100 - (100 * (highest - market_data.candles["close"]) / divisor)).shift(displace)
+        def calculate_values() -> pd.Series:
+            lowest, highest = get_rolling_extrema(market_data, length)
+            divisor = highest - lowest
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return shift(100 - (100 * (highest - market_data.candles["close"]) / divisor), displace)
+        return study_cache.get(study_key(market_data, "PercentR", (length,), displace), calculate_values)
 
+# Values calculated on compared_market_data (a single symbol) on the bars of market_data, see alignment.align.
+# A panel takes them for every symbol, and a packed panel on the dates of the candles of every symbol.
+def align_compared(values : pd.Series, compared_market_data : MarketData, market_data : Union[MarketData, MarketPanel]) -> np.ndarray:
+    if isinstance(market_data, PackedPanel):
+        return market_data.pack_values(align(values, compared_market_data, market_data.panel))
+    values = align(values, compared_market_data, market_data)
+    return values.reshape(len(values), -1) if isinstance(market_data, MarketPanel) else values
+
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("displace", "displace"),
+                market_datas=2)
 class RealRelativeStrength(Study):
 
     def __init__(self, market_data : MarketData,
@@ -114,23 +454,34 @@ class RealRelativeStrength(Study):
         self.compared_market_data = compared_market_data
         self.length = length
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
 
-    def __calculate(self) -> None:
-        self.values = RealRelativeStrength.calculate(self.market_data, self.compared_market_data, self.length, self.displace)
+    def _calculate(self) -> pd.Series:
+        return RealRelativeStrength.calculate(self.market_data, self.compared_market_data, self.length, self.displace)
 
     def calculate(market_data : MarketData, compared_market_data : MarketData, length : int, displace : int = 0) -> pd.Series:
-        rolling_move = market_data.candles["close"].diff(length)
-        compared_rolling_move = compared_market_data.candles["close"].diff(length)
-        rolling_atr = AverageTrueRange.calculate(market_data, length, AverageType.Wilders)
-        compared_atr = AverageTrueRange.calculate(compared_market_data, length, AverageType.Wilders)
-        power_index = compared_rolling_move / compared_atr
-        expected_move = power_index * rolling_atr
-        diff = rolling_move - expected_move
-        return (diff / rolling_atr).shift(displace)
+        def calculate_values() -> pd.Series:
+            close = market_data.candles["close"]
+            rolling_move = close - shift(close, length)
+            compared_rolling_move = compared_market_data.candles["close"].diff(length)
+            # The compared market data (usually the benchmark) is the same for every symbol, so its ATR comes from the cache
+            rolling_atr = AverageTrueRange.calculate(market_data, length, AverageType.Wilders)
+            compared_atr = AverageTrueRange.calculate(compared_market_data, length, AverageType.Wilders)
+            # The compared market data may have other bars (another timeframe, or missing dates), so its values
+            # are taken as of the close of every bar of market data
+            compared_rolling_move = align_compared(compared_rolling_move, compared_market_data, market_data)
+            compared_atr = align_compared(compared_atr, compared_market_data, market_data)
+            power_index = compared_rolling_move / compared_atr
+            expected_move = power_index * rolling_atr
+            diff = rolling_move - expected_move
+            return shift(diff / rolling_atr, displace)
+        key = study_key(market_data, "RealRelativeStrength", (compared_market_data.get_key(), length), displace)
+        return study_cache.get(key, calculate_values)
 
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("price", "price_type", to_price_type),
+                StudyParameter("displace", "displace"))
 class SimpleMovingAverage(Study):
-    
+
     def __init__(self, market_data : MarketData,
                  length : int = 20,
                  price_type : PriceType = PriceType.Close,
@@ -138,33 +489,56 @@ class SimpleMovingAverage(Study):
         self.length = length
         self.price_type = price_type
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate
 
-    def __calculate(self) -> None:
-        data = get_price(self.market_data.candles, self.price_type)
-        self.values = SimpleMovingAverage.calculate(data, self.length, self.displace)
-    
+    def _calculate(self) -> pd.Series:
+        def calculate_values() -> pd.Series:
+            data = get_price(self.market_data.candles, self.price_type)
+            return SimpleMovingAverage.calculate(data, self.length, self.displace)
+        return study_cache.get(self.get_key(self.length, self.price_type), calculate_values)
+
+    def _start_updates(self) -> None:
+        self.average = incremental.moving_average(self.length, AverageType.Simple)
+
+    def _update(self, candle) -> float:
+        return self.average.update(float(get_price(candle, self.price_type)))
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.average.prime(np.asarray(get_price(candles, self.price_type), dtype=np.float64))
+
     def calculate(column : pd.Series, length : int, displace : int = 0) -> pd.Series:
-        return column.rolling(length).mean().shift(displace)
+        return shift(like_column(simple_moving_average(np.asarray(column, dtype=np.float64), length), column), displace)
 
+@register_study(StudyParameter("displace", "displace"))
 class TrueRange(Study):
 
     def __init__(self, market_data : MarketData, displace : int = 0) -> None:
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
-    
-    def __calculate(self) -> None:
-        self.values = TrueRange.calculate(self.market_data, self.displace)
-    
+
+    def _calculate(self) -> pd.Series:
+        def calculate_values() -> pd.Series:
+            return TrueRange.calculate(self.market_data.candles, self.displace)
+        return study_cache.get(self.get_key(), calculate_values)
+
+    def _start_updates(self) -> None:
+        self.true_range = incremental.TrueRange()
+
+    def _update(self, candle) -> float:
+        return self.true_range.update(float(candle["high"]), float(candle["low"]), float(candle["close"]))
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.true_range.prime(np.asarray(candles["close"], dtype=np.float64))
+
     def calculate(dataframe : pd.DataFrame, displace : int = 0) -> pd.Series:
-        high = dataframe["high"]
-        low = dataframe["low"]
-        previous_close = dataframe["close"].shift(periods=1)
-        data = pd.DataFrame({"tr0": high - low, "tr1": abs(high - previous_close), "tr2": abs(low - previous_close)})
-        data.set_index(dataframe.index)
-        true_range = data.max(axis=1)
-        return true_range.shift(displace)
+        high = np.asarray(dataframe["high"], dtype=np.float64)
+        low = np.asarray(dataframe["low"], dtype=np.float64)
+        previous_close = shift_rows(np.asarray(dataframe["close"], dtype=np.float64), 1)
+        # fmax skips a missing previous close, like the maximum of a row in pandas
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - previous_close), np.abs(low - previous_close)))
+        return shift(like_column(true_range, dataframe["close"]), displace)
 
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("price", "price_type", to_price_type),
+                StudyParameter("displace", "displace"))
 class WeightedMovingAverage(Study):
 
     def __init__(self, market_data : MarketData,
@@ -172,23 +546,30 @@ class WeightedMovingAverage(Study):
                  price_type : PriceType = PriceType.Close,
                  displace : int = 0) -> None:
         self.length = length
-        self.price_type: price_type
+        self.price_type = price_type
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
 
-    def __calculate(self) -> None:
-        data = get_price(self.market_data.candles, self.priceType)
-        self.values = WeightedMovingAverage.calculate(data, self.length, self.displace)
+    def _calculate(self) -> pd.Series:
+        def calculate_values() -> pd.Series:
+            data = get_price(self.market_data.candles, self.price_type)
+            return WeightedMovingAverage.calculate(data, self.length, self.displace)
+        return study_cache.get(self.get_key(self.length, self.price_type), calculate_values)
+
+    def _start_updates(self) -> None:
+        self.average = incremental.moving_average(self.length, AverageType.Weighted)
+
+    def _update(self, candle) -> float:
+        return self.average.update(float(get_price(candle, self.price_type)))
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.average.prime(np.asarray(get_price(candles, self.price_type), dtype=np.float64))
 
     def calculate(column : pd.Series, length : int, displace : int = 0) -> pd.Series:
-        weights = np.arange(length) + 1
-        weights_sum = length * (length + 1) / 2
-        swv = np.lib.stride_tricks.sliding_window_view(column.values.flatten(), window_shape=length)
-        sw = (swv*weights).sum(axis=1) / weights_sum
-        nans = np.empty(shape=(length - 1,))
-        nans[:] = np.nan
-        return pd.Series(np.concatenate([nans, sw]), index=column.index).shift(displace)
+        return shift(like_column(weighted_moving_average(np.asarray(column, dtype=np.float64), length), column), displace)
 
+@register_study(StudyParameter("length", "length"),
+                StudyParameter("price", "price_type", to_price_type),
+                StudyParameter("displace", "displace"))
 class WildersMovingAverage(Study):
 
     def __init__(self, market_data : MarketData,
@@ -196,13 +577,37 @@ class WildersMovingAverage(Study):
                  price_type : PriceType = PriceType.Close,
                  displace : int = 0) -> None:
         self.length = length
-        self.price_type: price_type
+        self.price_type = price_type
         Study.__init__(self, market_data, displace)
-        self.calculate = self.__calculate()
 
-    def __calculate(self) -> None:
-        data = get_price(self.market_data.candles, self.priceType)
-        self.values = WeightedMovingAverage.calculate(data, self.length, self.displace)
+    def _calculate(self) -> pd.Series:
+        def calculate_values() -> pd.Series:
+            data = get_price(self.market_data.candles, self.price_type)
+            return WildersMovingAverage.calculate(data, self.length, self.displace)
+        return study_cache.get(self.get_key(self.length, self.price_type), calculate_values)
+
+    def _start_updates(self) -> None:
+        self.average = incremental.moving_average(self.length, AverageType.Wilders)
+
+    def _update(self, candle) -> float:
+        return self.average.update(float(get_price(candle, self.price_type)))
+
+    def _prime(self, candles : pd.DataFrame) -> None:
+        self.average.prime(np.asarray(get_price(candles, self.price_type), dtype=np.float64))
 
     def calculate(column : pd.Series, length : int, displace : int = 0) -> pd.Series:
-        return column.ewm(alpha=1.0/length).mean().shift(displace)
\ No newline at end of file
+        return shift(like_column(to_pandas(column).ewm(alpha=1.0/length).mean(), column), displace)
+
+# Moving average of a column for any of the average types
+def moving_average(column : pd.Series, length : int, average_type : AverageType) -> pd.Series:
+    if (average_type == AverageType.Simple):
+        return SimpleMovingAverage.calculate(column, length)
+    if (average_type == AverageType.Exponential):
+        return ExponentialMovingAverage.calculate(column, length)
+    if (average_type == AverageType.Weighted):
+        return WeightedMovingAverage.calculate(column, length)
+    if (average_type == AverageType.Wilders):
+        return WildersMovingAverage.calculate(column, length)
+    if (average_type == AverageType.Hull):
+        return HullMovingAverage.calculate(column, length)
+    raise NotImplementedError(f"Average type {average_type.name} has not been implemented.")
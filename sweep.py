@@ -0,0 +1,173 @@
+from alignment import align
+from enums import AverageType, OpeningPositionEffect
+from kernels import moving_averages, shift_rows
+from performance import trade_statistics
+from simulation import simulate_trades
+from strategy import Strategy
+from studies import get_registered_study
+from typing import Union
+from utils import get_price
+
+import copy
+import instrumentation
+import itertools
+import json
+import numpy as np
+import pandas as pd
+
+# Studies whose values for every length are calculated at once by kernels.moving_averages
+MOVING_AVERAGE_STUDIES = {
+    "SimpleMovingAverage": AverageType.Simple,
+    "ExponentialMovingAverage": AverageType.Exponential,
+    "HullMovingAverage": AverageType.Hull,
+    "WeightedMovingAverage": AverageType.Weighted,
+    "WildersMovingAverage": AverageType.Wilders
+}
+METRICS = ["trades", "win-rate", "average-pl", "total-pl", "compounded-pl", "worst-pl",
+           "profit-factor", "max-drawdown", "sharpe", "sortino", "exposure"]
+
+# Values taken by a parameter of the strategy file. A list is a grid of values,
+# a dictionary {"start", "stop", "step"} is a range that includes the stop value
+# and anything else is a fixed value.
+def expand_values(value) -> list:
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict) and "start" in value and "stop" in value:
+        step = value.get("step", 1)
+        values = np.arange(value["start"], value["stop"] + step / 2, step)
+        if all(isinstance(x, int) for x in [value["start"], value["stop"], step]):
+            return [int(x) for x in values]
+        return [float(x) for x in values]
+    return [value]
+
+# Per-column statistics of the trades of a 2-D simulation on length bars
+def sweep_metrics(trades : dict, count : int, length : int) -> dict:
+    column = trades["column"]
+    pl = trades["final-pl"]
+    statistics = trade_statistics(column, pl, trades["closing-index"], trades["closing-index"] - trades["opening-index"], count)
+    total = np.bincount(column, weights=pl, minlength=count)
+    compounded = np.expm1(np.bincount(column, weights=np.log1p(pl / 100), minlength=count)) * 100
+    worst = np.full(shape=count, fill_value=np.inf)
+    np.minimum.at(worst, column, trades["lowest-pl"])
+    trade_count = statistics["trades"]
+    return {"trades": trade_count,
+            "win-rate": statistics["win-rate"],
+            "average-pl": statistics["expectancy"],
+            "total-pl": total,
+            "compounded-pl": compounded,
+            "worst-pl": np.where(trade_count > 0, worst, np.nan),
+            "profit-factor": statistics["profit-factor"],
+            "max-drawdown": statistics["max-drawdown"],
+            "sharpe": statistics["sharpe"],
+            "sortino": statistics["sortino"],
+            "exposure": statistics["time-in-market"] / length * 100}
+
+# Runs a strategy for every combination of the study parameters given as grids or ranges in the strategy file.
+# All the combinations of a symbol are evaluated on the same candles, as 2-D arrays with a column per combination.
+class ParameterSweep:
+
+    def __init__(self, file_name : Union[str, dict], max_elements : int = 2**22, get_fresh_data : bool = True) -> None:
+        if isinstance(file_name, dict):
+            strategy_dict = copy.deepcopy(file_name)
+        else:
+            with open(file_name, "r") as file:
+                strategy_dict = json.load(file)
+        self.max_elements = max_elements # Bound on bars x combinations evaluated at once
+        self.swept_params = [] # Names of the swept parameters of each study
+        self.study_grids = [] # Parameters of each study for every combination of its swept parameters
+        self.failed_symbols = {} # Symbols that could not be swept, with the reason
+        for study in strategy_dict["studies"]:
+            params = study["params"]
+            swept = [name for name, value in params.items()
+                     if name != "marketDataIds" and (isinstance(value, list) or isinstance(value, dict))]
+            grid = [dict(params, **dict(zip(swept, values)))
+                    for values in itertools.product(*[expand_values(params[name]) for name in swept])]
+            self.swept_params.append(swept)
+            self.study_grids.append(grid)
+            # The strategy itself is built with the first combination
+            study["params"] = dict(grid[0])
+        self.strategy = Strategy(strategy_dict, get_fresh_data)
+
+    def get_combination_count(self) -> int:
+        return int(np.prod([len(grid) for grid in self.study_grids]))
+
+    # Values of a study for every combination of its parameters, as a (bars x combinations) array
+    # on the bars of the main symbol
+    def __study_values(self, study_idx : int) -> np.ndarray:
+        name, params = self.strategy.study_specs[study_idx]
+        market_data = self.strategy.market_data_list[params["marketDataIds"][0]]
+        return align(self.__calculate_study_values(study_idx), market_data, self.strategy.market_data_list[0])
+
+    # Values of a study for every combination of its parameters on the bars of its own market data
+    def __calculate_study_values(self, study_idx : int) -> np.ndarray:
+        name, params = self.strategy.study_specs[study_idx]
+        grid = self.study_grids[study_idx]
+        market_datas = [self.strategy.market_data_list[index] for index in params["marketDataIds"]]
+        if name in MOVING_AVERAGE_STUDIES and set(self.swept_params[study_idx]) <= {"length"}:
+            # The parameters left out of the strategy file take their default values
+            arguments = get_registered_study(name).get_arguments(params, defaults=True)
+            column = get_price(market_datas[0].candles, arguments["price_type"]).to_numpy()
+            averages = moving_averages(column, [study_params["length"] for study_params in grid], MOVING_AVERAGE_STUDIES[name])
+            return shift_rows(averages, arguments["displace"])
+        columns = []
+        for study_params in grid:
+            study = Strategy.get_study(name, dict(study_params, marketDatas=market_datas))
+            study.calculate()
+            values = study.values
+            if study_idx in self.strategy.desired_column:
+                values = values[self.strategy.desired_column[study_idx]]
+            columns.append(values.to_numpy(dtype=np.float64))
+        return np.column_stack(columns)
+
+    # Results of every combination on one symbol of the main symbols list
+    def run_symbol(self, index : int) -> pd.DataFrame:
+        self.strategy.load_symbol(index)
+        candles = self.strategy.market_data_list[0].candles
+        length = len(candles)
+        values = [self.__study_values(study_idx) for study_idx in range(len(self.study_grids))]
+        counts = [len(grid) for grid in self.study_grids]
+        total = self.get_combination_count()
+        chunk_size = max(1, self.max_elements // max(length, 1))
+        atr = self.strategy.get_exit_atr(self.strategy.market_data_list[0])
+        metrics = {metric: [] for metric in METRICS}
+        for start in range(0, total, chunk_size):
+            combinations = np.arange(start, min(total, start + chunk_size))
+            # Parameter index of every study in each combination
+            choice = np.unravel_index(combinations, counts)
+            opening, closing = self.strategy.condition_plan.execute(lambda study_idx: values[study_idx][:, choice[study_idx]])
+            shape = (length, len(combinations))
+            trades = simulate_trades(np.broadcast_to(np.asarray(opening, dtype=bool), shape),
+                                     np.broadcast_to(np.asarray(closing, dtype=bool), shape),
+                                     candles["open"].to_numpy(),
+                                     candles["high"].to_numpy(),
+                                     candles["low"].to_numpy(),
+                                     self.strategy.exit_rules,
+                                     atr,
+                                     self.strategy.opening_position_effect == OpeningPositionEffect.SellToOpen)
+            for metric, metric_values in sweep_metrics(trades, len(combinations), length).items():
+                metrics[metric].append(metric_values)
+        choice = np.unravel_index(np.arange(total), counts)
+        results = {"symbol": self.strategy.main_symbols_list[index]}
+        for study_idx, swept in enumerate(self.swept_params):
+            for name in swept:
+                results[f"S{study_idx}.{name}"] = [self.study_grids[study_idx][i][name] for i in choice[study_idx]]
+        for metric in METRICS:
+            results[metric] = np.concatenate(metrics[metric])
+        return pd.DataFrame(results)
+
+    # Results of every combination on every symbol, ranked by the given metrics (best first).
+    # The symbols that fail are left out and recorded in failed_symbols.
+    def run(self, rank_by : tuple = ("compounded-pl",), ascending : bool = False) -> pd.DataFrame:
+        for metric in rank_by:
+            if metric not in METRICS:
+                raise ValueError(f"Unknown metric '{metric}', the available metrics are {METRICS}.")
+        reports = []
+        self.failed_symbols = {}
+        for index in range(len(self.strategy.main_symbols_list)):
+            try:
+                reports.append(self.run_symbol(index))
+            except Exception as e:
+                self.failed_symbols[self.strategy.main_symbols_list[index]] = f"{type(e).__name__}: {e}"
+        instrumentation.count("sweep", failed_symbols=len(self.failed_symbols))
+        results = pd.concat(reports, ignore_index=True) if len(reports) > 0 else pd.DataFrame(columns=["symbol"] + METRICS)
+        return results.sort_values(list(rank_by), ascending=ascending, na_position="last", kind="stable", ignore_index=True)
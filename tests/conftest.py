@@ -0,0 +1,85 @@
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+# The modules of the repository are imported from its root, like the scripts in it do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Runs a test in an empty directory, where the candle cache (and any report) is written
+@pytest.fixture
+def cache_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+# A local stand-in for the API, serving the price history and token endpoints from a thread.
+# Each test sets the responses it needs: responses[path] is a list of (status, body) answered in
+# order (the last one repeats), or a function of the query (or form) and headers returning them, and
+# requests records every (method, path, query or form, headers) and connections the client address
+# of every request. The connections are kept open between requests, like the ones of the API.
+class FakeServer:
+
+    def __init__(self) -> None:
+        self.responses = {}
+        self.requests = []
+        self.connections = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                url = urllib.parse.urlsplit(self.path)
+                self.answer(url.path, urllib.parse.parse_qs(url.query))
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+                self.answer(self.path, urllib.parse.parse_qs(body))
+
+            def answer(self, path : str, params : dict) -> None:
+                with server.lock:
+                    server.requests.append((self.command, path, params, dict(self.headers)))
+                    server.connections.append(self.client_address)
+                    responses = server.responses.get(path, [(404, {})])
+                    response = responses.pop(0) if len(responses) > 1 else responses[0]
+                status, body = response(params, dict(self.headers)) if callable(response) else response
+                content = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def get_requests(self, path : str) -> list:
+        with self.lock:
+            return [request for request in self.requests if request[1] == path]
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+# A fake API, run from a directory with the credentials and the (valid) tokens of a client
+@pytest.fixture
+def fake_server(cache_directory):
+    with open("credentials.json", "w") as file:
+        json.dump({"key": "key", "secret": "secret"}, file)
+    with open("tokens.json", "w") as file:
+        json.dump({"refresh_token": "refresh", "access_token": "access-0", "id_token": "id", "expiration": time.time() + 1800}, file)
+    server = FakeServer()
+    yield server
+    server.close()
@@ -0,0 +1,94 @@
+from alignment import Alignment, align, alignment_cache, get_close_times
+from benchmarks import generate_market_data
+from datamodels import MarketData
+from enums import FrequencyType
+from resample import SESSION_TIMEZONE, resample
+from test_resample import make_minute_candles
+
+import numpy as np
+import pandas as pd
+import pytest
+
+@pytest.fixture(autouse=True)
+def clear_alignment_cache():
+    alignment_cache.clear()
+
+def get_local(market_data : MarketData) -> pd.DatetimeIndex:
+    return market_data.candles.index.tz_convert(SESSION_TIMEZONE)
+
+# Every bar of the target takes the last bar of the source that closed before it (or when it) closed, looked up one at a time
+def naive_positions(source_closes : np.ndarray, target_closes : np.ndarray) -> np.ndarray:
+    positions = []
+    for close in target_closes:
+        closed = [i for i, source_close in enumerate(source_closes) if source_close <= close]
+        positions.append(closed[-1] if len(closed) > 0 else -1)
+    return np.array(positions)
+
+def test_close_times():
+    minutes = resample(make_minute_candles(), FrequencyType.Minute, 5)
+    np.testing.assert_array_equal(get_close_times(minutes), minutes.get_timestamps() + 5 * 60000)
+    for frequency_type, weekday, day in [(FrequencyType.Daily, None, None), (FrequencyType.Weekly, 4, None), (FrequencyType.Monthly, None, -1)]:
+        market_data = generate_market_data("AAA", 1000)
+        if frequency_type != FrequencyType.Daily:
+            market_data = resample(market_data, frequency_type, 1)
+        closes = pd.DatetimeIndex(get_close_times(market_data).astype("datetime64[ms]")).tz_localize("UTC").tz_convert(SESSION_TIMEZONE)
+        assert ((closes.hour == 16) & (closes.minute == 0)).all()
+        assert (closes.normalize() >= get_local(market_data).normalize()).all()
+        if weekday is not None:
+            assert (closes.weekday == weekday).all()
+        if day is not None:
+            assert ((closes + pd.Timedelta(days=1)).day == 1).all()
+
+# The daily values of a symbol on 5 minute bars are the ones of the day before until the session closes
+def test_daily_values_on_intraday_bars():
+    minutes = make_minute_candles()
+    daily = resample(minutes, FrequencyType.Daily, 1)
+    intraday = resample(minutes, FrequencyType.Minute, 5)
+    alignment = Alignment(daily, intraday)
+    np.testing.assert_array_equal(alignment.positions, naive_positions(get_close_times(daily), get_close_times(intraday)))
+    values = align(daily.candles["close"], daily, intraday)
+    local = get_local(intraday)
+    last_bars = (local.hour == 15) & (local.minute == 55)
+    dates = get_local(daily).normalize()
+    # The last bar of a session closes with it and sees its daily close, the others see the day before
+    np.testing.assert_array_equal(values[last_bars], daily.candles["close"].to_numpy()[dates.get_indexer(local[last_bars].normalize())])
+    first_day = local.normalize() == dates[0]
+    assert np.isnan(values[first_day & ~last_bars]).all()
+    previous = dates.get_indexer(local[~first_day & ~last_bars].normalize()) - 1
+    np.testing.assert_array_equal(values[~first_day & ~last_bars], daily.candles["close"].to_numpy()[previous])
+
+# Changing the source after a bar of the target does not change its aligned values
+@pytest.mark.parametrize("frequency_type", [FrequencyType.Daily, FrequencyType.Weekly, FrequencyType.Monthly])
+def test_no_look_ahead(frequency_type):
+    minutes = make_minute_candles()
+    source = resample(minutes, frequency_type, 1)
+    target = resample(minutes, FrequencyType.Minute, 30)
+    values = align(source.candles["close"], source, target)
+    target_closes = get_close_times(target)
+    for bar in range(0, target.get_length(), 97):
+        changed = source.candles["close"].to_numpy().copy()
+        changed[get_close_times(source) > target_closes[bar]] = -1
+        np.testing.assert_array_equal(align(changed, source, target)[:bar + 1], values[:bar + 1])
+
+# A symbol missing some dates takes the last value it had on them
+def test_other_symbol_with_missing_dates():
+    target = generate_market_data("AAA", 200)
+    source = generate_market_data("BBB", 200)
+    missing = np.zeros(shape=200, dtype=bool)
+    missing[50:60] = True
+    source = MarketData("BBB", source.candles[~missing], source.frequency_type, source.frequency)
+    values = align(source.candles["close"], source, target)
+    expected = np.r_[source.candles["close"].to_numpy()[:50], [source.candles["close"].iloc[49]] * 10, source.candles["close"].to_numpy()[50:]]
+    np.testing.assert_array_equal(values, expected)
+
+def test_same_bars_are_not_moved():
+    market_data = generate_market_data("AAA", 100)
+    assert Alignment(market_data, market_data).is_identity()
+    assert Alignment(market_data, MarketData("AAA", market_data.candles.copy(), FrequencyType.Daily, 1)).is_identity()
+    values = np.arange(100.0)
+    np.testing.assert_array_equal(align(values, market_data, market_data), values)
+    # Alignments are cached for every pair of market data
+    other = generate_market_data("BBB", 100)
+    align(values, other, market_data)
+    align(values, other, market_data)
+    assert alignment_cache.misses == 1 and alignment_cache.hits == 1
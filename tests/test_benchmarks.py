@@ -0,0 +1,64 @@
+from enums import FrequencyType
+
+import benchmarks
+import json
+import numpy as np
+import os
+import pytest
+import sys
+
+def test_generate_market_data():
+    market_data = benchmarks.generate_market_data("AAA", 500)
+    candles = market_data.candles
+    assert market_data.get_length() == 500 and candles.index.is_monotonic_increasing
+    assert (candles["high"] >= candles[["open", "close"]].max(axis=1)).all()
+    assert (candles["low"] <= candles[["open", "close"]].min(axis=1)).all()
+    # The same symbol and seed are the same candles, another seed other candles
+    assert candles.equals(benchmarks.generate_market_data("AAA", 500).candles)
+    assert not np.array_equal(candles["close"], benchmarks.generate_market_data("AAA", 500, seed=1).candles["close"])
+    minutes = benchmarks.generate_market_data("AAA", 10, FrequencyType.Minute, 5)
+    assert (np.diff(minutes.get_timestamps()) == 5 * 60000).all()
+
+# Every stage runs on a few small symbols, without touching the working directory
+def test_run_every_stage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    results = benchmarks.run(benchmarks.STAGES, [300], [1, 3], repeat=1)
+    assert os.listdir(tmp_path) == []
+    assert results["settings"]["stages"] == benchmarks.STAGES
+    stages = {(result["stage"], result["symbols"]) for result in results["results"]}
+    for stage in benchmarks.STAGES:
+        assert (stage, 1) in stages
+        assert ((stage, 3) in stages) != (stage in benchmarks.SINGLE_SYMBOL_STAGES)
+    for result in results["results"]:
+        assert result["bars"] == 300
+        assert result["seconds"]["min"] <= result["seconds"]["median"] and result["peak-memory-bytes"] > 0
+    json.dumps(results)
+
+def test_compare_finds_regressions():
+    def make_results(seconds : float, memory : int) -> dict:
+        return {"results": [{"stage": "studies", "case": "SimpleMovingAverage", "bars": 1000, "symbols": 1,
+                             "seconds": {"median": seconds}, "peak-memory-bytes": memory}]}
+    baseline = make_results(1.0, 1000)
+    assert benchmarks.compare(baseline, make_results(1.1, 1100)) == []
+    assert benchmarks.compare(baseline, make_results(1.1, 1100), threshold=1.05)[0]["case"] == "SimpleMovingAverage"
+    regressions = benchmarks.compare(baseline, make_results(2.0, 1000))
+    assert len(regressions) == 1 and regressions[0]["time-ratio"] == pytest.approx(2.0)
+    # Cases that are not in the baseline are not compared
+    assert benchmarks.compare({"results": []}, make_results(2.0, 1000)) == []
+
+# A regression against the results given to compare with makes the command fail
+def test_main_fails_on_regressions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    arguments = ["benchmarks.py", "--stages", "studies", "--bars", "200", "--symbols", "1", "--repeat", "1"]
+    monkeypatch.setattr(sys, "argv", arguments + ["--output", "before.json"])
+    benchmarks.main()
+    with open("before.json") as file:
+        before = json.load(file)
+    for result in before["results"]:
+        result["seconds"]["median"] /= 1000
+    with open("before.json", "w") as file:
+        json.dump(before, file)
+    monkeypatch.setattr(sys, "argv", arguments + ["--output", "after.json", "--compare", "before.json"])
+    with pytest.raises(SystemExit) as exit:
+        benchmarks.main()
+    assert exit.value.code == 1
@@ -0,0 +1,79 @@
+from datamodels import CANDLE_COLUMNS, MarketData, MarketPanel, decode_candles
+from enums import FrequencyType
+from test_schwabapi import make_candles
+
+import datamodels
+import gc
+import json
+import numpy as np
+import pandas as pd
+import pytest
+import studies
+
+# The candles dataframe built one candle at a time, like the client did before decoding into columns
+def build_dataframe(candles : list) -> pd.DataFrame:
+    df = pd.DataFrame({column: [candle[column] for candle in candles] for column in CANDLE_COLUMNS})
+    df["open"] = df["open"].astype(np.float64)
+    df["volume"] = df["volume"].astype(np.int64)
+    df.index = pd.DatetimeIndex(np.array([candle["datetime"] for candle in candles], dtype=np.int64).astype("datetime64[ms]"), name="datetime")
+    return df.tz_localize("UTC").tz_convert("US/Pacific")
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_decode_candles(use_orjson, monkeypatch):
+    if not use_orjson:
+        monkeypatch.setattr(datamodels, "orjson", None)
+    response = make_candles("AAPL", 50)
+    columns = decode_candles(json.dumps(response).encode())
+    assert sorted(columns) == sorted(CANDLE_COLUMNS + ["datetime"])
+    assert columns["datetime"].dtype == np.int64 and columns["volume"].dtype == np.int64 and columns["close"].dtype == np.float64
+    for column in CANDLE_COLUMNS + ["datetime"]:
+        np.testing.assert_array_equal(columns[column], [candle[column] for candle in response["candles"]])
+    market_data = MarketData("AAPL", columns, FrequencyType.Daily, 1)
+    pd.testing.assert_frame_equal(market_data.candles, build_dataframe(response["candles"]))
+
+def test_decode_empty_candles():
+    columns = decode_candles(json.dumps(make_candles("AAPL", 0)).encode())
+    market_data = MarketData("AAPL", columns, FrequencyType.Daily, 1)
+    assert market_data.get_length() == 0 and len(market_data.candles) == 0
+
+# The dataframe is only built when the candles are used, the columns and the dates are read from the arrays until then
+def test_dataframe_is_built_when_used():
+    response = make_candles("AAPL", 10)
+    market_data = MarketData("AAPL", response["candles"], FrequencyType.Daily, 1)
+    assert market_data.get_length() == 10
+    close = market_data.get_column("close")
+    np.testing.assert_array_equal(market_data.get_timestamps(), [candle["datetime"] for candle in response["candles"]])
+    assert market_data._MarketData__candles is None
+    candles = market_data.candles
+    assert market_data._MarketData__columns is None
+    np.testing.assert_array_equal(candles["close"], close)
+    np.testing.assert_array_equal(market_data.get_timestamps(), [candle["datetime"] for candle in response["candles"]])
+
+# The candles of a market data or a panel keep their key until they are replaced (also by the same dataframe
+# changed in place), and new candles never take the key of candles that were deleted
+def test_keys_of_replaced_candles():
+    response = make_candles("AAPL", 50)
+    market_data = MarketData("AAPL", response["candles"], FrequencyType.Daily, 1)
+    key = market_data.get_key()
+    assert market_data.get_key() == key
+    candles = market_data.candles
+    candles["close"] *= 2
+    market_data.candles = candles
+    assert market_data.get_key() != key
+    keys = set()
+    for i in range(200):
+        keys.add(MarketData("AAPL", build_dataframe(response["candles"]), FrequencyType.Daily, 1).get_key())
+    assert len(keys) == 200
+    panel = MarketPanel.from_market_datas([market_data])
+    assert panel.get_key() == panel.get_key() != MarketPanel.from_market_datas([market_data]).get_key()
+
+# A study of new candles with the dates of deleted ones is calculated on the new candles
+def test_study_of_new_candles_with_the_same_dates():
+    response = make_candles("AAPL", 50)
+    for scale in [1, 2, 3]:
+        candles = build_dataframe(response["candles"]).assign(close=lambda candles: candles["close"] * scale)
+        study = studies.SimpleMovingAverage(MarketData("AAPL", candles, FrequencyType.Daily, 1), 5)
+        study.calculate()
+        np.testing.assert_allclose(study.values, candles["close"].rolling(5).mean())
+        del study, candles
+        gc.collect()
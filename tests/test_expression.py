@@ -0,0 +1,146 @@
+from expression import ExpressionPlan, apply_operator, crossover, parse, tokenize
+
+import numpy as np
+import pandas as pd
+import pytest
+import re
+
+BARS = 500
+
+# Random studies around 0 with a few NaN at the start, like the first bars of a moving average
+def make_studies(count : int = 4, seed : int = 0) -> list:
+    generator = np.random.default_rng(seed)
+    index = pd.date_range("2020-01-01", periods=BARS, freq="D")
+    values = []
+    for i in range(count):
+        study = generator.normal(0, 1, BARS).cumsum() / 10
+        study[:i * 3] = np.nan
+        values.append(pd.Series(study, index=index))
+    return values
+
+# The tree of an expression evaluated with pandas Series, one operator at a time and crossovers with shift
+def naive_evaluate(node : tuple, studies : list):
+    if node[0] == "constant":
+        return node[1]
+    if node[0] == "study":
+        return studies[node[1]]
+    operator = node[0]
+    value1 = naive_evaluate(node[1], studies)
+    value2 = naive_evaluate(node[2], studies)
+    if operator == "crosses-above" or operator == "crosses-below":
+        above = operator == "crosses-above"
+        previous1 = value1.shift(1) if isinstance(value1, pd.Series) else value1
+        previous2 = value2.shift(1) if isinstance(value2, pd.Series) else value2
+        if above:
+            return (previous1 <= previous2) & (value1 > value2)
+        return (previous1 >= previous2) & (value1 < value2)
+    return {"+": lambda: value1 + value2, "-": lambda: value1 - value2, "*": lambda: value1 * value2, "/": lambda: value1 / value2,
+            ">": lambda: value1 > value2, ">=": lambda: value1 >= value2, "<": lambda: value1 < value2, "<=": lambda: value1 <= value2,
+            "=": lambda: value1 == value2, "!=": lambda: value1 != value2, "&": lambda: value1 & value2, "|": lambda: value1 | value2}[operator]()
+
+EXPRESSIONS = ["S0 > S1",
+               "S0 $crosses-above$ S1 & S2 < 0.5 & S0 > S3",
+               "S0 $crosses-below$ S1 | S2 > 0.95",
+               "(S0 + S1) * 2 - S2 / 4 >= S3 $and$ S1 != S2",
+               "S0 - -1.5 * S1 <= 3 $or$ (S2 $crosses-above$ S3 & S0 > 0)",
+               "S0 * (2 + 3) > 10 - 4 * 2",
+               "S1 / S2 $crosses-below$ 0.5",
+               "S3"]
+
+@pytest.mark.parametrize("expression", EXPRESSIONS)
+def test_plan_matches_naive_evaluation(expression):
+    studies = make_studies()
+    plan = ExpressionPlan([expression], len(studies))
+    values = plan.execute(lambda index: studies[index].to_numpy())[0]
+    expected = naive_evaluate(parse(expression), studies)
+    np.testing.assert_array_equal(np.asarray(values), expected.to_numpy())
+
+# Several expressions are evaluated in one plan, with their common subexpressions calculated once
+def test_common_subexpressions_are_shared():
+    plan = ExpressionPlan(["S0 $crosses-above$ S1 & S2 < 80", "S0 $crosses-above$ S1 | S2 > 95", "S2 < 80 & S0 $crosses-above$ S1"], 3)
+    operators = [instruction[0] for instruction in plan.instructions]
+    assert operators.count("study") == 3
+    assert operators.count("crosses-above") == 1
+    assert operators.count("<") == 1
+    assert plan.get_studies() == [0, 1, 2]
+    # The same expression twice is the same result
+    plan = ExpressionPlan(["S0 > S1", "S0 > S1"])
+    assert plan.outputs[0] == plan.outputs[1] and len(plan.instructions) == 3
+
+# Operations between constants are calculated when the expression is compiled
+def test_constants_are_folded():
+    assert parse("S0 * (2 + 3) > 10 - 4 * 2") == (">", ("*", ("study", 0), ("constant", 5.0)), ("constant", 2.0))
+    assert parse("-(1 + 2)") == ("constant", -3.0)
+    plan = ExpressionPlan(["2 * 3 < 7"])
+    assert plan.instructions == [("constant", True, None)]
+    assert plan.execute(lambda index: None) == [True]
+
+def test_tokenize():
+    assert tokenize("S0 $crosses-above$ s12 & S2 <= 8.5") == [("study", 0, 0), ("operator", "crosses-above", 3), ("study", 12, 19),
+                                                               ("operator", "&", 23), ("study", 2, 25), ("operator", "<=", 28),
+                                                               ("constant", 8.5, 31)]
+    assert tokenize("S0 $AND$ S1")[1] == ("operator", "&", 3)
+
+# Malformed expressions are rejected when the plan is compiled
+@pytest.mark.parametrize("expression, message", [("S0 >", "Incomplete"),
+                                                 ("S0 > > S1", "Expected a constant"),
+                                                 ("(S0 > S1", "Unmatched '('"),
+                                                 ("S0 > S1)", "Unmatched ')'"),
+                                                 ("S0 S1", "Expected an operator"),
+                                                 ("S > 1", "Missing study index"),
+                                                 ("S0 $above$ S1", "Unknown operator"),
+                                                 ("S0 $crosses-above S1", "Missing closing '$'"),
+                                                 ("S0 # S1", "Unexpected character"),
+                                                 ("S0 > 1.2.3", "Invalid constant"),
+                                                 ("1 $crosses-above$ 2", "needs at least one operand"),
+                                                 ("S4 > 0", "S4 does not exist")])
+def test_malformed_expressions_are_rejected(expression, message):
+    with pytest.raises(ValueError, match=re.escape(message)):
+        ExpressionPlan([expression], 4)
+
+# Evaluating a few bars at a time, with the buffers reused between chunks, gives the values of a single chunk,
+# also for crossovers of results that cross over on the first bar of a chunk
+@pytest.mark.parametrize("chunk_rows", [1, 2, 7, 64, BARS])
+def test_chunks_match_single_chunk(chunk_rows):
+    studies = make_studies()
+    expressions = EXPRESSIONS + ["(S0 - S1) $crosses-above$ (S2 - S3) $crosses-below$ 0.5", "S0 + S1 * S2"]
+    plan = ExpressionPlan(expressions, len(studies))
+    get_study = lambda index: studies[index].to_numpy()
+    expected = [naive_evaluate(parse(expression), studies).to_numpy() for expression in expressions]
+    for values, expected_values in zip(plan.execute(get_study, chunk_rows=chunk_rows), expected):
+        np.testing.assert_array_equal(values, expected_values)
+
+# A crossover with a constant compares the previous value of the other operand with it
+def test_crossovers_with_constants():
+    values = np.array([0.0, 1.0, 2.0, 1.0, 0.0, 2.0])
+    np.testing.assert_array_equal(crossover(values, 1.5, True), [False, False, True, False, False, True])
+    np.testing.assert_array_equal(crossover(1.5, values, False), [False, False, True, False, False, True])
+    np.testing.assert_array_equal(crossover(values, 0.5, False), [False, False, False, False, True, False])
+    series = pd.Series(values, index=pd.date_range("2020-01-01", periods=6))
+    result = crossover(series, 1.5, True)
+    assert isinstance(result, pd.Series) and result.index.equals(series.index)
+    with pytest.raises(ValueError):
+        crossover(1.0, 2.0, True)
+
+# The studies of a panel (bars x symbols) are evaluated for every symbol at once, each symbol like on its own
+@pytest.mark.parametrize("chunk_rows", [None, 3, 50])
+def test_panel_values(chunk_rows):
+    symbols = [make_studies(seed=seed) for seed in range(3)]
+    panel = [np.stack([studies[index].to_numpy() for studies in symbols], axis=1) for index in range(4)]
+    plan = ExpressionPlan(EXPRESSIONS, 4)
+    results = plan.execute(lambda index: panel[index], chunk_rows=chunk_rows)
+    for j, studies in enumerate(symbols):
+        symbol_results = plan.execute(lambda index: studies[index].to_numpy())
+        for values, symbol_values in zip(results, symbol_results):
+            assert values.shape == (BARS, 3)
+            np.testing.assert_array_equal(values[:, j], symbol_values)
+
+def test_apply_operator_into_buffer():
+    value1 = np.array([1.0, 2.0, 3.0])
+    value2 = np.array([3.0, 2.0, 1.0])
+    out = np.empty(3)
+    assert apply_operator(value1, value2, "+", out) is out
+    np.testing.assert_array_equal(out, [4.0, 4.0, 4.0])
+    flags = np.empty(3, dtype=bool)
+    assert apply_operator(value1, value2, ">=", flags) is flags
+    np.testing.assert_array_equal(flags, [False, True, True])
@@ -0,0 +1,92 @@
+from benchmarks import generate_market_data, get_strategy_dict
+from enums import FrequencyType, PeriodType
+from strategy import Strategy
+from test_schwabapi import make_candles, make_client
+
+import instrumentation
+import json
+import pytest
+import studies
+
+@pytest.fixture
+def sink():
+    sink = instrumentation.add_sink(instrumentation.MemorySink())
+    yield sink
+    instrumentation.clear_sinks()
+
+def test_nothing_is_measured_without_sinks():
+    with instrumentation.stage("download", "AAA", http_calls=1) as current_stage:
+        current_stage.add(bytes_read=10)
+    assert current_stage.start is None and current_stage.counts == {"http_calls": 1}
+    assert not instrumentation.is_enabled()
+
+def test_stage_counts(sink):
+    with instrumentation.stage("download", "AAA", http_calls=1) as current_stage:
+        current_stage.add(bytes_read=10)
+        current_stage.add(bytes_read=5)
+    instrumentation.count("market-data", "AAA", cache_hits=1)
+    with pytest.raises(KeyError):
+        with instrumentation.stage("decode", "AAA"):
+            raise KeyError("candles")
+    download, cache, decode = sink.events
+    assert download["stage"] == "download" and download["symbol"] == "AAA"
+    assert download["counts"] == {"http_calls": 1, "bytes_read": 15} and download["seconds"] >= 0
+    assert cache["seconds"] is None and cache["counts"] == {"cache_hits": 1}
+    # A stage that raised is recorded with the error
+    assert decode["counts"] == {"errors": 1}
+    assert sink.get_events(stage="download") == [download]
+    assert sink.get_events(symbol="BBB") == []
+
+def test_summarize(sink):
+    for symbol, bars in [("AAA", 10), ("BBB", 20), ("AAA", 30)]:
+        with instrumentation.stage("study", symbol, studies=1, bars=bars):
+            pass
+    instrumentation.count("market-data", "AAA", downloads=1)
+    summary = sink.get_summary()
+    assert summary["study"]["events"] == 3 and summary["study"]["studies"] == 3 and summary["study"]["bars"] == 60
+    assert summary["market-data"] == {"events": 1, "seconds": 0.0, "downloads": 1}
+    by_symbol = sink.get_summary(by_symbol=True)
+    assert by_symbol[("study", "AAA")]["bars"] == 40 and by_symbol[("study", "BBB")]["bars"] == 20
+
+def test_log_and_json_sinks(tmp_path):
+    lines = []
+    instrumentation.add_sink(instrumentation.LogSink(lines.append))
+    json_sink = instrumentation.add_sink(instrumentation.JSONFileSink(str(tmp_path / "events.jsonl")))
+    try:
+        instrumentation.count("market-data", "AAA", cache_hits=2)
+        with instrumentation.stage("portfolio", symbols=3):
+            pass
+    finally:
+        instrumentation.remove_sink(json_sink)
+        instrumentation.clear_sinks()
+    assert lines[0] == "market-data [AAA] cache_hits=2"
+    assert lines[1].startswith("portfolio ") and lines[1].endswith(" ms symbols=3")
+    with open(tmp_path / "events.jsonl") as file:
+        events = [json.loads(line) for line in file]
+    assert [event["stage"] for event in events] == ["market-data", "portfolio"]
+    assert json_sink.file.closed
+
+# The report of a symbol records loading its candles, its studies (and their cache hits), the evaluation and the simulation
+@pytest.mark.usefixtures("cache_directory")
+def test_single_report_stages(sink):
+    studies.study_cache.clear()
+    generate_market_data("AAA", 500).save()
+    sink.clear()
+    strategy = Strategy(get_strategy_dict(["AAA"]), get_fresh_data=False)
+    report = strategy.generate_single_report()
+    summary = sink.get_summary()
+    assert summary["cache-load"]["events"] == 1 and summary["cache-load"]["bars"] == 500 and summary["cache-load"]["bytes_read"] > 0
+    assert summary["market-data"]["cache_hits"] == 1
+    assert summary["study"]["studies"] == 4
+    assert summary["evaluation"]["bars"] == 500
+    assert summary["simulation"]["trades"] == len(report)
+
+# Downloads record every HTTP request, the retries and the decoding of the candles
+def test_download_stages(sink, fake_server):
+    fake_server.responses["/marketdata/v1/pricehistory"] = [(429, {}), (200, make_candles("AAPL", 5))]
+    market_data = make_client(fake_server).get_price_history("AAPL", PeriodType.Year, 5, FrequencyType.Daily, 1)
+    summary = sink.get_summary()
+    assert summary["http-request"]["http_calls"] == 2
+    assert summary["http-retry"]["retries"] == 1 and summary["http-retry"]["throttled"] == 1
+    assert summary["decode"]["events"] == 1 and summary["decode"]["bars"] == market_data.get_length() == 5
+    assert [event["symbol"] for event in sink.get_events("http-request")] == ["AAPL", "AAPL"]
@@ -0,0 +1,96 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from enums import AverageType
+from kernels import (WindowSums, hull_moving_average, moving_averages, rolling_extrema, rolling_maximum,
+                     rolling_minimum, simple_moving_average, weighted_moving_average)
+
+LENGTHS = [1, 2, 3, 7, 20, 50, 199, 200, 201, 500]
+
+# A random walk far from 0 (where the rounding errors of cumulative sums show), with a few NaN
+def make_prices(length : int, seed : int, nans : bool = True) -> np.ndarray:
+    random = np.random.default_rng(seed)
+    prices = 10000 + np.cumsum(random.normal(size=length))
+    if nans and length > 0:
+        prices[random.choice(length, size=max(1, length // 50), replace=False)] = np.nan
+    return prices
+
+def pandas_sma(values : np.ndarray, length : int) -> np.ndarray:
+    return pd.Series(values).rolling(length).mean().to_numpy()
+
+def pandas_wma(values : np.ndarray, length : int) -> np.ndarray:
+    weights = np.arange(1, length + 1, dtype=np.float64)
+    return pd.Series(values).rolling(length).apply(lambda window: np.dot(window, weights) / weights.sum(), raw=True).to_numpy()
+
+def pandas_hma(values : np.ndarray, length : int) -> np.ndarray:
+    difference = 2 * pandas_wma(values, math.ceil(length / 2)) - pandas_wma(values, length)
+    return pandas_wma(difference, max(1, round(math.sqrt(length))))
+
+@pytest.mark.parametrize("nans", [False, True])
+@pytest.mark.parametrize("length", LENGTHS)
+def test_averages_match_pandas(length, nans):
+    prices = make_prices(1000, length, nans)
+    np.testing.assert_allclose(simple_moving_average(prices, length), pandas_sma(prices, length), rtol=1e-12)
+    np.testing.assert_allclose(weighted_moving_average(prices, length), pandas_wma(prices, length), rtol=1e-12)
+    np.testing.assert_allclose(hull_moving_average(prices, length), pandas_hma(prices, length), rtol=1e-12)
+
+# Series shorter than (or as long as) the window, and empty ones, are NaN like in pandas
+@pytest.mark.parametrize("size", [0, 1, 5, 10])
+def test_averages_of_short_series(size):
+    prices = make_prices(size, size, nans=False)
+    for length in [1, 5, 10, 11]:
+        np.testing.assert_allclose(simple_moving_average(prices, length), pandas_sma(prices, length))
+        np.testing.assert_allclose(weighted_moving_average(prices, length), pandas_wma(prices, length))
+        np.testing.assert_allclose(hull_moving_average(prices, length), pandas_hma(prices, length))
+
+def test_averages_of_all_nan():
+    prices = np.full(shape=50, fill_value=np.nan)
+    assert np.isnan(simple_moving_average(prices, 5)).all()
+    assert np.isnan(weighted_moving_average(prices, 5)).all()
+
+# Every column of a 2-D array is averaged on its own
+def test_averages_of_columns():
+    prices = np.column_stack([make_prices(700, seed) for seed in range(3)])
+    for length in [3, 40]:
+        sma = simple_moving_average(prices, length)
+        wma = weighted_moving_average(prices, length)
+        for j in range(prices.shape[1]):
+            np.testing.assert_allclose(sma[:, j], pandas_sma(prices[:, j], length), rtol=1e-12)
+            np.testing.assert_allclose(wma[:, j], pandas_wma(prices[:, j], length), rtol=1e-12)
+
+# The sums taken once for every length give the same averages as the sums taken for each length
+@pytest.mark.parametrize("average_type", [AverageType.Simple, AverageType.Weighted, AverageType.Hull])
+def test_moving_averages_share_sums(average_type):
+    prices = make_prices(1500, 7)
+    lengths = [2, 9, 50, 300, 2000]
+    single = {AverageType.Simple: simple_moving_average,
+              AverageType.Weighted: weighted_moving_average,
+              AverageType.Hull: hull_moving_average}[average_type]
+    averages = moving_averages(prices, lengths, average_type)
+    assert averages.shape == (len(prices), len(lengths))
+    for j, length in enumerate(lengths):
+        np.testing.assert_allclose(averages[:, j], single(prices, length), rtol=1e-12)
+
+def test_window_sums_reject_longer_lengths():
+    sums = WindowSums(make_prices(100, 0), 10)
+    with pytest.raises(ValueError):
+        sums.mean(20)
+
+@pytest.mark.parametrize("nans", [False, True])
+@pytest.mark.parametrize("length", LENGTHS)
+def test_rolling_extrema_match_pandas(length, nans):
+    prices = make_prices(1000, length, nans)
+    np.testing.assert_array_equal(rolling_maximum(prices, length), pd.Series(prices).rolling(length).max().to_numpy())
+    np.testing.assert_array_equal(rolling_minimum(prices, length), pd.Series(prices).rolling(length).min().to_numpy())
+
+@pytest.mark.parametrize("size", [0, 1, 5, 10])
+def test_rolling_extrema_of_short_series(size):
+    low = make_prices(size, size, nans=False)
+    high = low + 1
+    for length in [1, 5, 10, 11]:
+        lowest, highest = rolling_extrema(low, high, length)
+        np.testing.assert_array_equal(lowest, pd.Series(low).rolling(length).min().to_numpy())
+        np.testing.assert_array_equal(highest, pd.Series(high).rolling(length).max().to_numpy())
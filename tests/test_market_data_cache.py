@@ -0,0 +1,72 @@
+from benchmarks import generate_market_data
+from datamodels import MarketData
+from enums import FrequencyType
+
+import numpy as np
+import pytest
+import utils
+
+# Client answering every request with the candles of fresh (as the API would after the start date)
+class FakeClient:
+
+    def __init__(self, fresh : dict) -> None:
+        self.fresh = fresh
+
+    def get_price_history(self, symbol, period_type, period, frequency_type, frequency, start_date=None, end_date=None,
+                          need_extended_hours_data=None, need_previous_close=None) -> MarketData:
+        return self.fresh[symbol]
+
+    def get_price_history_many(self, symbols, period_type, period, frequency_type, frequency, start_date=None, end_date=None,
+                               need_extended_hours_data=None, need_previous_close=None, max_workers=8, errors=None) -> dict:
+        return {symbol: self.fresh[symbol] for symbol in symbols}
+
+pytestmark = pytest.mark.usefixtures("cache_directory")
+
+def cache(symbol : str, bars : int) -> MarketData:
+    market_data = generate_market_data(symbol, bars)
+    market_data.save()
+    return market_data
+
+def assert_cached(market_data : MarketData) -> None:
+    cached = utils.load_market_data(market_data.symbol, FrequencyType.Daily, 1)
+    assert np.array_equal(cached.get_timestamps(), market_data.get_timestamps())
+    for column in ["open", "high", "low", "close", "volume"]:
+        assert np.array_equal(cached.get_column(column), market_data.get_column(column))
+
+def no_candles(market_data : MarketData) -> MarketData:
+    return MarketData(market_data.symbol, market_data.candles.iloc[:0], FrequencyType.Daily, 1)
+
+# Regression: the cache was saved over the files it was memory-mapped from, and left truncated
+def test_refresh_without_new_candles_keeps_cache():
+    market_data = cache("AAA", 2000)
+    client = FakeClient({"AAA": no_candles(market_data)})
+    refreshed = utils.get_market_data("AAA", FrequencyType.Daily, 1, True, client, incremental=True, derive=False)
+    assert refreshed.get_length() == 2000
+    assert_cached(market_data)
+
+def test_refresh_many_without_new_candles_keeps_cache():
+    market_datas = [cache(symbol, 2000) for symbol in ["AAA", "BBB"]]
+    client = FakeClient({market_data.symbol: no_candles(market_data) for market_data in market_datas})
+    refreshed = utils.get_market_data_many(["AAA", "BBB"], FrequencyType.Daily, 1, True, client, incremental=True, derive=False)
+    assert [market_data.get_length() for market_data in refreshed.values()] == [2000, 2000]
+    for market_data in market_datas:
+        assert_cached(market_data)
+
+# The last cached candle is replaced by its fresh version and the newer ones are appended
+def test_refresh_appends_new_candles():
+    full = generate_market_data("AAA", 2010)
+    MarketData("AAA", full.candles.iloc[:2000], FrequencyType.Daily, 1).save()
+    client = FakeClient({"AAA": MarketData("AAA", full.candles.iloc[1999:], FrequencyType.Daily, 1)})
+    refreshed = utils.get_market_data("AAA", FrequencyType.Daily, 1, True, client, incremental=True, derive=False)
+    assert refreshed.get_length() == 2010
+    assert_cached(full)
+
+# Saving over a memory-mapped copy of the same symbol replaces the files instead of writing into them
+def test_save_over_mapped_cache():
+    market_data = cache("AAA", 2000)
+    mapped = utils.load_market_data("AAA", FrequencyType.Daily, 1)
+    longer = generate_market_data("AAA", 3000, seed=1)
+    longer.save()
+    assert mapped.get_length() == 2000
+    assert np.array_equal(mapped.get_column("close"), market_data.get_column("close"))
+    assert_cached(longer)
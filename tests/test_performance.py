@@ -0,0 +1,116 @@
+from benchmarks import generate_market_data, get_strategy_dict
+from performance import STATISTICS, get_portfolio_statistics, get_trade_statistics, max_drawdowns
+from strategy import Strategy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Trades of a few symbols, one after the other for every symbol, with a symbol with a single trade
+def make_report(seed : int = 0) -> pd.DataFrame:
+    generator = np.random.default_rng(seed)
+    reports = []
+    for symbol, count in [("AAA", 40), ("BBB", 25), ("CCC", 1), ("DDD", 60)]:
+        opening = pd.Timestamp("2020-01-01") + pd.to_timedelta(np.cumsum(generator.integers(1, 20, count)), unit="D")
+        closing = opening + pd.to_timedelta(generator.integers(1, 10, count) * 3600, unit="s")
+        reports.append(pd.DataFrame({"symbol": symbol, "opening-date": opening, "closing-date": closing,
+                                     "final-pl": generator.normal(0.5, 5, count)}))
+    report = pd.concat(reports, ignore_index=True)
+    # A trade still open is left out
+    report.loc[3, "final-pl"] = np.nan
+    return report.sample(frac=1, random_state=seed)
+
+# The statistics of the trades of a symbol, computed with pandas on its own
+def pandas_statistics(trades : pd.DataFrame) -> dict:
+    trades = trades.sort_values("closing-date")
+    pl = trades["final-pl"]
+    wins = pl[pl > 0]
+    losses = pl[pl < 0]
+    equity = (1 + pl / 100).cumprod()
+    peaks = pd.concat([pd.Series([1.0]), equity], ignore_index=True).cummax().iloc[1:].to_numpy()
+    downside = np.sqrt((np.minimum(pl, 0)**2).mean())
+    return {"trades": len(pl),
+            "wins": len(wins),
+            "losses": len(losses),
+            "win-rate": len(wins) / len(pl) * 100,
+            "average-win": wins.mean(),
+            "average-loss": losses.mean(),
+            "profit-factor": wins.sum() / abs(losses.sum()) if len(losses) > 0 else np.inf,
+            "expectancy": pl.mean(),
+            "max-drawdown": max(0.0, ((1 - equity.to_numpy() / peaks) * 100).max()),
+            "sharpe": pl.mean() / pl.std(),
+            "sortino": pl.mean() / downside if downside > 0 else np.inf,
+            "time-in-market": (trades["closing-date"] - trades["opening-date"]).sum()}
+
+def test_trade_statistics_match_pandas():
+    report = make_report()
+    statistics = get_trade_statistics(report)
+    assert list(statistics.index) == ["AAA", "BBB", "CCC", "DDD"]
+    assert list(statistics.columns) == STATISTICS + ["exposure"]
+    closed = report[report["final-pl"].notna()]
+    for symbol, trades in closed.groupby("symbol"):
+        for name, value in pandas_statistics(trades).items():
+            if isinstance(value, pd.Timedelta):
+                assert statistics.loc[symbol, name] == value
+            else:
+                np.testing.assert_allclose(statistics.loc[symbol, name], value, rtol=1e-10, atol=1e-9, err_msg=f"{name} of {symbol}")
+    period = closed["closing-date"].max() - closed["opening-date"].min()
+    np.testing.assert_allclose(statistics["exposure"], statistics["time-in-market"] / period * 100, rtol=1e-12)
+
+def test_statistics_of_all_trades():
+    report = make_report()
+    statistics = get_trade_statistics(report, by=None)
+    assert list(statistics.index) == ["all"]
+    expected = pandas_statistics(report[report["final-pl"].notna()])
+    assert statistics.loc["all", "trades"] == expected["trades"]
+    np.testing.assert_allclose(statistics.loc["all", "expectancy"], expected["expectancy"], rtol=1e-12)
+    np.testing.assert_allclose(statistics.loc["all", "max-drawdown"], expected["max-drawdown"], rtol=1e-10)
+
+def test_max_drawdowns():
+    # Groups given out of order, with a trade losing everything and a group without trades
+    group = np.array([1, 0, 1, 0, 1, 0])
+    pl = np.array([-50.0, 10.0, 100.0, -100.0, -10.0, 10.0])
+    order = np.array([1, 1, 2, 2, 3, 3])
+    drawdowns = max_drawdowns(group, pl, order, 3)
+    np.testing.assert_allclose(drawdowns[:2], [100.0, 50.0], rtol=1e-6)
+    assert np.isnan(drawdowns[2])
+    assert np.isnan(max_drawdowns(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), 2)).all()
+
+def test_portfolio_statistics_match_pandas():
+    generator = np.random.default_rng(0)
+    equity = 10000 * np.cumprod(1 + generator.normal(0.001, 0.01, 500))
+    results = pd.DataFrame({"equity": equity, "exposure": generator.uniform(0, 1, 500), "positions": generator.integers(0, 3, 500)})
+    statistics = get_portfolio_statistics(results, 10000)
+    returns = pd.concat([pd.Series([10000.0]), results["equity"]], ignore_index=True).pct_change().dropna()
+    curve = pd.concat([pd.Series([10000.0]), results["equity"]], ignore_index=True)
+    np.testing.assert_allclose(statistics["total-return"], (equity[-1] / 10000 - 1) * 100, rtol=1e-12)
+    np.testing.assert_allclose(statistics["max-drawdown"], ((1 - curve / curve.cummax()) * 100).max(), rtol=1e-12)
+    np.testing.assert_allclose(statistics["sharpe"], returns.mean() / returns.std() * np.sqrt(252), rtol=1e-10)
+    np.testing.assert_allclose(statistics["sortino"], returns.mean() / np.sqrt((np.minimum(returns, 0)**2).mean()) * np.sqrt(252), rtol=1e-10)
+    assert statistics["average-exposure"] == pytest.approx(results["exposure"].mean() * 100)
+    assert statistics["time-in-market"] == pytest.approx((results["positions"] > 0).mean() * 100)
+
+# The reports of the strategies have dates in the time zone of the candles, read back from a CSV file as text
+# with their UTC offsets (which change with daylight saving time)
+@pytest.mark.usefixtures("cache_directory")
+def test_statistics_of_strategy_reports():
+    symbols = ["AAA", "BBB", "CCC"]
+    for symbol in symbols:
+        generate_market_data(symbol, 1000).save()
+    strategy_dict = get_strategy_dict(symbols)
+    strategy = Strategy(strategy_dict, get_fresh_data=False)
+    report = strategy.generate_single_report()
+    assert report["closing-date"].dt.tz is not None
+    statistics = get_trade_statistics(report)
+    naive = report.assign(**{column: report[column].dt.tz_convert(None) for column in ["opening-date", "closing-date"]})
+    pd.testing.assert_frame_equal(statistics, get_trade_statistics(naive))
+    assert statistics.loc["AAA", "trades"] == report["final-pl"].notna().sum()
+    report.to_csv("report.csv", index=False)
+    read_back = pd.read_csv("report.csv")
+    assert read_back["closing-date"].str.endswith("-07:00").any() and read_back["closing-date"].str.endswith("-08:00").any()
+    pd.testing.assert_frame_equal(get_trade_statistics(read_back), statistics)
+    # The trades of the portfolio, with a start and an end in the time zone of the candles
+    _, trades = strategy.simulate_portfolio()
+    portfolio_statistics = get_trade_statistics(trades, start=trades["opening-date"].min(), end=trades["closing-date"].max())
+    assert sorted(portfolio_statistics.index) == sorted(trades["symbol"].unique())
+    np.testing.assert_allclose(portfolio_statistics["exposure"], get_trade_statistics(trades)["exposure"])
@@ -0,0 +1,120 @@
+from benchmarks import generate_market_data
+from portfolio import PortfolioRules, signals_to_trades, simulate_portfolio
+from simulation import ExitRules, simulate_trades
+from strategy import Strategy
+
+import copy
+import numpy as np
+import pandas as pd
+import pytest
+
+SYMBOLS = 4
+
+# Random candles of a few symbols around 100 (bars x symbols), with opening and closing signals on about 5% and 3% of the bars
+def make_panel(length : int, seed : int) -> tuple:
+    rng = np.random.default_rng(seed)
+    shape = (length, SYMBOLS)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, shape), axis=0))
+    open = close * np.exp(rng.normal(0, 0.004, shape))
+    high = np.maximum(open, close) * np.exp(np.abs(rng.normal(0, 0.006, shape)))
+    low = np.minimum(open, close) * np.exp(-np.abs(rng.normal(0, 0.006, shape)))
+    atr = np.abs(rng.normal(1.5, 0.3, shape))
+    return rng.random(shape) < 0.05, rng.random(shape) < 0.03, open, high, low, close, atr
+
+# Trades of a portfolio, as (column, entry, exit, exit price) sorted like the ones of simulate_trades
+def portfolio_trades(results : dict) -> list:
+    trades = results["trades"]
+    return sorted(zip(trades["column"], trades["opening-index"], trades["closing-index"], trades["closing-price"]))
+
+def column_trades(opening, closing, open, high, low, rules, atr, short) -> list:
+    trades = []
+    for j in range(SYMBOLS):
+        column = simulate_trades(opening[:, j], closing[:, j], open[:, j], high[:, j], low[:, j],
+                                 rules, None if atr is None else atr[:, j], short)
+        trades += zip([j] * len(column["opening-index"]), column["opening-index"], column["closing-index"], column["closing-price"])
+    return sorted(trades)
+
+# With capital for every position, the portfolio makes the trades of every symbol on its own
+@pytest.mark.parametrize("short", [False, True])
+@pytest.mark.parametrize("rules", [None, ExitRules({"percent": 2}, {"percent": 3}), ExitRules({"atr": 2}, trailing_stop={"atr": 2.5})])
+def test_portfolio_makes_the_trades_of_every_symbol(rules, short):
+    opening, closing, open, high, low, close, atr = make_panel(600, 1)
+    entry_bars, exit_bars, exit_prices = signals_to_trades(opening, closing, open, high, low, rules, atr, short)
+    results = simulate_portfolio(entry_bars, exit_bars, open, close, 10000, PortfolioRules(position_size=0.2), exit_prices, short)
+    expected = column_trades(opening, closing, open, high, low, rules, atr, short)
+    trades = portfolio_trades(results)
+    assert len(trades) == len(expected) > 0
+    for trade, expected_trade in zip(trades, expected):
+        assert trade[:3] == expected_trade[:3]
+        assert trade[3] == pytest.approx(expected_trade[3])
+    assert (np.sign(results["trades"]["shares"]) == (-1 if short else 1)).all()
+
+# One symbol with all the equity in every trade compounds the P/L of its trades
+@pytest.mark.parametrize("short", [False, True])
+def test_portfolio_equity_compounds_trades(short):
+    opening, closing, open, high, low, close, atr = make_panel(800, 2)
+    rules = ExitRules({"percent": 2}, trailing_stop={"percent": 3})
+    columns = slice(0, 1)
+    entry_bars, exit_bars, exit_prices = signals_to_trades(opening[:, columns], closing[:, columns], open[:, columns],
+                                                           high[:, columns], low[:, columns], rules, None, short)
+    results = simulate_portfolio(entry_bars, exit_bars, open[:, columns], close[:, columns], 1000, PortfolioRules(position_size=1.0),
+                                 exit_prices, short)
+    trades = simulate_trades(opening[:, 0], closing[:, 0], open[:, 0], high[:, 0], low[:, 0], rules, None, short)
+    assert len(trades["final-pl"]) > 0
+    assert results["equity"][-1] == pytest.approx(1000 * np.prod(1 + trades["final-pl"] / 100))
+    # Flat at the end, with all of the equity in cash
+    assert results["positions"][-1] == 0 and results["cash"][-1] == pytest.approx(results["equity"][-1])
+
+# No more positions than allowed are opened, in the order of the symbols
+def test_max_positions():
+    opening = np.zeros(shape=(4, 3), dtype=bool)
+    closing = np.zeros(shape=(4, 3), dtype=bool)
+    opening[0] = True
+    closing[1] = True
+    open = np.full(shape=(4, 3), fill_value=10.0)
+    entry_bars, exit_bars, exit_prices = signals_to_trades(opening, closing)
+    results = simulate_portfolio(entry_bars, exit_bars, open, open, 1000, PortfolioRules(position_size=0.1, max_positions=2), exit_prices)
+    assert results["trades"]["column"].tolist() == [0, 1]
+    assert results["positions"].tolist() == [0, 2, 0, 0]
+    assert results["exposure"][1] == pytest.approx(0.2)
+
+# A short position gains what the price loses, and its exposure is the value it owes over the equity
+def test_short_position_value():
+    opening = np.array([[True], [False], [False], [False]])
+    closing = np.array([[False], [False], [True], [False]])
+    open = np.array([[10.0], [10.0], [8.0], [6.0]])
+    close = np.array([[10.0], [9.0], [7.0], [6.0]])
+    entry_bars, exit_bars, exit_prices = signals_to_trades(opening, closing)
+    results = simulate_portfolio(entry_bars, exit_bars, open, close, 100, PortfolioRules(position_size=0.5), exit_prices, short=True)
+    assert results["trades"]["shares"].tolist() == [-5.0]
+    assert results["trades"]["closing-index"].tolist() == [3]
+    assert results["equity"].tolist() == pytest.approx([100, 105, 115, 120])
+    assert results["invested"][1] == pytest.approx(-45)
+    assert results["exposure"][1] == pytest.approx(45 / 105)
+
+# The portfolio of a strategy selling short with stops makes the trades of the report of every symbol
+@pytest.mark.usefixtures("cache_directory")
+def test_strategy_portfolio_matches_reports():
+    strategy_dict = {"marketData": [{"symbol": "AAA, BBB", "frequency": 1, "frequencyType": "Daily"}],
+                     "studies": [{"id": 0, "name": "SimpleMovingAverage", "params": {"marketDataIds": [0], "length": 10}},
+                                 {"id": 1, "name": "SimpleMovingAverage", "params": {"marketDataIds": [0], "length": 30}}],
+                     "opening": {"type": "SellToOpen", "condition": "S0 $crosses-below$ S1"},
+                     "closing": {"condition": "S0 $crosses-above$ S1", "stopLoss": {"atr": 2}, "trailingStop": {"percent": 4}},
+                     "portfolio": {"positionSize": 0.1},
+                     "initialBalance": 10000}
+    for symbol in ["AAA", "BBB"]:
+        generate_market_data(symbol, 1500).save()
+    _, trades = Strategy(strategy_dict, get_fresh_data=False).simulate_portfolio()
+    reports = []
+    for symbol in ["AAA", "BBB"]:
+        symbol_dict = copy.deepcopy(strategy_dict)
+        symbol_dict["marketData"][0]["symbol"] = symbol
+        reports.append(Strategy(symbol_dict, get_fresh_data=False).generate_single_report())
+    report = pd.concat(reports).sort_values(["opening-date", "symbol"], ignore_index=True)
+    trades = trades.sort_values(["opening-date", "symbol"], ignore_index=True)
+    assert len(report) > 0 and (trades["shares"] < 0).all()
+    assert trades["symbol"].tolist() == report["symbol"].tolist()
+    assert (trades["opening-date"].to_numpy() == report["opening-date"].to_numpy()).all()
+    assert (trades["closing-date"].to_numpy() == report["closing-date"].to_numpy()).all()
+    np.testing.assert_allclose(trades["closing-price"], report["closing-price"])
+    np.testing.assert_allclose(trades["final-pl"], report["final-pl"])
@@ -0,0 +1,92 @@
+from report import ReportWriter
+
+import json
+import os
+import pandas as pd
+import pytest
+
+pytestmark = pytest.mark.usefixtures("cache_directory")
+
+COLUMNS = ["symbol", "final-pl"]
+
+def make_report(symbol : str, rows : int) -> pd.DataFrame:
+    return pd.DataFrame({"symbol": [symbol] * rows, "final-pl": [float(i) for i in range(rows)]})
+
+def read_progress() -> list:
+    with open("report.csv.progress") as file:
+        return [json.loads(line) for line in file]
+
+class FakeClock:
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+def test_flush_every_symbols():
+    writer = ReportWriter("report.csv", COLUMNS, flush_symbols=2)
+    writer.write("A", make_report("A", 1))
+    assert writer.rows == 0
+    writer.write("B", make_report("B", 0))
+    assert writer.rows == 1
+    assert read_progress() == [{"symbols": ["A", "B"], "size": os.path.getsize("report.csv")}]
+    writer.close()
+
+def test_flush_every_seconds():
+    clock = FakeClock()
+    writer = ReportWriter("report.csv", COLUMNS, flush_seconds=10, clock=clock)
+    writer.write("A", make_report("A", 3))
+    clock.now = 5
+    writer.write("B", make_report("B", 3))
+    assert writer.rows == 0
+    clock.now = 11
+    writer.write("C", make_report("C", 3))
+    assert writer.rows == 9
+    clock.now = 15
+    writer.write("D", make_report("D", 3))
+    assert writer.rows == 9
+    writer.close()
+    assert [progress["symbols"] for progress in read_progress()] == [["A", "B", "C"], ["D"]]
+
+def test_flush_every_rows():
+    writer = ReportWriter("report.csv", COLUMNS, flush_rows=5)
+    writer.write("A", make_report("A", 4))
+    assert writer.rows == 0
+    writer.write("B", make_report("B", 4))
+    assert writer.rows == 8
+    writer.close()
+
+def test_report_without_trades_has_header():
+    with ReportWriter("report.csv", COLUMNS) as writer:
+        writer.write("A", make_report("A", 0))
+    report = pd.read_csv("report.csv")
+    assert list(report.columns) == COLUMNS and len(report) == 0
+
+# An interrupted run (with a write cut short in the report and in the progress file) is resumed
+# from the last symbols that were completely written
+def test_resume_after_interruption():
+    writer = ReportWriter("report.csv", COLUMNS, flush_symbols=2)
+    for symbol in ["A", "B", "C", "D"]:
+        writer.write(symbol, make_report(symbol, 2))
+    writer.write("E", make_report("E", 2))
+    # The run stops while writing the rows of E and F, before their progress is recorded
+    with open("report.csv", "a") as file:
+        file.write("E,0.0\nE,1.0\nF,0.")
+    with open("report.csv.progress", "a") as file:
+        file.write('{"symbols": ["E", "F"], "si')
+    with ReportWriter("report.csv", COLUMNS, resume=True) as writer:
+        assert writer.done_symbols == {"A", "B", "C", "D"}
+        for symbol in ["E", "F"]:
+            writer.write(symbol, make_report(symbol, 2))
+    report = pd.read_csv("report.csv")
+    expected = pd.concat([make_report(symbol, 2) for symbol in "ABCDEF"], ignore_index=True)
+    pd.testing.assert_frame_equal(report, expected)
+
+def test_no_resume_starts_over():
+    with ReportWriter("report.csv", COLUMNS) as writer:
+        writer.write("A", make_report("A", 2))
+    with ReportWriter("report.csv", COLUMNS) as writer:
+        assert writer.done_symbols == set()
+        writer.write("B", make_report("B", 1))
+    assert pd.read_csv("report.csv")["symbol"].tolist() == ["B"]
@@ -0,0 +1,79 @@
+from benchmarks import generate_market_data
+from datamodels import MarketData
+from enums import FrequencyType
+from resample import SESSION_TIMEZONE, can_resample, get_resampled, resample
+
+import instrumentation
+import numpy as np
+import pandas as pd
+import pytest
+
+# Minute candles of the sessions (9:30 to 16:00 in New York, Monday to Friday) of about six weeks
+def make_minute_candles(symbol : str = "AAA", bars : int = 60000) -> MarketData:
+    market_data = generate_market_data(symbol, bars, FrequencyType.Minute, 1)
+    local = market_data.candles.index.tz_convert(SESSION_TIMEZONE)
+    minutes = local.hour * 60 + local.minute
+    in_session = (minutes >= 9 * 60 + 30) & (minutes < 16 * 60) & (local.weekday < 5)
+    return MarketData(symbol, market_data.candles[in_session], FrequencyType.Minute, 1)
+
+# Bars grouped by pandas on the local time of the session, dated when they start
+def pandas_resample(market_data : MarketData, get_start) -> pd.DataFrame:
+    candles = market_data.candles
+    local = candles.index.tz_convert(SESSION_TIMEZONE).tz_localize(None)
+    bars = candles.groupby(get_start(local)).agg({"open": "first", "high": "max", "low": "min", "close": "last", "volume": "sum"})
+    bars.index = pd.DatetimeIndex(bars.index).tz_localize(SESSION_TIMEZONE)
+    return bars
+
+def assert_same_bars(market_data : MarketData, bars : pd.DataFrame) -> None:
+    assert market_data.get_length() == len(bars)
+    np.testing.assert_array_equal(market_data.get_timestamps(), MarketData.index_to_timestamps(bars.index))
+    for column in bars:
+        np.testing.assert_array_equal(market_data.get_column(column), bars[column].to_numpy())
+
+@pytest.mark.parametrize("frequency", [5, 10, 15, 30])
+def test_minutes_match_pandas(frequency):
+    market_data = make_minute_candles()
+    bars = pandas_resample(market_data, lambda local: local.floor(f"{frequency}min"))
+    assert_same_bars(resample(market_data, FrequencyType.Minute, frequency), bars)
+
+def test_days_from_minutes_match_pandas():
+    market_data = make_minute_candles()
+    assert_same_bars(resample(market_data, FrequencyType.Daily, 1), pandas_resample(market_data, lambda local: local.normalize()))
+
+@pytest.mark.parametrize("frequency_type", [FrequencyType.Weekly, FrequencyType.Monthly])
+def test_weeks_and_months_match_pandas(frequency_type):
+    market_data = generate_market_data("AAA", 1000)
+    if frequency_type == FrequencyType.Weekly:
+        get_start = lambda local: local.normalize() - pd.to_timedelta(local.weekday, unit="D")
+    else:
+        get_start = lambda local: local.to_period("M").start_time
+    assert_same_bars(resample(market_data, frequency_type, 1), pandas_resample(market_data, get_start))
+
+def test_can_resample():
+    assert can_resample(FrequencyType.Minute, 1, FrequencyType.Minute, 15)
+    assert not can_resample(FrequencyType.Minute, 10, FrequencyType.Minute, 15)
+    assert can_resample(FrequencyType.Minute, 5, FrequencyType.Daily, 1)
+    assert can_resample(FrequencyType.Daily, 1, FrequencyType.Weekly, 1)
+    assert not can_resample(FrequencyType.Weekly, 1, FrequencyType.Daily, 1)
+    with pytest.raises(ValueError):
+        resample(generate_market_data("AAA", 10), FrequencyType.Minute, 5)
+
+def test_empty_candles():
+    resampled = resample(generate_market_data("AAA", 0, FrequencyType.Minute, 1), FrequencyType.Minute, 5)
+    assert resampled.get_length() == 0 and len(resampled.candles) == 0
+
+# The resampled bars are cached, and extended when the finer candles grow
+@pytest.mark.usefixtures("cache_directory")
+def test_resampled_bars_are_cached_and_extended():
+    sink = instrumentation.add_sink(instrumentation.MemorySink())
+    try:
+        market_data = make_minute_candles()
+        first = MarketData("AAA", market_data.candles.iloc[:market_data.get_length() // 2], FrequencyType.Minute, 1)
+        assert_same_bars(get_resampled(first, FrequencyType.Minute, 15), resample(first, FrequencyType.Minute, 15).candles)
+        assert_same_bars(get_resampled(first, FrequencyType.Minute, 15), resample(first, FrequencyType.Minute, 15).candles)
+        assert_same_bars(get_resampled(market_data, FrequencyType.Minute, 15), resample(market_data, FrequencyType.Minute, 15).candles)
+        assert_same_bars(get_resampled(market_data, FrequencyType.Minute, 15), resample(market_data, FrequencyType.Minute, 15).candles)
+        events = sink.get_events("resample-cache")
+        assert [list(event["counts"]) for event in events] == [["misses"], ["cache_hits"], ["extensions"], ["cache_hits"]]
+    finally:
+        instrumentation.clear_sinks()
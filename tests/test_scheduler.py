@@ -0,0 +1,90 @@
+import multiprocessing
+import time
+
+import pytest
+import requests
+
+from scheduler import RequestError, RequestScheduler, RetryPolicy, TokenBucket
+
+# A clock that only moves when something sleeps on it
+class FakeClock:
+
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds : float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class FakeResponse:
+
+    def __init__(self, status_code : int, headers : dict = None) -> None:
+        self.status_code = status_code
+        self.headers = {} if headers is None else headers
+        self.text = ""
+
+def test_bucket_allows_burst_then_rate():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        assert bucket.acquire() == 0
+    for _ in range(4):
+        bucket.acquire()
+    assert clock.now == pytest.approx(2.0)
+
+def test_bucket_pause_delays_every_request():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, capacity=5, clock=clock, sleep=clock.sleep)
+    bucket.pause(10)
+    bucket.acquire()
+    assert clock.now == pytest.approx(11.0)
+
+def test_scheduler_retries_until_success():
+    clock = FakeClock()
+    responses = [FakeResponse(503), FakeResponse(429, {"Retry-After": "2"}), FakeResponse(200)]
+    scheduler = RequestScheduler(requests_per_minute=6000, retry_policy=RetryPolicy(seed=0), clock=clock, sleep=clock.sleep)
+    assert scheduler.send(lambda: responses.pop(0)).status_code == 200
+    assert len(responses) == 0
+    assert clock.now >= 2.0
+
+def test_scheduler_returns_errors_not_retried():
+    scheduler = RequestScheduler(retry_policy=RetryPolicy(seed=0))
+    assert scheduler.send(lambda: FakeResponse(400)).status_code == 400
+
+def test_scheduler_gives_up():
+    clock = FakeClock()
+    scheduler = RequestScheduler(retry_policy=RetryPolicy(max_retries=2, seed=0), clock=clock, sleep=clock.sleep)
+
+    def fail() -> FakeResponse:
+        raise requests.ConnectionError("refused")
+
+    with pytest.raises(RequestError) as error:
+        scheduler.send(fail, "AAPL")
+    assert error.value.symbol == "AAPL"
+    assert error.value.attempts == 3
+    with pytest.raises(RequestError) as error:
+        scheduler.send(lambda: FakeResponse(500))
+    assert error.value.status_code == 500
+
+def acquire_tokens(bucket : TokenBucket, count : int, times) -> None:
+    for _ in range(count):
+        bucket.acquire()
+    times.put(time.monotonic())
+
+# Two processes taking tokens from a shared bucket get the rate between them, not each one
+def test_shared_bucket_limits_processes_together():
+    bucket = TokenBucket(rate=20, capacity=1, shared=True)
+    times = multiprocessing.Queue()
+    start = time.monotonic()
+    processes = [multiprocessing.Process(target=acquire_tokens, args=(bucket, 10, times)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    finished = max(times.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join()
+    # 20 tokens, the first one in the bucket, at 20 a second
+    assert finished - start >= 19 / 20 * 0.95
@@ -0,0 +1,120 @@
+import json
+
+import pytest
+
+from enums import FrequencyType, PeriodType
+from scheduler import RequestError, RequestScheduler, RetryPolicy
+from schwabapi import SchwabAPIClient
+
+PRICE_HISTORY = "/marketdata/v1/pricehistory"
+TOKEN = "/v1/oauth/token"
+
+pytestmark = pytest.mark.usefixtures("fake_server")
+
+def make_candles(symbol : str, count : int = 3) -> dict:
+    start = 1700000000000
+    candles = [{"open": i + 1.0, "high": i + 2.0, "low": i + 0.5, "close": i + 1.5, "volume": 100 * i, "datetime": start + 86400000 * i}
+               for i in range(count)]
+    return {"symbol": symbol, "candles": candles, "empty": count == 0}
+
+def make_client(fake_server) -> SchwabAPIClient:
+    scheduler = RequestScheduler(requests_per_minute=60000, burst=100, retry_policy=RetryPolicy(base_delay=0.001, seed=0))
+    return SchwabAPIClient(base_url=fake_server.url, scheduler=scheduler)
+
+def get_daily(client : SchwabAPIClient, symbol : str = "AAPL"):
+    return client.get_price_history(symbol, PeriodType.Year, 5, FrequencyType.Daily, 1)
+
+def test_get_price_history(fake_server):
+    fake_server.responses[PRICE_HISTORY] = [(200, make_candles("AAPL"))]
+    market_data = get_daily(make_client(fake_server))
+    assert market_data.get_length() == 3
+    assert market_data.candles["close"].tolist() == [1.5, 2.5, 3.5]
+    method, path, params, headers = fake_server.get_requests(PRICE_HISTORY)[0]
+    assert params["symbol"] == ["AAPL"] and params["periodType"] == ["year"]
+    assert headers["Authorization"] == "Bearer access-0"
+
+def test_throttled_and_failed_requests_are_retried(fake_server):
+    fake_server.responses[PRICE_HISTORY] = [(429, {}), (503, {}), (200, make_candles("AAPL"))]
+    assert get_daily(make_client(fake_server)).get_length() == 3
+    assert len(fake_server.get_requests(PRICE_HISTORY)) == 3
+
+def test_errors_are_raised(fake_server):
+    fake_server.responses[PRICE_HISTORY] = [(400, {"error": "bad symbol"})]
+    with pytest.raises(RequestError) as error:
+        get_daily(make_client(fake_server))
+    assert error.value.status_code == 400
+
+def test_retry_policy_of_the_caller_is_kept(fake_server):
+    policy = RetryPolicy()
+    scheduler = RequestScheduler(retry_policy=policy)
+    statuses = set(policy.retry_statuses)
+    client = SchwabAPIClient(base_url=fake_server.url, scheduler=scheduler)
+    assert policy.retry_statuses == statuses
+    assert scheduler.retry_policy is policy
+    assert 401 in client.scheduler.retry_policy.retry_statuses
+    # The rate limit is still the caller's
+    assert client.scheduler.bucket is scheduler.bucket
+
+# Every request is answered 401 until it comes with the refreshed token
+def answer_with_token(params : dict, headers : dict) -> tuple:
+    if headers["Authorization"] != "Bearer access-1":
+        return (401, {})
+    return (200, make_candles(params["symbol"][0]))
+
+def test_expired_token_is_refreshed_once(fake_server):
+    fake_server.responses[PRICE_HISTORY] = [answer_with_token]
+    fake_server.responses[TOKEN] = [(200, {"refresh_token": "refresh", "access_token": "access-1", "id_token": "id"})]
+    client = make_client(fake_server)
+    symbols = [f"S{i}" for i in range(20)]
+    errors = {}
+    market_datas = client.get_price_history_many(symbols, PeriodType.Year, 5, FrequencyType.Daily, 1, max_workers=8, errors=errors)
+    assert errors == {}
+    assert sorted(market_datas) == sorted(symbols)
+    assert len(fake_server.get_requests(TOKEN)) == 1
+    with open("tokens.json") as file:
+        assert json.load(file)["access_token"] == "access-1"
+
+# A token refreshed by another process (found in the tokens file) is used instead of refreshing it again
+def test_token_refreshed_by_another_process_is_reused(fake_server):
+    fake_server.responses[PRICE_HISTORY] = [answer_with_token]
+    client = make_client(fake_server)
+    with open("tokens.json", "r+") as file:
+        tokens = json.load(file)
+        tokens["access_token"] = "access-1"
+        file.seek(0)
+        json.dump(tokens, file)
+        file.truncate()
+    assert get_daily(client).get_length() == 3
+    assert len(fake_server.get_requests(TOKEN)) == 0
+
+def test_many_leaves_out_failed_symbols(fake_server):
+    def answer(params : dict, headers : dict) -> tuple:
+        symbol = params["symbol"][0]
+        return (404, {}) if symbol == "BAD" else (200, make_candles(symbol, 2))
+    fake_server.responses[PRICE_HISTORY] = [answer]
+    errors = {}
+    market_datas = make_client(fake_server).get_price_history_many(["A", "BAD", "C"], PeriodType.Year, 5, FrequencyType.Daily, 1, errors=errors)
+    assert sorted(market_datas) == ["A", "C"]
+    assert market_datas["C"].symbol == "C" and market_datas["C"].get_length() == 2
+    assert list(errors) == ["BAD"] and errors["BAD"].status_code == 404
+
+# The start date can be given by symbol; symbols without one get the whole period
+def test_many_start_dates(fake_server):
+    fake_server.responses[PRICE_HISTORY] = [lambda params, headers: (200, make_candles(params["symbol"][0]))]
+    make_client(fake_server).get_price_history_many(["A", "B"], PeriodType.Year, 5, FrequencyType.Daily, 1,
+                                                    start_date={"A": 123}, end_date=456)
+    params = {request[2]["symbol"][0]: request[2] for request in fake_server.get_requests(PRICE_HISTORY)}
+    assert params["A"]["startDate"] == ["123"] and params["A"]["endDate"] == ["456"]
+    assert "startDate" not in params["B"] and "endDate" not in params["B"]
+
+# The downloads of many symbols share the connections of the session instead of opening one each
+def test_many_reuses_connections(fake_server):
+    fake_server.responses[PRICE_HISTORY] = [lambda params, headers: (200, make_candles(params["symbol"][0]))]
+    scheduler = RequestScheduler(requests_per_minute=60000, burst=100)
+    client = SchwabAPIClient(base_url=fake_server.url, max_connections=4, scheduler=scheduler)
+    symbols = [f"S{i}" for i in range(40)]
+    market_datas = client.get_price_history_many(symbols, PeriodType.Year, 5, FrequencyType.Daily, 1, max_workers=4)
+    assert sorted(market_datas) == sorted(symbols)
+    assert all(market_datas[symbol].symbol == symbol for symbol in symbols)
+    assert len(fake_server.connections) == 40
+    assert len(set(fake_server.connections)) <= 4
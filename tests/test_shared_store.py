@@ -0,0 +1,66 @@
+from benchmarks import generate_market_data
+from concurrent.futures import ProcessPoolExecutor
+from datamodels import CANDLE_COLUMNS, MarketData
+from shared_store import SharedCandleStore, SharedMarketData, attach_block, get_layout
+
+import numpy as np
+import pytest
+
+def assert_same_columns(shared : MarketData, market_data : MarketData, rtol : float = 0) -> None:
+    assert shared.symbol == market_data.symbol and shared.get_length() == market_data.get_length()
+    np.testing.assert_array_equal(shared.get_timestamps(), market_data.get_timestamps())
+    for column in CANDLE_COLUMNS:
+        np.testing.assert_allclose(shared.get_column(column), market_data.get_column(column), rtol=rtol)
+
+def test_attach():
+    market_data = generate_market_data("AAA", 300)
+    with SharedCandleStore() as store:
+        handle = store.add(market_data)
+        assert store.add(market_data) is handle and len(store.blocks) == 1
+        shared = handle.attach()
+        assert_same_columns(shared, market_data)
+        assert not shared.get_column("close").flags.writeable
+        with pytest.raises(ValueError):
+            shared.get_column("close")[0] = 0
+        # The candles dataframe of the shared columns is the one of the market data
+        assert shared.candles.index.equals(market_data.candles.index)
+        del shared
+
+def test_float32_prices():
+    market_data = generate_market_data("AAA", 300)
+    with SharedCandleStore(np.float32) as store:
+        shared = store.add(market_data).attach()
+        assert shared.get_column("close").dtype == np.float32 and shared.get_column("volume").dtype == np.int64
+        assert_same_columns(shared, market_data, 1e-6)
+        assert store.get_size() < get_layout(300, np.float64)[1]
+        del shared
+    with pytest.raises(ValueError):
+        SharedCandleStore(np.int32)
+
+def test_empty_market_data():
+    market_data = generate_market_data("AAA", 0)
+    with SharedCandleStore() as store:
+        shared = store.add(market_data).attach()
+        assert shared.get_length() == 0 and len(shared.candles) == 0
+        del shared
+
+def sum_close(handle : SharedMarketData) -> float:
+    return float(handle.attach().get_column("close").sum())
+
+# Worker processes read the candles from the shared blocks
+def test_attach_in_other_processes():
+    market_datas = [generate_market_data(symbol, 500) for symbol in ["AAA", "BBB", "CCC"]]
+    with SharedCandleStore() as store:
+        handles = [store.add(market_data) for market_data in market_datas]
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            sums = list(executor.map(sum_close, handles))
+    assert sums == [float(market_data.get_column("close").sum()) for market_data in market_datas]
+
+# Closing the store removes its blocks
+def test_close_removes_blocks():
+    store = SharedCandleStore()
+    handle = store.add(generate_market_data("AAA", 100))
+    store.close()
+    assert store.blocks == [] and store.get_size() == 0
+    with pytest.raises(FileNotFoundError):
+        attach_block(handle.name)
@@ -0,0 +1,164 @@
+from simulation import ExitRules, find_trades, simulate_trades
+
+import numpy as np
+import pytest
+
+# Random candles around 100, with opening and closing signals on about 5% and 3% of the bars
+def make_candles(length : int, seed : int) -> tuple:
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, length)))
+    open = close * np.exp(rng.normal(0, 0.004, length))
+    high = np.maximum(open, close) * np.exp(np.abs(rng.normal(0, 0.006, length)))
+    low = np.minimum(open, close) * np.exp(-np.abs(rng.normal(0, 0.006, length)))
+    atr = np.abs(rng.normal(1.5, 0.3, length))
+    return rng.random(length) < 0.05, rng.random(length) < 0.03, open, high, low, atr
+
+# Trades found one bar at a time, as (entry, exit, exit price). A trade opens on the bar after an opening
+# signal while flat (unless a closing signal comes on the same bar), closes on the bar after a closing
+# signal or within a bar at its stop or target, and a new one can open on any bar after a stop.
+def loop_stop_exits(opening, closing, open, high, low, rules, atr, short) -> list:
+    sign = -1 if short else 1
+    trade_open, trade_high, trade_low = (-open, -low, -high) if short else (open, high, low)
+
+    def distance(exit_distance : dict, price : float, entry : int) -> float:
+        if "percent" in exit_distance:
+            return exit_distance["percent"] / 100 * abs(price)
+        return exit_distance["atr"] * atr[entry - 1]
+
+    results = []
+    entry = None
+    for bar in range(1, len(open)):
+        if entry is not None and closing[bar - 1]:
+            results.append((entry, bar, sign * trade_open[bar]))
+            entry = None
+        elif entry is None and opening[bar - 1] and not closing[bar - 1]:
+            entry = bar
+            entry_price = trade_open[bar]
+            best = entry_price
+        if entry is None:
+            continue
+        stop = -np.inf
+        if rules.stop_loss is not None:
+            stop = entry_price - distance(rules.stop_loss, entry_price, entry)
+        if rules.trailing_stop is not None:
+            stop = max(stop, best - distance(rules.trailing_stop, best, entry))
+        target = np.inf if rules.take_profit is None else entry_price + distance(rules.take_profit, entry_price, entry)
+        if trade_low[bar] <= stop:
+            results.append((entry, bar, sign * min(trade_open[bar], stop)))
+            entry = None
+        elif trade_high[bar] >= target:
+            results.append((entry, bar, sign * max(trade_open[bar], target)))
+            entry = None
+        elif not np.isnan(trade_high[bar]):
+            best = max(best, trade_high[bar])
+    # A trade still open at the end is left out
+    return results
+
+# The trades of the per-bar loop that simulate_trades replaced, as lists of
+# (entry, exit, opening price, closing price, lowest P/L, highest P/L, final P/L)
+def loop_trades(opening, closing, open, high, low) -> list:
+    trades = []
+    is_open = False
+    for index in range(1, len(open)):
+        # We look for an opening signal in previous index and open in the current one
+        if opening[index - 1] and not is_open:
+            entry = index
+            current_lowest = low[index]
+            current_highest = high[index]
+            is_open = True
+        if closing[index - 1] and is_open:
+            is_open = False
+            # If the closing and opening condition occur simultaneously, then the trade is ignored
+            if entry != index:
+                trades.append((entry, index, open[entry], open[index],
+                               (current_lowest / open[entry] - 1) * 100,
+                               (current_highest / open[entry] - 1) * 100,
+                               (open[index] / open[entry] - 1) * 100))
+        if is_open:
+            current_lowest = min(current_lowest, low[index])
+            current_highest = max(current_highest, high[index])
+    # A trade without a closing signal is left out
+    return trades
+
+@pytest.mark.parametrize("density", [(0.05, 0.03), (0.3, 0.3), (0.02, 0.2), (0.5, 0.01)])
+def test_trades_match_loop(density):
+    rng = np.random.default_rng(int(density[0] * 100 + density[1] * 1000))
+    for case in range(200):
+        length = int(rng.integers(2, 300))
+        opening, closing, open, high, low, atr = make_candles(length, case)
+        opening = rng.random(length) < density[0]
+        closing = rng.random(length) < density[1]
+        # Half of the cases end with a trade that is still open
+        if case % 2 == 0:
+            closing[length // 2:] = False
+        trades = simulate_trades(opening, closing, open, high, low)
+        columns = ["opening-index", "closing-index", "opening-price", "closing-price", "lowest-pl", "highest-pl", "final-pl"]
+        expected = loop_trades(opening, closing, open, high, low)
+        assert len(trades["opening-index"]) == len(expected)
+        for position, name in enumerate(columns):
+            assert np.allclose(trades[name], [trade[position] for trade in expected])
+
+RULES = [ExitRules({"percent": 2}),
+         ExitRules(take_profit={"percent": 3}),
+         ExitRules(trailing_stop={"percent": 2.5}),
+         ExitRules({"atr": 2}, {"atr": 3}, {"atr": 2.5}),
+         ExitRules({"percent": 5}, {"atr": 2}, {"percent": 1.5})]
+
+@pytest.mark.parametrize("short", [False, True])
+@pytest.mark.parametrize("rules", RULES)
+def test_stop_exits_match_loop(rules, short):
+    for seed in range(5):
+        opening, closing, open, high, low, atr = make_candles(1000, seed)
+        high[::17] = np.nan
+        low[::17] = np.nan
+        trades = simulate_trades(opening, closing, open, high, low, rules, atr, short)
+        expected = loop_stop_exits(opening, closing, open, high, low, rules, atr, short)
+        assert list(zip(trades["opening-index"], trades["closing-index"])) == [(entry, exit) for entry, exit, price in expected]
+        assert np.allclose(trades["closing-price"], [price for entry, exit, price in expected])
+
+# Trades that never reach their stop keep their signal exits (regression: this raised an IndexError)
+def test_stop_exits_without_hits():
+    open = np.linspace(100, 101, 10)
+    opening = np.zeros(10, dtype=bool)
+    closing = np.zeros(10, dtype=bool)
+    opening[1] = True
+    closing[5] = True
+    trades = simulate_trades(opening, closing, open, open + 0.1, open - 0.1, ExitRules({"percent": 50}))
+    expected = simulate_trades(opening, closing, open, open + 0.1, open - 0.1)
+    assert list(trades["opening-index"]) == [2]
+    assert list(trades["closing-index"]) == [6]
+    assert np.allclose(trades["final-pl"], expected["final-pl"])
+
+def test_stop_exits_2d_match_columns():
+    opening, closing, open, high, low, atr = make_candles(1000, 7)
+    opening = np.column_stack([opening, np.roll(opening, 7), opening])
+    closing = np.column_stack([closing, closing, np.roll(closing, 3)])
+    rules = ExitRules({"percent": 3}, {"atr": 2}, {"percent": 2})
+    trades = simulate_trades(opening, closing, open, high, low, rules, atr)
+    for column in range(3):
+        column_trades = simulate_trades(opening[:, column], closing[:, column], open, high, low, rules, atr)
+        in_column = trades["column"] == column
+        for name, values in column_trades.items():
+            assert np.array_equal(values, trades[name][in_column], equal_nan=True)
+
+def test_short_pl_is_opposite():
+    opening, closing, open, high, low, atr = make_candles(500, 3)
+    long_trades = simulate_trades(opening, closing, open, high, low)
+    short_trades = simulate_trades(opening, closing, open, high, low, short=True)
+    assert np.allclose(short_trades["final-pl"], (1 - short_trades["closing-price"] / short_trades["opening-price"]) * 100)
+    assert np.allclose(short_trades["final-pl"], -long_trades["final-pl"])
+
+# After a stop, the next opening signal opens a new trade before the closing signal of the stopped one
+def test_stop_exits_reenter():
+    open = np.array([100.0, 100, 100, 90, 90, 95, 95, 95, 95, 95])
+    high = open + 1
+    low = open - 1
+    opening = np.zeros(10, dtype=bool)
+    closing = np.zeros(10, dtype=bool)
+    opening[[0, 2, 4, 6]] = True
+    closing[8] = True
+    trades = simulate_trades(opening, closing, open, high, low, ExitRules({"percent": 5}))
+    # Stopped at the open of bar 3 (a gap below the stop), opened again on bar 5 after the signal on bar 4
+    assert list(trades["opening-index"]) == [1, 5]
+    assert list(trades["closing-index"]) == [3, 9]
+    assert np.allclose(trades["closing-price"], [90, 95])
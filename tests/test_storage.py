@@ -0,0 +1,54 @@
+from benchmarks import generate_market_data
+from datamodels import JSONStorage, MarketData, NumpyStorage, migrate_json_cache
+from enums import FrequencyType
+
+import numpy as np
+import pandas as pd
+import pytest
+import utils
+
+pytestmark = pytest.mark.usefixtures("cache_directory")
+
+PATH = MarketData.get_path(FrequencyType.Daily, 1)
+
+# The JSON files keep 10 significant digits of the prices (and the dates in UTC), the columnar files all of them
+def assert_same_candles(loaded : MarketData, market_data : MarketData, rtol : float = 0) -> None:
+    assert loaded.symbol == market_data.symbol
+    assert np.array_equal(loaded.get_timestamps(), market_data.get_timestamps())
+    if (rtol == 0):
+        pd.testing.assert_index_equal(loaded.candles.index, market_data.candles.index)
+    for column in ["open", "high", "low", "close", "volume"]:
+        np.testing.assert_allclose(loaded.get_column(column), market_data.get_column(column), rtol=rtol)
+
+@pytest.mark.parametrize("storage", [NumpyStorage(), NumpyStorage(mmap_mode=None), JSONStorage()])
+def test_storage_round_trip(storage):
+    market_data = generate_market_data("AAA", 300)
+    assert not storage.exists(PATH, "AAA")
+    storage.save(market_data, PATH)
+    assert storage.exists(PATH, "AAA")
+    assert_same_candles(storage.load(PATH, "AAA", FrequencyType.Daily, 1), market_data, 1e-9 if isinstance(storage, JSONStorage) else 0)
+
+def test_numpy_storage_maps_columns():
+    market_data = generate_market_data("AAA", 300)
+    market_data.save()
+    loaded = MarketData.load("AAA", FrequencyType.Daily, 1)
+    assert isinstance(np.load(NumpyStorage().get_fname(PATH, "AAA") + "\\close.npy", mmap_mode="r"), np.memmap)
+    assert_same_candles(loaded, market_data)
+
+# Symbols cached as JSON by older versions are moved to the columnar cache the first time they are read
+def test_json_cache_is_migrated_on_load():
+    market_data = generate_market_data("AAA", 200)
+    JSONStorage().save(market_data, PATH)
+    assert MarketData.load("AAA", FrequencyType.Daily, 1) is None
+    assert_same_candles(utils.load_market_data("AAA", FrequencyType.Daily, 1), market_data, 1e-9)
+    assert_same_candles(MarketData.load("AAA", FrequencyType.Daily, 1), market_data, 1e-9)
+
+def test_migrate_json_cache():
+    market_datas = [generate_market_data(symbol, 100) for symbol in ["AAA", "BBB"]]
+    for market_data in market_datas:
+        JSONStorage().save(market_data, PATH)
+    assert migrate_json_cache(remove_json=True) == 2
+    assert migrate_json_cache() == 0
+    for market_data in market_datas:
+        assert not JSONStorage().exists(PATH, market_data.symbol)
+        assert_same_candles(MarketData.load(market_data.symbol, FrequencyType.Daily, 1), market_data, 1e-9)
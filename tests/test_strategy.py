@@ -0,0 +1,85 @@
+from benchmarks import generate_market_data, get_strategy_dict
+from strategy import Strategy
+
+import pandas as pd
+import pytest
+import strategy as strategy_module
+import utils
+
+pytestmark = pytest.mark.usefixtures("cache_directory")
+
+SYMBOLS = ["AAA", "BBB", "CCC", "DDD", "EEE"]
+
+# The strategy of the benchmarks, with a study of another symbol (read by the workers from shared memory)
+def make_strategy_dict() -> dict:
+    for symbol in SYMBOLS + ["SPY"]:
+        generate_market_data(symbol, 800).save()
+    strategy_dict = get_strategy_dict(SYMBOLS + ["MISSING"])
+    strategy_dict["marketData"].append({"symbol": "SPY", "frequency": 1, "frequencyType": "Daily"})
+    strategy_dict["studies"].append({"id": 4, "name": "RealRelativeStrength", "params": {"marketDataIds": [0, 1], "length": 12}})
+    strategy_dict["opening"]["condition"] += " & S4 > -1"
+    return strategy_dict
+
+# The report of every symbol written by the worker processes is the one written by a single process,
+# in the same order, and a symbol without market data is recorded as failed in both
+@pytest.mark.parametrize("chunk_size", [None, 1, 4])
+def test_global_report_workers_match_single_process(chunk_size):
+    strategy_dict = make_strategy_dict()
+    strategy = Strategy(strategy_dict, get_fresh_data=False)
+    strategy.generate_global_report(workers=1, file_name="single.csv")
+    assert list(strategy.failed_symbols) == ["MISSING"]
+    strategy = Strategy(strategy_dict, get_fresh_data=False)
+    strategy.generate_global_report(workers=2, chunk_size=chunk_size, file_name="workers.csv")
+    assert list(strategy.failed_symbols) == ["MISSING"]
+    single = pd.read_csv("single.csv")
+    assert len(single) > 0 and single["symbol"].is_monotonic_increasing
+    pd.testing.assert_frame_equal(pd.read_csv("workers.csv"), single)
+
+# The global report has the reports of every symbol one after the other
+def test_global_report_matches_single_reports():
+    strategy_dict = make_strategy_dict()
+    Strategy(strategy_dict, get_fresh_data=False).generate_global_report(file_name="report.csv")
+    reports = []
+    for symbol in SYMBOLS:
+        strategy_dict["marketData"][0]["symbol"] = symbol
+        reports.append(Strategy(strategy_dict, get_fresh_data=False).generate_single_report())
+    reports = pd.concat(reports, ignore_index=True)
+    report = pd.read_csv("report.csv")
+    assert report["symbol"].tolist() == reports["symbol"].tolist()
+    pd.testing.assert_series_equal(report["final-pl"], reports["final-pl"])
+
+# A malformed condition is rejected when the strategy is created, before any market data is loaded
+def test_malformed_condition_is_rejected():
+    strategy_dict = get_strategy_dict(SYMBOLS)
+    strategy_dict["closing"]["condition"] = "S0 $crosses-below$ (S1 | S2 > 95"
+    with pytest.raises(ValueError, match="Unmatched"):
+        Strategy(strategy_dict, get_fresh_data=False)
+
+# Creating a strategy only reads the strategy file, the market data is loaded when it is first needed
+def test_strategy_is_loaded_lazily(monkeypatch):
+    for symbol in ["AAA", "SPY"]:
+        generate_market_data(symbol, 300).save()
+    strategy_dict = get_strategy_dict(["AAA"])
+    strategy_dict["marketData"].append({"symbol": "SPY", "frequency": 1, "frequencyType": "Daily"})
+    strategy_dict["studies"].append({"id": 4, "name": "RealRelativeStrength", "params": {"marketDataIds": [0, 1], "length": 12}})
+    loaded = []
+    def get_market_data(symbol, *args, **kwargs):
+        loaded.append(symbol)
+        return utils.get_market_data(symbol, *args, **kwargs)
+    monkeypatch.setattr(strategy_module, "get_market_data", get_market_data)
+    strategy = Strategy(strategy_dict, get_fresh_data=False)
+    assert loaded == [] and strategy.market_data_list == [None, None] and strategy.studies_list == []
+    strategy.evaluate_expression("S4 > 0")
+    assert sorted(loaded) == ["AAA", "SPY"] and len(strategy.studies_list) == 5
+    assert strategy.opening_indices is None
+    strategy.generate_single_report()
+    assert sorted(loaded) == ["AAA", "SPY"]
+
+# Studies and market data IDs are checked when the strategy is created
+@pytest.mark.parametrize("study, message", [({"id": 4, "name": "Unknown", "params": {"marketDataIds": [0]}}, "Unknown study"),
+                                            ({"id": 4, "name": "TrueRange", "params": {"marketDataIds": [1]}}, "market data ID 1")])
+def test_invalid_study_is_rejected(study, message):
+    strategy_dict = get_strategy_dict(SYMBOLS)
+    strategy_dict["studies"].append(study)
+    with pytest.raises(ValueError, match=message):
+        Strategy(strategy_dict, get_fresh_data=False)
@@ -0,0 +1,142 @@
+from alignment import Alignment
+from benchmarks import STUDIES, generate_market_data, get_strategy_dict
+from datamodels import CANDLE_COLUMNS, MarketData
+from enums import FrequencyType
+from resample import resample
+from strategy import Strategy
+from streaming import StreamingEvaluator
+from test_resample import make_minute_candles
+
+import math
+import numpy as np
+import pandas as pd
+import pytest
+import re
+import studies
+
+pytestmark = pytest.mark.usefixtures("cache_directory")
+
+# Studies that can be updated one candle at a time
+UPDATED_STUDIES = [name for name in STUDIES if name != "RealRelativeStrength"]
+
+@pytest.fixture(autouse=True)
+def clear_study_cache():
+    studies.study_cache.clear()
+
+def get_candles(market_data : MarketData) -> list:
+    columns = [market_data.candles[column].to_numpy(dtype=np.float64) for column in CANDLE_COLUMNS]
+    return [dict(zip(CANDLE_COLUMNS, [column[i] for column in columns])) for i in range(market_data.get_length())]
+
+def get_lines(values) -> dict:
+    if isinstance(values, (dict, pd.DataFrame)):
+        return {line: values[line] for line in values}
+    return {None: values}
+
+# Updating a study with every candle gives the values of the study calculated on all of them
+@pytest.mark.parametrize("name", UPDATED_STUDIES)
+@pytest.mark.parametrize("displace", [0, 2])
+def test_updates_match_calculation(name, displace):
+    market_data = generate_market_data("AAA", 400)
+    study = STUDIES[name](market_data, None)
+    study.displace = displace
+    study.calculate()
+    updates = [get_lines(study.update(candle)) for candle in get_candles(market_data)]
+    for line, values in get_lines(study.values).items():
+        np.testing.assert_allclose([update[line] for update in updates], np.asarray(values, dtype=np.float64),
+                                   rtol=1e-9, atol=1e-12, err_msg=f"{name} {line}")
+
+# A study primed with the first candles continues with the next ones like a study updated with all of them,
+# also when there are fewer candles than its window or its displacement
+@pytest.mark.parametrize("name", UPDATED_STUDIES)
+@pytest.mark.parametrize("displace", [0, 2])
+@pytest.mark.parametrize("bars", [1, 250])
+def test_primed_updates_match_calculation(name, displace, bars):
+    market_data = generate_market_data("AAA", 400)
+    study = STUDIES[name](market_data, None)
+    study.displace = displace
+    study.calculate()
+    study.prime(bars)
+    updates = [get_lines(study.update(candle)) for candle in get_candles(market_data)[bars:]]
+    for line, values in get_lines(study.values).items():
+        np.testing.assert_allclose([update[line] for update in updates], np.asarray(values, dtype=np.float64)[bars:],
+                                   rtol=1e-9, atol=1e-12, err_msg=f"{name} {line}")
+
+def test_displaced_into_the_future_can_not_be_updated():
+    study = studies.SimpleMovingAverage(generate_market_data("AAA", 10), 3, displace=-1)
+    with pytest.raises(ValueError):
+        study.update({"open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0, "volume": 1.0})
+    with pytest.raises(ValueError):
+        study.prime()
+
+def test_study_without_updates():
+    market_data = generate_market_data("AAA", 10)
+    study = studies.RealRelativeStrength(market_data, market_data, 3)
+    assert not study.can_update()
+    with pytest.raises(NotImplementedError):
+        study.update(get_candles(market_data)[0])
+
+# The conditions evaluated on every live candle, after the candles the strategy already had,
+# are the conditions of the strategy evaluated on all of them
+def test_streaming_matches_batch_evaluation():
+    market_data = generate_market_data("AAA", 1000)
+    history = 700
+    strategy_dict = get_strategy_dict(["AAA"])
+    strategy = Strategy(strategy_dict, get_fresh_data=False)
+    strategy.load_symbol(0, MarketData("AAA", market_data.candles.iloc[:history], market_data.frequency_type, market_data.frequency))
+    evaluator = StreamingEvaluator(strategy)
+    signals = [evaluator.update(candle) for candle in get_candles(market_data)[history:]]
+    batch = Strategy(strategy_dict, get_fresh_data=False)
+    batch.load_symbol(0, market_data)
+    batch.load()
+    opening = [opening for opening, closing in signals]
+    closing = [closing for opening, closing in signals]
+    assert any(opening) and any(closing)
+    np.testing.assert_array_equal(opening, batch.opening_indices[history:])
+    np.testing.assert_array_equal(closing, batch.closing_indices[history:])
+    assert not math.isnan(evaluator.study_values[0])
+
+# A strategy with a study that can not be updated is rejected when the evaluator is created
+def test_strategy_with_study_without_updates_is_rejected():
+    for symbol in ["AAA", "SPY"]:
+        generate_market_data(symbol, 300).save()
+    strategy_dict = get_strategy_dict(["AAA"])
+    strategy_dict["marketData"].append({"symbol": "SPY", "frequency": 1, "frequencyType": "Daily"})
+    strategy_dict["studies"].append({"id": 4, "name": "RealRelativeStrength", "params": {"marketDataIds": [0, 1], "length": 12}})
+    strategy_dict["opening"]["condition"] += " & S4 > 0"
+    with pytest.raises(ValueError, match=re.escape("RealRelativeStrength (S4) can not be updated incrementally")):
+        StreamingEvaluator(Strategy(strategy_dict, get_fresh_data=False))
+
+# A strategy on 5 minute candles with a study of the daily candles of another symbol, whose candles are given
+# with the last 5 minute candle of their session, gives the conditions of the full evaluation
+def test_streaming_with_other_timeframe_matches_batch_evaluation():
+    market_data = resample(make_minute_candles(bars=30000), FrequencyType.Minute, 5)
+    daily = resample(make_minute_candles("SPY", bars=30000), FrequencyType.Daily, 1)
+    history = market_data.get_length() * 2 // 3
+    history_data = MarketData("AAA", market_data.candles.iloc[:history], FrequencyType.Minute, 5)
+    # The daily candles given live are the ones that close after the history
+    closed = int(Alignment(daily, history_data).positions[-1]) + 1
+    strategy_dict = get_strategy_dict(["AAA"])
+    strategy_dict["marketData"][0].update({"frequency": 5, "frequencyType": "Minute"})
+    strategy_dict["marketData"].append({"symbol": "SPY", "frequency": 1, "frequencyType": "Daily"})
+    strategy_dict["studies"].append({"id": 4, "name": "SimpleMovingAverage", "params": {"marketDataIds": [1], "length": 3, "price": "close"}})
+    strategy_dict["studies"].append({"id": 5, "name": "ExponentialMovingAverage", "params": {"marketDataIds": [1], "length": 2, "price": "close"}})
+    strategy_dict["opening"]["condition"] = "S0 $crosses-above$ S1 & S4 > S5"
+    strategy_dict["closing"]["condition"] = "S0 $crosses-below$ S1 | S4 $crosses-below$ S5"
+    daily.save()
+    strategy = Strategy(strategy_dict, get_fresh_data=False)
+    strategy.load_symbol(0, history_data)
+    evaluator = StreamingEvaluator(strategy)
+    positions = Alignment(daily, market_data).positions
+    daily_candles = get_candles(daily)
+    signals = []
+    for bar, candle in enumerate(get_candles(market_data)[history:], history):
+        other_candles = {1: daily_candles[positions[bar]]} if positions[bar] >= closed and positions[bar] != positions[bar - 1] else None
+        signals.append(evaluator.update(candle, other_candles))
+    batch = Strategy(strategy_dict, get_fresh_data=False)
+    batch.load_symbol(0, market_data)
+    batch.load()
+    opening = [opening for opening, closing in signals]
+    closing = [closing for opening, closing in signals]
+    assert any(opening) and any(closing)
+    np.testing.assert_array_equal(opening, batch.opening_indices[history:])
+    np.testing.assert_array_equal(closing, batch.closing_indices[history:])
@@ -0,0 +1,209 @@
+from alignment import get_close_times
+from benchmarks import STUDIES, generate_market_data, get_strategy_dict
+from datamodels import MarketData, MarketPanel
+from dynamic_enums import AvailableStudies
+from enums import AverageType, FrequencyType, PriceType
+from strategy import Strategy
+
+import copy
+import numpy as np
+import pandas as pd
+import pytest
+import studies
+
+# Symbols with all the dates, with a few dates missing in the middle, and starting later
+def make_market_datas(bars : int = 600) -> list:
+    market_datas = [generate_market_data(symbol, bars) for symbol in ["AAA", "BBB", "CCC"]]
+    candles = market_datas[1].candles
+    missing = np.zeros(shape=bars, dtype=bool)
+    missing[100:400:7] = True
+    missing[450:460] = True
+    market_datas[1] = MarketData("BBB", candles[~missing], market_datas[1].frequency_type, market_datas[1].frequency)
+    market_datas[2] = MarketData("CCC", market_datas[2].candles.iloc[50:], market_datas[2].frequency_type, market_datas[2].frequency)
+    return market_datas
+
+def get_lines(values) -> dict:
+    if isinstance(values, (dict, pd.DataFrame)):
+        return {line: values[line] for line in values}
+    return {None: values}
+
+@pytest.fixture(autouse=True)
+def clear_study_cache():
+    studies.study_cache.clear()
+
+# The studies of a panel give every symbol the values of the study of the symbol on its own,
+# also when it misses some of the dates of the other symbols (and NaN on those dates)
+@pytest.mark.parametrize("name", list(STUDIES))
+def test_panel_studies_match_symbols(name):
+    market_datas = make_market_datas()
+    benchmark = generate_market_data("SPY", 600)
+    panel = MarketPanel.from_market_datas(market_datas)
+    assert panel.has_gaps
+    study = STUDIES[name](panel, benchmark)
+    study.calculate()
+    panel_lines = get_lines(study.values)
+    for j, market_data in enumerate(market_datas):
+        symbol_study = STUDIES[name](market_data, benchmark)
+        symbol_study.calculate()
+        for line, values in get_lines(symbol_study.values).items():
+            np.testing.assert_allclose(panel_lines[line][:, j], panel.align(values), rtol=1e-10, err_msg=f"{name} {line} of {market_data.symbol}")
+
+def test_pack_and_unpack():
+    market_datas = make_market_datas(100)
+    panel = MarketPanel.from_market_datas(market_datas)
+    packed = panel.pack()
+    assert packed is panel.pack() and not packed.has_gaps
+    for j, market_data in enumerate(market_datas):
+        count = market_data.get_length()
+        np.testing.assert_array_equal(packed["close"][:count, j], market_data.candles["close"].to_numpy())
+        assert np.isnan(packed["close"][count:, j]).all()
+    close = packed.unpack(packed["close"])
+    np.testing.assert_array_equal(close, panel["close"])
+    np.testing.assert_array_equal(packed.unpack(packed.valid, False), panel.valid)
+
+# The portfolio of a strategy with crossovers makes the trades of the report of every symbol, when
+# some symbols miss dates too
+@pytest.mark.usefixtures("cache_directory")
+def test_strategy_panel_with_missing_dates_matches_reports():
+    market_datas = make_market_datas(1000)
+    for market_data in market_datas:
+        market_data.save()
+    symbols = [market_data.symbol for market_data in market_datas]
+    strategy_dict = get_strategy_dict(symbols)
+    strategy_dict["portfolio"] = {"positionSize": 0.05}
+    _, trades = Strategy(strategy_dict, get_fresh_data=False).simulate_portfolio()
+    reports = []
+    for symbol in symbols:
+        symbol_dict = copy.deepcopy(strategy_dict)
+        symbol_dict["marketData"][0]["symbol"] = symbol
+        reports.append(Strategy(symbol_dict, get_fresh_data=False).generate_single_report())
+    report = pd.concat(reports).sort_values(["opening-date", "symbol"], ignore_index=True)
+    trades = trades.sort_values(["opening-date", "symbol"], ignore_index=True)
+    assert (report["symbol"] == "BBB").sum() > 0
+    assert trades["symbol"].tolist() == report["symbol"].tolist()
+    assert (trades["opening-date"].to_numpy() == report["opening-date"].to_numpy()).all()
+    assert (trades["closing-date"].to_numpy() == report["closing-date"].to_numpy()).all()
+    np.testing.assert_allclose(trades["final-pl"], report["final-pl"])
+
+def test_study_cache_evicts_least_recently_used():
+    cache = studies.StudyCache(max_size=2)
+    calculated = []
+    def get(key : str) -> str:
+        return cache.get(key, lambda: calculated.append(key) or key.upper())
+    assert [get("a"), get("b"), get("a"), get("c")] == ["A", "B", "A", "C"]
+    # b was the least recently used when c was added
+    assert get("a") == "A" and get("b") == "B"
+    assert calculated == ["a", "b", "c", "b"]
+    assert cache.get_stats() == {"hits": 2, "misses": 4, "size": 2, "max_size": 2}
+
+# A study calculated again (as when it is in the opening and the closing conditions) comes from the cache
+def test_study_is_calculated_once():
+    market_data = generate_market_data("AAA", 300)
+    study = studies.SimpleMovingAverage(market_data, 20)
+    study.calculate()
+    values = study.values
+    studies.SimpleMovingAverage(market_data, 20).calculate()
+    study.calculate()
+    assert study.values is values
+    assert studies.study_cache.get_stats()["misses"] == 1 and studies.study_cache.hits == 2
+    # Other parameters, displacement or candles are other values
+    studies.SimpleMovingAverage(market_data, 10).calculate()
+    studies.SimpleMovingAverage(market_data, 20, displace=1).calculate()
+    studies.SimpleMovingAverage(generate_market_data("AAA", 300), 20).calculate()
+    assert studies.study_cache.misses == 4
+
+# The ATR of the benchmark is calculated once for all the symbols compared to it
+def test_benchmark_atr_is_calculated_once():
+    benchmark = generate_market_data("SPY", 300)
+    for symbol in ["AAA", "BBB", "CCC"]:
+        studies.RealRelativeStrength(generate_market_data(symbol, 300), benchmark, 12).calculate()
+    atr_keys = [key for key in studies.study_cache.values if key[1] == "AverageTrueRange"]
+    assert len(atr_keys) == 4
+    # The ATR of the benchmark was found in the cache by the second and third symbols
+    assert studies.study_cache.hits == 2
+    benchmark_atr = studies.AverageTrueRange.calculate(benchmark, 12, AverageType.Wilders)
+    assert studies.study_cache.hits == 3
+    assert benchmark_atr is studies.study_cache.values[studies.study_key(benchmark, "AverageTrueRange", (12, AverageType.Wilders), 0)]
+# Donchian Channels and %R of the same length take the lowest lows and highest highs from the same calculation
+@pytest.mark.parametrize("market_data", [generate_market_data("AAA", 300), MarketPanel.from_market_datas(make_market_datas(300))],
+                         ids=["market_data", "panel"])
+def test_donchian_and_percent_r_share_rolling_extrema(market_data):
+    donchian = studies.DonchianChannels(market_data, 14)
+    percent_r = studies.PercentR(market_data, 14)
+    donchian.calculate()
+    percent_r.calculate()
+    extrema_keys = [key for key in studies.study_cache.values if key[1] == "RollingExtrema"]
+    assert len(extrema_keys) == 1
+    assert studies.study_cache.hits == 1
+    studies.PercentR(market_data, 20).calculate()
+    assert len([key for key in studies.study_cache.values if key[1] == "RollingExtrema"]) == 2
+    if isinstance(market_data, MarketData):
+        lowest = market_data.candles["low"].rolling(14).min()
+        highest = market_data.candles["high"].rolling(14).max()
+        np.testing.assert_allclose(donchian.values["middle"], (lowest + highest) / 2, rtol=1e-12)
+        np.testing.assert_allclose(percent_r.values, 100 - 100 * (highest - market_data.candles["close"]) / (highest - lowest), rtol=1e-12)
+
+# Every study is registered with the parameters of the strategy files, required when they have no default
+def test_study_registry():
+    assert set(studies.STUDY_REGISTRY) == set(STUDIES)
+    assert [study.name for study in AvailableStudies] == list(studies.STUDY_REGISTRY)
+    schema = studies.get_registered_study("RealRelativeStrength").get_schema()
+    assert schema == {"marketDatas": 2, "params": {"length": {"required": True, "default": None},
+                                                   "displace": {"required": False, "default": 0}}}
+    market_data = generate_market_data("AAA", 100)
+    study = studies.create_study("BollingerBands", {"marketDatas": [market_data], "price": "high", "length": 10, "averageType": "Exponential"})
+    assert isinstance(study, studies.BollingerBands)
+    assert (study.price, study.length, study.std_devs, study.average_type) == (PriceType.High, 10, 2.0, AverageType.Exponential)
+    assert study.market_data is market_data
+
+@pytest.mark.parametrize("name, params, message", [("MovingAverage", {"marketDataIds": [0]}, "Unknown study"),
+                                                   ("RealRelativeStrength", {"marketDataIds": [0, 1]}, "needs the parameter 'length'"),
+                                                   ("RealRelativeStrength", {"marketDataIds": [0], "length": 10}, "needs 2 market data IDs"),
+                                                   ("SimpleMovingAverage", {"marketDataIds": [0], "price": "median"}, "Invalid value")])
+def test_invalid_study_parameters(name, params, message):
+    with pytest.raises(ValueError, match=message):
+        studies.get_registered_study(name).validate(params)
+
+# The RRS of a symbol against a benchmark with its own bars, computed with pandas: the move and the ATR of the
+# benchmark are taken from its last bar closed when every bar of the symbol closes
+def pandas_real_relative_strength(market_data : MarketData, benchmark : MarketData, length : int) -> np.ndarray:
+    get_atr = lambda market_data: studies.AverageTrueRange.calculate(market_data, length, AverageType.Wilders).to_numpy()
+    compared = pd.DataFrame({"close-time": get_close_times(benchmark), "move": benchmark.candles["close"].diff(length).to_numpy(),
+                             "atr": get_atr(benchmark)})
+    compared = pd.merge_asof(pd.DataFrame({"close-time": get_close_times(market_data)}), compared, on="close-time")
+    atr = get_atr(market_data)
+    move = market_data.candles["close"].diff(length).to_numpy()
+    return (move - compared["move"].to_numpy() / compared["atr"].to_numpy() * atr) / atr
+
+# A benchmark with more bars, fewer bars or missing dates, or on another timeframe, gives the RRS on the bars of the symbol
+@pytest.mark.parametrize("bars, benchmark_bars, frequency_type, frequency", [(400, 500, FrequencyType.Daily, 1),
+                                                                            (500, 400, FrequencyType.Daily, 1),
+                                                                            (600, None, FrequencyType.Daily, 1),
+                                                                            (5000, 200, FrequencyType.Minute, 5)])
+def test_real_relative_strength_with_other_bars(bars, benchmark_bars, frequency_type, frequency):
+    market_data = generate_market_data("AAA", bars, frequency_type, frequency)
+    benchmark = make_market_datas(bars)[1] if benchmark_bars is None else generate_market_data("SPY", benchmark_bars)
+    study = studies.RealRelativeStrength(market_data, benchmark, 12)
+    study.calculate()
+    assert len(study.values) == market_data.get_length() and study.values.index.equals(market_data.candles.index)
+    expected = pandas_real_relative_strength(market_data, benchmark, 12)
+    assert np.isfinite(expected[-50:]).all()
+    np.testing.assert_allclose(study.values, expected, rtol=1e-9, atol=1e-12)
+
+# The symbols of a strategy with fewer bars than the benchmark are reported, on their own and in panels
+@pytest.mark.usefixtures("cache_directory")
+def test_strategy_with_benchmark_of_other_length():
+    symbols = ["AAA", "BBB", "CCC"]
+    for symbol, bars in zip(symbols + ["SPY"], [400, 450, 1000, 1000]):
+        generate_market_data(symbol, bars).save()
+    strategy_dict = get_strategy_dict(symbols)
+    strategy_dict["marketData"].append({"symbol": "SPY", "frequency": 1, "frequencyType": "Daily"})
+    strategy_dict["studies"].append({"id": 4, "name": "RealRelativeStrength", "params": {"marketDataIds": [0, 1], "length": 12}})
+    strategy_dict["opening"]["condition"] += " & S4 > -1"
+    strategy = Strategy(strategy_dict, get_fresh_data=False)
+    strategy.generate_global_report(file_name="report.csv")
+    assert strategy.failed_symbols == {}
+    report = pd.read_csv("report.csv")
+    assert sorted(report["symbol"].unique()) == symbols
+    _, trades = Strategy(strategy_dict, get_fresh_data=False).simulate_portfolio()
+    assert sorted(trades["symbol"].unique()) == symbols
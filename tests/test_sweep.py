@@ -0,0 +1,49 @@
+from benchmarks import generate_market_data
+from strategy import Strategy
+from sweep import ParameterSweep
+
+import copy
+import instrumentation
+import numpy as np
+import pytest
+
+pytestmark = pytest.mark.usefixtures("cache_directory")
+
+# Lengths swept as a range and as a list, and a study without its optional price and displace
+STRATEGY = {"marketData": [{"symbol": "AAA, BBB", "frequency": 1, "frequencyType": "Daily"}],
+            "studies": [{"id": 0, "name": "SimpleMovingAverage", "params": {"marketDataIds": [0], "length": {"start": 5, "stop": 25, "step": 10}}},
+                        {"id": 1, "name": "WeightedMovingAverage", "params": {"marketDataIds": [0], "length": [20, 40], "price": "close", "displace": 1}},
+                        {"id": 2, "name": "PercentR", "params": {"marketDataIds": [0], "length": [7, 14], "displace": 0}}],
+            "opening": {"type": "BuyToOpen", "condition": "S0 $crosses-above$ S1 & S2 < 80"},
+            "closing": {"condition": "S0 < S1"},
+            "initialBalance": 10000}
+
+def test_sweep_matches_single_reports():
+    for symbol in ["AAA", "BBB"]:
+        generate_market_data(symbol, 1500).save()
+    results = ParameterSweep(STRATEGY, max_elements=2000, get_fresh_data=False).run()
+    assert len(results) == 2 * 3 * 2 * 2
+    for _, row in results.iterrows():
+        fixed = copy.deepcopy(STRATEGY)
+        fixed["marketData"][0]["symbol"] = row["symbol"]
+        for study_idx in range(3):
+            fixed["studies"][study_idx]["params"]["length"] = int(row[f"S{study_idx}.length"])
+        report = Strategy(fixed, get_fresh_data=False).generate_single_report()
+        assert len(report) == row["trades"]
+        assert np.isclose(report["final-pl"].sum(), row["total-pl"])
+
+# A symbol that can not be swept is left out of the results and recorded with its error
+def test_failed_symbols_are_recorded():
+    generate_market_data("AAA", 500).save()
+    strategy_dict = copy.deepcopy(STRATEGY)
+    strategy_dict["marketData"][0]["symbol"] = "AAA, MISSING"
+    sink = instrumentation.add_sink(instrumentation.MemorySink())
+    try:
+        sweep = ParameterSweep(strategy_dict, get_fresh_data=False)
+        results = sweep.run(rank_by=("trades", "total-pl"))
+    finally:
+        instrumentation.clear_sinks()
+    assert set(results["symbol"]) == {"AAA"} and len(results) == 12
+    assert results["trades"].is_monotonic_decreasing
+    assert list(sweep.failed_symbols) == ["MISSING"]
+    assert [event["counts"] for event in sink.get_events("sweep")] == [{"failed_symbols": 1}]
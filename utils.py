@@ -1,11 +1,16 @@
-from datamodels import MarketData
+from datamodels import JSONStorage, MarketData
 from enums import FrequencyType, PeriodType, PriceType
-from io import StringIO
+from resample import get_base_frequency, get_resampled
 from schwabapi import SchwabAPIClient
+from scheduler import RequestError, RequestScheduler
 
+import instrumentation
 import json
+import multiprocessing
+import multiprocessing.synchronize
 import os.path
 import pandas as pd
+import time
 
 
 def get_price(dataframe : pd.DataFrame, priceType : PriceType) -> pd.Series:
@@ -26,72 +31,197 @@ def get_price(dataframe : pd.DataFrame, priceType : PriceType) -> pd.Series:
     if (priceType == PriceType.Volume):
         return dataframe["volume"]
 
+# Client shared by every download of the current process, created on first use
+_client = None
+# Scheduler and token lock shared with other processes downloading at the same time (see share_client)
+_shared_client = None
+
+def get_client() -> SchwabAPIClient:
+    global _client
+    if (_client is None):
+        if (_shared_client is None):
+            _client = SchwabAPIClient()
+        else:
+            _client = SchwabAPIClient(scheduler=_shared_client[0], token_lock=_shared_client[1])
+    return _client
+
+# Makes the client of this process keep the rate limit and refresh the tokens together with the
+# processes started afterwards that are handed the result (to pass to use_shared_client in them),
+# instead of each process allowing itself the whole rate limit.
+def share_client() -> tuple[RequestScheduler, multiprocessing.synchronize.Lock]:
+    if (_shared_client is None):
+        use_shared_client((RequestScheduler(shared=True), multiprocessing.Lock()))
+    return _shared_client
+
+def use_shared_client(shared_client : tuple[RequestScheduler, multiprocessing.synchronize.Lock]) -> None:
+    global _client, _shared_client
+    _shared_client = shared_client
+    _client = None
+
+# Period requested from the API for every frequency type
+def get_period(frequency_type : FrequencyType, frequency : int) -> tuple[PeriodType, int, int]:
+    if (frequency_type == FrequencyType.Minute):
+        period_type = PeriodType.Day
+        period = 10 # 10 days ago
+        if (frequency not in (1, 5, 10, 15, 30)):
+            frequency = 5 # 5 min frequency as default
+    elif (frequency_type == FrequencyType.Daily):
+        frequency = 1
+        period_type = PeriodType.Year
+        period = 5 # 5 years
+    elif (frequency_type == FrequencyType.Weekly):
+        frequency = 1
+        period_type = PeriodType.Year
+        period = 5 # 5 years
+    elif (frequency_type == FrequencyType.Monthly):
+        frequency = 1
+        period_type = PeriodType.Year
+        period = 10 # 10 years
+    return (period_type, period, frequency)
+
+def load_market_data(symbol : str,
+                     frequency_type : FrequencyType,
+                     frequency : int) -> MarketData:
+    market_data = MarketData.load(symbol, frequency_type, frequency)
+    if (market_data is None):
+        # Symbols still cached as JSON are moved to the default storage the first time they are read
+        market_data = MarketData.load(symbol, frequency_type, frequency, storage=JSONStorage())
+        if (market_data is not None):
+            market_data.save()
+    return market_data
+
+# Appends freshly downloaded candles to the cached ones. The first fresh candle overlaps the last
+# cached one, which may have been saved before its bar closed, so the fresh version is kept.
+def merge_candles(cached : MarketData, fresh : MarketData) -> MarketData:
+    if (fresh.get_length() == 0):
+        return cached
+    old_candles = cached.candles[cached.candles.index < fresh.candles.index[0]]
+    candles = pd.concat([old_candles, fresh.candles])
+    return MarketData(cached.symbol, candles, cached.frequency_type, cached.frequency)
+
+# Milliseconds since the epoch of the last cached candle, used to only request the newer ones
+def get_refresh_start(market_data : MarketData) -> int:
+    if (market_data is None or market_data.get_length() == 0):
+        return None
+    return int(market_data.get_timestamps()[-1])
+
 def get_market_data(symbol : str,
                     frequency_type : FrequencyType,
                     frequency : int,
-                    get_fresh_data : bool = False) -> MarketData:
+                    get_fresh_data : bool = False,
+                    client : SchwabAPIClient = None,
+                    incremental : bool = False,
+                    derive : bool = True) -> MarketData:
+    # Frequencies that can be built from a finer series are resampled from it instead of downloaded
+    base_frequency = get_base_frequency(frequency_type, frequency) if derive else None
+    if (base_frequency is not None):
+        base_market_data = get_market_data(symbol, *base_frequency, get_fresh_data, client, incremental, derive=False)
+        return get_resampled(base_market_data, frequency_type, frequency)
     path = MarketData.get_path(frequency_type, frequency) 
-    if (get_fresh_data is False):
-        fname = path + f"\\{symbol}.json"
-        if (not os.path.isfile(fname)):
-            get_fresh_data = True
-        else:
-            with open(fname, "r") as file:
-                market_data = MarketData(symbol, pd.read_json(StringIO(file.read()), orient="index", date_unit="ms"), frequency_type, frequency)
-                market_data.candles.index = pd.to_datetime(market_data.candles.index)
-                return market_data
-    else:
-        client = SchwabAPIClient()
-        if (frequency_type == FrequencyType.Minute):
-            period_type = PeriodType.Day
-            period = 10 # 10 days ago
-            if (frequency != 1 or frequency != 5 or frequency != 10 or frequency != 15 or frequency != 30):
-                frequency = 5 # 5 min frequency as default
-        elif (frequency_type == FrequencyType.Daily):
-            frequency = 1
-            period_type = PeriodType.Year
-            period = 5 # 5 years
-        elif (frequency_type == FrequencyType.Weekly):
-            frequency = 1
-            period_type = PeriodType.Year
-            period = 5 # 5 years
-        elif (frequency_type == FrequencyType.Monthly):
-            frequency = 1
-            period_type = PeriodType.Year
-            period = 10 # 10 years
-        # Get market data without extended hours
+    cached = None
+    if (get_fresh_data is False or incremental):
+        cached = load_market_data(symbol, frequency_type, frequency)
+        if (cached is not None and get_fresh_data is False):
+            instrumentation.count("market-data", symbol, cache_hits=1)
+            return cached
+    instrumentation.count("market-data", symbol, downloads=1, refreshes=0 if cached is None else 1)
+    if (client is None):
+        client = get_client()
+    period_type, period, frequency = get_period(frequency_type, frequency)
+    # With incremental refreshes only the candles since the last cached one are requested
+    start_date = get_refresh_start(cached)
+    end_date = None if start_date is None else int(time.time() * 1000)
+    # Get market data without extended hours
+    try:
         market_data = client.get_price_history(symbol,
                                                period_type,
                                                period, frequency_type,
                                                frequency,
-                                               start_date=None,
-                                               end_date=None,
+                                               start_date=start_date,
+                                               end_date=end_date,
                                                need_extended_hours_data=False)
-        market_data.save_to_json(path=path)
-        return market_data
+    except RequestError as e:
+        if (start_date is None):
+            raise
+        print(f"Could not refresh {symbol}, using the cached candles: {e}")
+        return cached
+    if (start_date is not None):
+        # Nothing new, the cache is already up to date
+        if (market_data.get_length() == 0):
+            return cached
+        market_data = merge_candles(cached, market_data)
+        # The merged candles are a copy. Windows can not replace the cached files (see NumpyStorage.write_column)
+        # while they are still memory-mapped by the cached candles.
+        del cached
+    market_data.save(path=path)
+    return market_data
 
-def load_dynamic_enums() -> None:
-    with open("studies.py", "r") as file:
-        lines = file.readlines()
-        study_list = []
-        for line in lines:
-            study_name_index = line.find("class ")
-            if (study_name_index >= 0): # Class name was found
-                study_name_index += 6 # Start looking after 'class ' substring
-                end_index = line.find('(', study_name_index)
-                if (end_index < 0):
+# Same as get_market_data for a list of symbols, downloading the missing ones concurrently.
+# Symbols that could not be downloaded are left out of the result, with their error in errors (if given).
+def get_market_data_many(symbols : list,
+                         frequency_type : FrequencyType,
+                         frequency : int,
+                         get_fresh_data : bool = False,
+                         client : SchwabAPIClient = None,
+                         max_workers : int = 8,
+                         incremental : bool = False,
+                         derive : bool = True,
+                         errors : dict = None) -> dict[str, MarketData]:
+    base_frequency = get_base_frequency(frequency_type, frequency) if derive else None
+    if (base_frequency is not None):
+        base_market_datas = get_market_data_many(symbols, *base_frequency, get_fresh_data, client, max_workers, incremental, derive=False, errors=errors)
+        return {symbol: get_resampled(market_data, frequency_type, frequency) for symbol, market_data in base_market_datas.items()}
+    path = MarketData.get_path(frequency_type, frequency)
+    market_datas = {}
+    cached = {}
+    if (get_fresh_data is False or incremental):
+        for symbol in symbols:
+            market_data = load_market_data(symbol, frequency_type, frequency)
+            if (market_data is not None):
+                cached[symbol] = market_data
+        if (get_fresh_data is False):
+            market_datas = cached
+            cached = {}
+    missing = [symbol for symbol in symbols if symbol not in market_datas]
+    instrumentation.count("market-data", cache_hits=len(market_datas), downloads=len(missing), refreshes=len(cached))
+    if (len(missing) > 0):
+        if (client is None):
+            client = get_client()
+        period_type, period, frequency = get_period(frequency_type, frequency)
+        start_dates = {}
+        for symbol in missing:
+            start_date = get_refresh_start(cached.get(symbol))
+            if (start_date is not None):
+                start_dates[symbol] = start_date
+        download_errors = {}
+        downloaded = client.get_price_history_many(missing,
+                                                   period_type,
+                                                   period,
+                                                   frequency_type,
+                                                   frequency,
+                                                   start_date=start_dates,
+                                                   end_date=int(time.time() * 1000) if len(start_dates) > 0 else None,
+                                                   need_extended_hours_data=False,
+                                                   max_workers=max_workers,
+                                                   errors=download_errors)
+        instrumentation.count("market-data", failures=len(download_errors))
+        for symbol in missing:
+            market_data = downloaded.get(symbol)
+            if (symbol in start_dates):
+                if (market_data is None):
+                    print(f"Could not refresh {symbol}, using the cached candles")
+                    market_datas[symbol] = cached[symbol]
                     continue
-                study_list.append(line[study_name_index:end_index])
-    enum_template = """from enum import Enum
-
-class AvailableStudies(Enum):
-\t{enum_body}"""
-
-    enum_body = ""
-    for i in range(len(study_list)):
-        enum_body += study_list[i] + " = " + str(i) + "\n\t"
-    
-    enum_template = enum_template.format(enum_body=enum_body)
-    with open("dynamic_enums.py", "w") as file:
-        file.write(enum_template)
-
+                # Nothing new, the cache is already up to date
+                if (market_data.get_length() == 0):
+                    market_datas[symbol] = cached.pop(symbol)
+                    continue
+                market_data = merge_candles(cached.pop(symbol), market_data)
+            elif (market_data is None):
+                if (errors is not None):
+                    errors[symbol] = download_errors[symbol]
+                continue
+            market_data.save(path=path)
+            market_datas[symbol] = market_data
+    # Keep the order of the symbols list
+    return {symbol: market_datas[symbol] for symbol in symbols if symbol in market_datas}